@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+# Names of the caches that answered with stale data during the current render, see track_stale().
+_stale_reads = contextvars.ContextVar("stale_reads", default=None)
+
+@contextlib.contextmanager
+def track_stale():
+    """Collects the names of caches that serve stale data inside the block.
+
+    Nested blocks share the outermost list, so a command can cover both its search and its render.
+    """
+    reads = _stale_reads.get()
+    if reads is not None:
+        yield reads
+        return
+    reads = []
+    token = _stale_reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _stale_reads.reset(token)
+
+def note_stale(name: str):
+    """Records that the cache (or store) called name served stale data, for the enclosing track_stale() block."""
+    reads = _stale_reads.get()
+    if reads is not None:
+        reads.append(name)
+
+# Every named cache in the bot, so their counters can be reported by admin commands.
+registry = {}
+
+def register(cache):
+    """Adds a cache (anything with a name and a stats() method) to the registry."""
+    registry[cache.name] = cache
+    return cache
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single in-flight call.
+
+    The first caller starts the work, later callers for the same key wait for its result
+    instead of repeating the upstream call. The work runs at the most urgent upstream priority
+    class among the callers waiting on it, see upstream.SharedPriority.
+    """
+    def __init__(self):
+        self._inflight = {} # key -> (future, SharedPriority)
+        self.coalesced = 0
+
+    async def do(self, key, fetch):
+        """Returns the result of await fetch(), sharing it with concurrent callers using the same key."""
+        import upstream # Not at the top, upstream imports metrics, which imports this module.
+        entry = self._inflight.get(key)
+        if entry is None:
+            shared = upstream.SharedPriority()
+            with shared.applied():
+                future = asyncio.ensure_future(fetch())
+            self._inflight[key] = (future, shared)
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            future, shared = entry
+            shared.join()
+            self.coalesced += 1
+        # Shielded so one cancelled interaction doesn't cancel the call for everyone else waiting on it.
+        return await asyncio.shield(future)
+
+
+class TTLCache:
+    """A bounded in-process LRU cache whose entries expire after a fixed time-to-live.
+
+    Entries are evicted least-recently-used first once maxsize is reached. Hit, miss and
+    eviction counters are kept so cache effectiveness can be inspected at runtime.
+
+    Expired entries are kept until evicted. If fetching a fresh value raises one of the
+    stale_if_error exceptions, get_or_fetch() serves the expired value instead (stale-if-error)
+    as long as it expired less than max_stale seconds ago.
+    """
+    def __init__(self, name: str, maxsize: int = 256, ttl: float = 300, stale_if_error: tuple = (),
+                 max_stale: float = 24 * 3600):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_if_error = stale_if_error
+        self.max_stale = max_stale
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0 # Stale values served because the upstream call failed
+        self._flight = SingleFlight()
+        register(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Returns the cached value for key, or default if it is missing or expired."""
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return default
+
+    def get_stale(self, key, default=None):
+        """Returns the value for key even if it has expired, or default if there is none usable."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] + self.max_stale <= time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        """Stores value under key, evicting the least recently used entries if the cache is full."""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key, fetch):
+        """Returns the cached value for key, or awaits fetch() once (even for concurrent callers) and caches it."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        return await self.fetch_or_stale(key, fetch)
+
+    async def fetch_or_stale(self, key, fetch):
+        """Awaits fetch() once (even for concurrent callers) and caches the result, without a cache lookup.
+
+        Serves the stored value instead if the fetch raises one of the stale_if_error exceptions, so a
+        cache used only as a fallback while the upstream is unreachable doesn't count every call as a miss.
+        """
+        async def fetch_and_store():
+            result = await fetch()
+            self.set(key, result)
+            return result
+        try:
+            return await self._flight.do(key, fetch_and_store)
+        except self.stale_if_error:
+            value = self.get_stale(key, _MISSING)
+            if value is _MISSING:
+                raise
+            self.stale += 1
+            note_stale(self.name)
+            return value
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the cache counters."""
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self._flight.coalesced,
+            "stale": self.stale,
+            "hit_rate": self.hit_rate,
+        }
@@ -1,47 +1,54 @@
 import discord
 from discord.ext import commands
 from discord import app_commands # Added for slash commands
-from urllib.parse import urlencode, quote
-import requests
 
 # Ensure utils.py can be imported from the parent directory.
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import create_embed_for_item, PaginationView, get_linked_user
+from upstream import UpstreamError
+from cache import track_stale
+from tracing import span
+from pages import MediaPageButton, open_search_source, open_discover_source, render_media_page
+from media_index import media_status
+from submissions import submissions
 
 class MediaCommandsCog(commands.Cog):
-    def __init__(self, bot, jellyseerr_url, jellyseerr_headers):
+    def __init__(self, bot, jellyseerr):
         self.bot = bot
-        self.jellyseerr_url = jellyseerr_url
-        self.jellyseerr_headers = jellyseerr_headers
+        self.jellyseerr = jellyseerr # Shared UpstreamClient for Jellyseerr
+
+    async def cog_load(self):
+        # Keeps the local media status index synced so results show availability without upstream calls
+        media_status.start(self.jellyseerr)
+        submissions.start(self.jellyseerr)
+
+    def cog_unload(self):
+        media_status.stop()
+        submissions.stop()
 
     @app_commands.command(name="request", description="Search for a movie or TV show")
     async def request_cmd(self, interaction: discord.Interaction, query: str):
         """Searches for media on Jellyseerr and displays results with pagination."""
-        await interaction.response.defer()
-
-        search_url_path = "/api/v1/search"
-        full_search_url = f"{self.jellyseerr_url}{search_url_path}"
-        params = urlencode({"query": query}, quote_via=quote)
+        with span("discord.defer"):
+            await interaction.response.defer()
 
         try:
-            response = requests.get(f"{full_search_url}?{params}", headers=self.jellyseerr_headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            results = data.get("results", [])
+            # Stale results served during the search are flagged on the rendered page too
+            with track_stale():
+                key, source = await open_search_source(self.jellyseerr, query)
+                # The view only carries the source key, pages are rebuilt from the shared source on each press
+                page = await render_media_page(self.jellyseerr, key, 0, source)
 
-            if not results:
+            if page is None:
                 await interaction.followup.send("No results found for your query.")
                 return
 
-            # Pass JELLYSEERR_URL and headers to the PaginationView
-            view = PaginationView(results, self.jellyseerr_url, self.jellyseerr_headers)
-            initial_embed = create_embed_for_item(results[0], 0, len(results))
-
-            await interaction.followup.send(embed=initial_embed, view=view)
+            initial_embed, view = page
+            with span("discord.send"):
+                await interaction.followup.send(embed=initial_embed, view=view)
 
-        except requests.exceptions.RequestException as e:
+        except UpstreamError as e:
             await interaction.followup.send(f"An error occurred while searching: {e}")
         except Exception as e: # Catch any other unexpected errors
             await interaction.followup.send(f"An unexpected error occurred: {e}")
@@ -50,49 +57,34 @@ class MediaCommandsCog(commands.Cog):
     @app_commands.command(name="discover", description="Discover new movies or TV shows")
     async def discover_cmd(self, interaction: discord.Interaction):
         """Discovers new movies or TV shows from Jellyseerr."""
-        await interaction.response.defer()
+        with span("discord.defer"):
+            await interaction.response.defer()
         try:
-            # Define API paths
-            movies_discover_path = "/api/v1/discover/movies"
-            tv_discover_path = "/api/v1/discover/tv"
-
-            # Make requests
-            movie_response = requests.get(f"{self.jellyseerr_url}{movies_discover_path}", headers=self.jellyseerr_headers, timeout=10)
-            tv_response = requests.get(f"{self.jellyseerr_url}{tv_discover_path}", headers=self.jellyseerr_headers, timeout=10)
-
-            movie_response.raise_for_status()
-            tv_response.raise_for_status()
-
-            movies = movie_response.json().get("results", [])
-            tv_shows = tv_response.json().get("results", [])
-
-            popular_items = movies + tv_shows
-            if not popular_items:
+            # Movies and TV are fetched concurrently, further pages load lazily as the user pages forward
+            key, source = await open_discover_source(self.jellyseerr)
+            page = await render_media_page(self.jellyseerr, key, 0, source)
+            if page is None:
                 await interaction.followup.send("No popular items found to discover.")
                 return
 
-            # Pass JELLYSEERR_URL and headers to the PaginationView
-            view = PaginationView(popular_items, self.jellyseerr_url, self.jellyseerr_headers)
-            initial_embed = create_embed_for_item(popular_items[0], 0, len(popular_items))
-            await interaction.followup.send(embed=initial_embed, view=view)
+            initial_embed, view = page
+            with span("discord.send"):
+                await interaction.followup.send(embed=initial_embed, view=view)
 
-        except requests.exceptions.RequestException as e:
+        except UpstreamError as e:
             await interaction.followup.send(f"An error occurred while fetching popular items: {e}")
         except Exception as e: # Catch any other unexpected errors
             await interaction.followup.send(f"An unexpected error occurred during discovery: {e}")
 
 async def setup(bot):
     # This function is called by discord.py when loading the cog.
-    # It retrieves necessary configuration (JELLYSEERR_URL, JELLYSEERR_API_KEY)
+    # It retrieves the shared Jellyseerr client created in JellyBot.setup_hook
     # from the bot instance and initializes the cog.
-    jellyseerr_url = getattr(bot, 'JELLYSEERR_URL', None)
-    jellyseerr_api_key = getattr(bot, 'JELLYSEERR_API_KEY', None)
+    jellyseerr = getattr(bot, 'jellyseerr', None)
 
-    if not jellyseerr_url or not jellyseerr_api_key:
-        raise ValueError("JELLYSEERR_URL and JELLYSEERR_API_KEY must be set on the bot instance to load MediaCommandsCog.")
+    if jellyseerr is None:
+        raise ValueError("The Jellyseerr client must be set on the bot instance to load MediaCommandsCog.")
 
-    jellyseerr_headers = {
-        "X-Api-Key": jellyseerr_api_key,
-        "Content-Type": "application/json"
-    }
-    await bot.add_cog(MediaCommandsCog(bot, jellyseerr_url, jellyseerr_headers))
+    # Persistent result buttons are dispatched by custom_id, even for messages sent before a restart
+    bot.add_dynamic_items(MediaPageButton)
+    await bot.add_cog(MediaCommandsCog(bot, jellyseerr))
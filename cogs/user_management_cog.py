@@ -1,7 +1,9 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
-import requests
+import asyncio
+import heapq
+import random
 import re
 import secrets
 from datetime import datetime, timedelta
@@ -10,86 +12,237 @@ from datetime import datetime, timedelta
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import store_linked_user, get_linked_user, delete_linked_user, get_all_expiring_users
+from utils import (store_linked_user, get_linked_user, delete_linked_user,
+                   get_due_expirations, get_upcoming_expirations,
+                   create_expiration_jobs, get_pending_expiration_jobs, complete_expiration_step,
+                   record_expiration_failure, is_expiration_due, cancel_expiration_job, finish_expiration_job)
+from upstream import UpstreamError, priority, BACKGROUND
+from user_directory import JellyseerrUserDirectory
+from tracing import span
+from leader import leadership
+
+# Number of upcoming expirations kept in the in-memory heap, the rest stay in SQLite until needed.
+EXPIRATION_HEAP_SIZE = 256
+# Upper bound on how long the scheduler sleeps before re-reading upcoming expirations from SQLite.
+EXPIRATION_RESYNC_SECONDS = 6 * 3600
+# Same bound when several workers share the database: grants made by other workers are only seen on a re-read.
+EXPIRATION_SHARED_RESYNC_SECONDS = 300
+# Number of expirations processed concurrently.
+EXPIRATION_WORKERS = 4
+# Attempts per expiration step, with exponential backoff starting at EXPIRATION_RETRY_BASE_SECONDS.
+EXPIRATION_STEP_ATTEMPTS = 3
+EXPIRATION_RETRY_BASE_SECONDS = 2
+# Delay before jobs that exhausted their step attempts are tried again.
+EXPIRATION_RETRY_SECONDS = 15 * 60
+# Steps of an expiration job, in order. Completed steps are journaled in the expiration_jobs table.
+EXPIRATION_STEPS = ("role", "jellyfin", "notify", "unlink")
 
 class UserManagementCog(commands.Cog):
-    def __init__(self, bot, jellyseerr_url, jellyseerr_headers, jellyfin_url, jellyfin_headers):
+    def __init__(self, bot, jellyseerr, jellyfin):
         self.bot = bot
-        self.jellyseerr_url = jellyseerr_url
-        self.jellyseerr_headers = jellyseerr_headers
-        self.jellyfin_url = jellyfin_url
-        self.jellyfin_headers = jellyfin_headers
-        self.check_expired_users.start()
+        self.jellyseerr = jellyseerr # Shared UpstreamClient for Jellyseerr
+        self.jellyfin = jellyfin # Shared UpstreamClient for Jellyfin
+        # Local index of Jellyseerr users used by /link, refreshed in the background
+        self.user_directory = JellyseerrUserDirectory(jellyseerr)
+        # Min-heap of (expires_at, discord_id). Every expiration up to _expiry_horizon is in the heap,
+        # later ones are loaded from SQLite once the heap drains. A horizon of None means "everything".
+        self._expiry_heap = []
+        self._expiry_horizon = None
+        self._retry_at = None # When jobs that failed are tried again, kept apart from the heap so refills keep it
+        self._expiry_wakeup = asyncio.Event()
+        self._expiry_task = None
+
+    async def cog_load(self):
+        # Expirations queue behind interactive commands for Jellyfin and Jellyseerr capacity
+        with priority(BACKGROUND):
+            self._expiry_task = asyncio.create_task(self._expiration_loop())
+        self.user_directory.start()
 
     def cog_unload(self):
-        self.check_expired_users.cancel()
-
-    @tasks.loop(hours=24)
-    async def check_expired_users(self):
-        now = datetime.utcnow()
-        expiring_users = get_all_expiring_users()
-        for user_row in expiring_users:
-            # Unpack with None defaults for backward compatibility
-            discord_id, jellyfin_user_id, expires_at_str, guild_id, role_name = (*user_row, None, None)[:5]
+        if self._expiry_task:
+            self._expiry_task.cancel()
+        self.user_directory.stop()
+
+    def schedule_expiration(self, discord_id: str, expires_at: datetime):
+        """Adds a new /trial or /vip grant to the scheduler and wakes it if this is the next deadline."""
+        if self._expiry_horizon is not None and expires_at > self._expiry_horizon:
+            return # Will be picked up from SQLite when the heap is refilled.
+        heapq.heappush(self._expiry_heap, (expires_at, discord_id))
+        if self._expiry_heap[0] == (expires_at, discord_id):
+            self._expiry_wakeup.set()
+
+    async def _refill_expiry_heap(self):
+        rows = await get_upcoming_expirations(EXPIRATION_HEAP_SIZE)
+        heap = []
+        for discord_id, expires_at_str in rows:
+            try:
+                heap.append((datetime.fromisoformat(expires_at_str), discord_id))
+            except (TypeError, ValueError):
+                print(f"Ignoring invalid expiration date '{expires_at_str}' for user {discord_id}.")
+        heapq.heapify(heap)
+        self._expiry_heap = heap
+        self._expiry_horizon = max(heap)[0] if len(rows) >= EXPIRATION_HEAP_SIZE and heap else None
+
+    async def _expiration_loop(self):
+        """Sleeps until the next expiration deadline and processes the users that are due."""
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                # With several workers only the one holding the lease processes expirations.
+                await leadership.wait_until_leader()
+                await self._refill_expiry_heap()
+                resync_seconds = EXPIRATION_SHARED_RESYNC_SECONDS if leadership.shared else EXPIRATION_RESYNC_SECONDS
+                resync_at = datetime.utcnow() + timedelta(seconds=resync_seconds)
+                while self._expiry_heap or self._expiry_horizon is None:
+                    now = datetime.utcnow()
+                    if now >= resync_at:
+                        break
+                    deadlines = [resync_at]
+                    if self._expiry_heap:
+                        deadlines.append(self._expiry_heap[0][0])
+                    if self._retry_at is not None:
+                        deadlines.append(self._retry_at)
+                    next_deadline = min(deadlines)
+                    if next_deadline > now:
+                        self._expiry_wakeup.clear()
+                        timeout = (next_deadline - now).total_seconds()
+                        try:
+                            await asyncio.wait_for(self._expiry_wakeup.wait(), timeout=timeout)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    # Drop every heap entry that is due; SQLite decides who is actually still expiring.
+                    while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                        heapq.heappop(self._expiry_heap)
+                    if self._retry_at is not None and self._retry_at <= now:
+                        self._retry_at = None
+                    if not leadership.is_leader:
+                        break
+                    await self.check_expired_users(now)
+                    if not self._expiry_heap and self._expiry_horizon is not None:
+                        break # Load the next batch of upcoming expirations.
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"An unexpected error occurred in the expiration scheduler: {e}")
+                await asyncio.sleep(60)
+
+    async def check_expired_users(self, now: datetime = None):
+        """Journals every user whose expiration date has passed and runs all pending expiration jobs.
+
+        Jobs left unfinished by a failure or a restart are resumed from their first incomplete step.
+        """
+        now = now or datetime.utcnow()
+        due_users = await get_due_expirations(now.isoformat())
+        if due_users:
+            await create_expiration_jobs(due_users)
+        jobs = await get_pending_expiration_jobs()
+        if not jobs:
+            return
 
-            if not expires_at_str:
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        failed_ids = []
+
+        async def worker():
+            while not queue.empty():
+                job = queue.get_nowait()
+                if not await self._process_expiration_job(*job):
+                    failed_ids.append(job[0])
+
+        await asyncio.gather(*(worker() for _ in range(min(EXPIRATION_WORKERS, len(jobs)))))
+        print(f"Processed {len(jobs)} expiration job(s), {len(failed_ids)} failed.")
+        if failed_ids:
+            # Wake the scheduler again later to resume the failed jobs, however far the heap reaches.
+            self._retry_at = datetime.utcnow() + timedelta(seconds=EXPIRATION_RETRY_SECONDS)
+
+    async def _process_expiration_job(self, discord_id, jellyfin_user_id, guild_id, role_name, completed_steps, attempts) -> bool:
+        """Runs the remaining steps of one expiration job. Returns False if a step failed."""
+        completed = [step for step in completed_steps.split(",") if step]
+        step_functions = {
+            "role": lambda: self._remove_expired_role(discord_id, guild_id, role_name),
+            "jellyfin": lambda: self._disable_jellyfin_user(discord_id, jellyfin_user_id),
+            "notify": lambda: self._notify_expired_user(discord_id),
+            "unlink": lambda: finish_expiration_job(discord_id),
+        }
+        for step in EXPIRATION_STEPS:
+            if step in completed:
                 continue
-            expires_at = datetime.fromisoformat(expires_at_str)
+            # /trial or /vip may have extended the user since the job was journaled, or while it was retrying.
+            if not await is_expiration_due(discord_id, datetime.utcnow().isoformat()):
+                await cancel_expiration_job(discord_id)
+                print(f"Cancelled the expiration of user {discord_id}, their access was extended.")
+                return True
+            try:
+                await self._run_expiration_step(discord_id, step, step_functions[step])
+            except Exception as e:
+                print(f"Expiration step '{step}' failed for user {discord_id} (job attempt {attempts + 1}): {e}")
+                await record_expiration_failure(discord_id, f"{step}: {e}")
+                return False
+            if step != "unlink": # The unlink step removes the job itself.
+                completed.append(step)
+                await complete_expiration_step(discord_id, completed)
+        print(f"Unlinked expired user: {discord_id}")
+        return True
+
+    async def _run_expiration_step(self, discord_id: str, step: str, step_function):
+        """Runs one expiration step, retrying transient upstream and Discord errors with exponential backoff."""
+        for attempt in range(1, EXPIRATION_STEP_ATTEMPTS + 1):
+            try:
+                return await step_function()
+            except (UpstreamError, discord.HTTPException) as e:
+                if attempt == EXPIRATION_STEP_ATTEMPTS:
+                    raise
+                delay = EXPIRATION_RETRY_BASE_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                print(f"Expiration step '{step}' for user {discord_id} failed (attempt {attempt}): {e}. Retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+
+    async def _remove_expired_role(self, discord_id: str, guild_id: str, role_name: str):
+        if not (guild_id and role_name):
+            return
+        guild = self.bot.get_guild(int(guild_id))
+        if not guild:
+            # The guild may be on a shard run by another worker, fetch it over REST instead.
+            try:
+                guild = await self.bot.fetch_guild(int(guild_id))
+            except (discord.NotFound, discord.Forbidden):
+                print(f"Guild {guild_id} not found for user {discord_id}.")
+                return
+        role = discord.utils.get(guild.roles, name=role_name)
+        if not role:
+            print(f"Role '{role_name}' not found in guild {guild_id} for user {discord_id}.")
+            return
+        try:
+            member = await guild.fetch_member(int(discord_id))
+            await member.remove_roles(role)
+            print(f"Removed role '{role_name}' from user {discord_id}.")
+        except discord.Forbidden:
+            print(f"Bot lacks permissions to remove role '{role_name}' for user {discord_id} in guild {guild_id}.")
+        except discord.NotFound:
+            print(f"Member {discord_id} not found in guild {guild_id} for role removal.")
 
-            if now >= expires_at:
-                try:
-                    # --- Role Removal ---
-                    if guild_id and role_name:
-                        try:
-                            guild = self.bot.get_guild(int(guild_id))
-                            if guild:
-                                role = discord.utils.get(guild.roles, name=role_name)
-                                if role:
-                                    member = await guild.fetch_member(int(discord_id))
-                                    if member:
-                                        await member.remove_roles(role)
-                                        print(f"Removed role '{role_name}' from user {discord_id}.")
-                                else:
-                                    print(f"Role '{role_name}' not found in guild {guild_id} for user {discord_id}.")
-                            else:
-                                print(f"Guild {guild_id} not found for user {discord_id}.")
-                        except discord.Forbidden:
-                            print(f"Bot lacks permissions to remove role '{role_name}' for user {discord_id} in guild {guild_id}.")
-                        except discord.NotFound:
-                             print(f"Member {discord_id} not found in guild {guild_id} for role removal.")
-                        except Exception as e:
-                            print(f"An error occurred during role removal for {discord_id}: {e}")
-
-
-                    # --- Disable in Jellyfin ---
-                    policy_url = f"{self.jellyfin_url}/Users/{jellyfin_user_id}/Policy"
-                    response = requests.get(policy_url, headers=self.jellyfin_headers, timeout=10)
-                    response.raise_for_status()
-                    policy = response.json()
-                    policy['EnableMediaPlayback'] = False
-                    requests.post(policy_url, headers=self.jellyfin_headers, json=policy, timeout=10).raise_for_status()
-                    print(f"Disabled Jellyfin access for expired user: {discord_id}")
-
-                    # --- Notify user and cleanup DB ---
-                    try:
-                        user = await self.bot.fetch_user(int(discord_id))
-                        await user.send("Your temporary access to the media server has expired, and any associated roles have been removed.")
-                    except discord.NotFound:
-                        print(f"Could not find Discord user {discord_id} to notify of expiration.")
-                    except discord.Forbidden:
-                        print(f"Could not DM user {discord_id} about expiration.")
-
-                    delete_linked_user(discord_id)
-                    print(f"Unlinked expired user: {discord_id}")
-
-                except requests.exceptions.RequestException as e:
-                    print(f"Failed to disable expired user {discord_id} in Jellyfin: {e}")
-                except Exception as e:
-                    print(f"An unexpected error occurred while processing expiration for user {discord_id}: {e}")
+    async def _disable_jellyfin_user(self, discord_id: str, jellyfin_user_id: str):
+        policy_path = f"/Users/{jellyfin_user_id}/Policy"
+        try:
+            policy = await self.jellyfin.get_json(policy_path)
+        except UpstreamError as e:
+            if e.status == 404:
+                print(f"Jellyfin user {jellyfin_user_id} for expired user {discord_id} no longer exists.")
+                return
+            raise
+        policy['EnableMediaPlayback'] = False
+        (await self.jellyfin.post(policy_path, json=policy)).raise_for_status()
+        print(f"Disabled Jellyfin access for expired user: {discord_id}")
 
-    @check_expired_users.before_loop
-    async def before_check_expired_users(self):
-        await self.bot.wait_until_ready()
+    async def _notify_expired_user(self, discord_id: str):
+        try:
+            user = await self.bot.fetch_user(int(discord_id))
+            await user.send("Your temporary access to the media server has expired, and any associated roles have been removed.")
+        except discord.NotFound:
+            print(f"Could not find Discord user {discord_id} to notify of expiration.")
+        except discord.Forbidden:
+            print(f"Could not DM user {discord_id} about expiration.")
 
     async def _create_user(self, interaction: discord.Interaction, user: discord.Member, duration_days: int = None, role_name_to_assign: str = None):
         """A helper function to create a user in Jellyfin and Jellyseerr, with an optional expiration."""
@@ -105,23 +258,23 @@ class UserManagementCog(commands.Cog):
                             "EnableMediaPlayback": True, "EnableLiveTvAccess": False,
                             "EnableLiveTvManagement": False }
             }
-            response_fin = requests.post(f"{self.jellyfin_url}/Users/New", headers=self.jellyfin_headers, json=jellyfin_user_payload, timeout=10)
-            if response_fin.status_code == 400 and "User with the same name already exists" in response_fin.text:
+            response_fin = await self.jellyfin.post("/Users/New", json=jellyfin_user_payload)
+            if response_fin.status == 400 and "User with the same name already exists" in response_fin.text:
                 await interaction.followup.send(f"⚠️ User '{username}' already exists in Jellyfin.", ephemeral=True)
                 return
             response_fin.raise_for_status()
             jellyfin_user_id = response_fin.json().get("Id")
-        except requests.exceptions.RequestException as e:
+        except UpstreamError as e:
             await interaction.followup.send(f"❌ Failed to create Jellyfin user: {e}", ephemeral=True)
             return
 
         # Import User to Jellyseerr
         try:
-            response_seerr_import = requests.post(f"{self.jellyseerr_url}/api/v1/user/import-from-jellyfin",
-                                                 headers=self.jellyseerr_headers, json={"jellyfinUserIds": [jellyfin_user_id]}, timeout=10)
-            response_seerr_import.raise_for_status()
-            jellyseerr_user = response_seerr_import.json()[0]
-        except requests.exceptions.RequestException as e:
+            imported_users = await self.jellyseerr.post_json("/api/v1/user/import-from-jellyfin",
+                                                             json={"jellyfinUserIds": [jellyfin_user_id]})
+            jellyseerr_user = imported_users[0]
+            self.user_directory.add(jellyseerr_user)
+        except UpstreamError as e:
             await interaction.followup.send(f"❌ Failed to import to Jellyseerr: {e}", ephemeral=True)
             return
 
@@ -142,7 +295,7 @@ class UserManagementCog(commands.Cog):
 
         # Store linked user
         expires_at = datetime.utcnow() + timedelta(days=duration_days) if duration_days else None
-        store_linked_user(
+        await store_linked_user(
             discord_id=str(user.id),
             jellyseerr_user_id=str(jellyseerr_user.get("id")),
             jellyfin_user_id=str(jellyfin_user_id),
@@ -151,6 +304,8 @@ class UserManagementCog(commands.Cog):
             guild_id=str(interaction.guild.id) if role_name_to_assign else None,
             role_name=role_name_to_assign
         )
+        if expires_at:
+            self.schedule_expiration(str(user.id), expires_at)
 
         # DM Credentials
         try:
@@ -160,8 +315,8 @@ class UserManagementCog(commands.Cog):
                 f"**Username:** `{username}`\n"
                 f"**Temporary Password:** `{temp_password}`\n\n"
                 f"Please change your password after logging in.\n\n"
-                f"🔗 Jellyfin: {self.jellyfin_url}\n"
-                f"🔗 Jellyseerr: {self.jellyseerr_url}\n\n"
+                f"🔗 Jellyfin: {self.jellyfin.base_url}\n"
+                f"🔗 Jellyseerr: {self.jellyseerr.base_url}\n\n"
             )
             if duration_days:
                 dm_message += f"**Note:** This is a temporary account that will expire in {duration_days} days."
@@ -190,18 +345,18 @@ class UserManagementCog(commands.Cog):
 
     @app_commands.command(name="link", description="Link your Discord account to your Jellyfin/Jellyseerr user")
     async def link_cmd(self, interaction: discord.Interaction, jellyfin_username: str, password: str):
-        await interaction.response.defer(ephemeral=True)
+        with span("discord.defer"):
+            await interaction.response.defer(ephemeral=True)
 
         # Authenticate with Jellyfin
         jellyfin_user_id = None
         try:
             auth_payload = {"Username": jellyfin_username, "Pw": password}
-            jellyfin_auth_url = f"{self.jellyfin_url}/Users/AuthenticateByName"
             # Note: Jellyfin's AuthenticateByName might not require X-Emby-Token if it's for initial auth.
-            # However, if the server is locked down, it might. The original code included it.
-            auth_response = requests.post(jellyfin_auth_url, json=auth_payload, headers=self.jellyfin_headers, timeout=10)
+            # However, if the server is locked down, it might. The shared client always sends it.
+            auth_response = await self.jellyfin.post("/Users/AuthenticateByName", json=auth_payload)
 
-            if auth_response.status_code == 401:
+            if auth_response.status == 401:
                 await interaction.followup.send("❌ **Authentication Failed:** Invalid Jellyfin username or password.", ephemeral=True)
                 return
             auth_response.raise_for_status()
@@ -210,7 +365,7 @@ class UserManagementCog(commands.Cog):
             if not jellyfin_user_id:
                 await interaction.followup.send("❌ **Error:** Could not retrieve Jellyfin User ID after authentication.", ephemeral=True)
                 return
-        except requests.exceptions.RequestException as e:
+        except UpstreamError as e:
             await interaction.followup.send(f"❌ An error occurred while trying to authenticate with Jellyfin: {e}", ephemeral=True)
             return
 
@@ -218,12 +373,7 @@ class UserManagementCog(commands.Cog):
         jellyseerr_user_id_for_link = None
         jellyseerr_username = None # To store the username from Jellyseerr if found
         try:
-            seerr_users_url = f"{self.jellyseerr_url}/api/v1/user?take=1000" # Get many users, default is 20
-            seerr_response = requests.get(seerr_users_url, headers=self.jellyseerr_headers, timeout=10)
-            seerr_response.raise_for_status()
-            seerr_users = seerr_response.json().get("results", [])
-
-            found_seerr_user = next((u for u in seerr_users if str(u.get("jellyfinUserId")) == str(jellyfin_user_id)), None)
+            found_seerr_user = await self.user_directory.find_by_jellyfin_id(jellyfin_user_id)
 
             if not found_seerr_user:
                 await interaction.followup.send(
@@ -235,7 +385,7 @@ class UserManagementCog(commands.Cog):
             jellyseerr_user_id_for_link = found_seerr_user.get("id")
             jellyseerr_username = found_seerr_user.get("username") or found_seerr_user.get("jellyfinUsername") or jellyfin_username
 
-        except requests.exceptions.RequestException as e:
+        except UpstreamError as e:
             await interaction.followup.send(f"❌ Failed to fetch users from Jellyseerr: {e}", ephemeral=True)
             return
 
@@ -244,7 +394,7 @@ class UserManagementCog(commands.Cog):
              return
 
         # Store the linked user in the database
-        store_linked_user(
+        await store_linked_user(
             discord_id=str(interaction.user.id),
             jellyseerr_user_id=str(jellyseerr_user_id_for_link),
             jellyfin_user_id=str(jellyfin_user_id), # Storing this for completeness
@@ -255,25 +405,20 @@ class UserManagementCog(commands.Cog):
     @app_commands.command(name="unlink", description="Unlink your Discord account from Jellyseerr/Jellyfin")
     async def unlink_cmd(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        linked_user = get_linked_user(str(interaction.user.id))
+        linked_user = await get_linked_user(str(interaction.user.id))
         if not linked_user:
             await interaction.followup.send("⚠️ You haven't linked your account yet.", ephemeral=True)
             return
 
-        delete_linked_user(str(interaction.user.id))
+        await delete_linked_user(str(interaction.user.id))
         await interaction.followup.send("✅ Unlinked your Discord account successfully.", ephemeral=True)
 
 
 async def setup(bot):
-    jellyseerr_url = getattr(bot, 'JELLYSEERR_URL', None)
-    jellyseerr_api_key = getattr(bot, 'JELLYSEERR_API_KEY', None)
-    jellyfin_url = getattr(bot, 'JELLYFIN_URL', None)
-    jellyfin_api_key = getattr(bot, 'JELLYFIN_API_KEY', None)
-
-    if not all([jellyseerr_url, jellyseerr_api_key, jellyfin_url, jellyfin_api_key]):
-        raise ValueError("JELLYSEERR_URL, JELLYSEERR_API_KEY, JELLYFIN_URL, and JELLYFIN_API_KEY must be set on the bot instance to load UserManagementCog.")
+    jellyseerr = getattr(bot, 'jellyseerr', None)
+    jellyfin = getattr(bot, 'jellyfin', None)
 
-    jellyseerr_headers = {"X-Api-Key": jellyseerr_api_key, "Content-Type": "application/json"}
-    jellyfin_headers = {"X-Emby-Token": jellyfin_api_key, "Content-Type": "application/json"}
+    if jellyseerr is None or jellyfin is None:
+        raise ValueError("The Jellyseerr and Jellyfin clients must be set on the bot instance to load UserManagementCog.")
 
-    await bot.add_cog(UserManagementCog(bot, jellyseerr_url, jellyseerr_headers, jellyfin_url, jellyfin_headers))
+    await bot.add_cog(UserManagementCog(bot, jellyseerr, jellyfin))
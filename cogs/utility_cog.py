@@ -1,21 +1,52 @@
 import discord
 from discord.ext import commands
 from discord import app_commands # Added for slash commands
-import requests
 
 # Ensure utils.py can be imported from the parent directory.
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils import get_linked_user, create_request_embed, RequestsPaginationView
+from utils import get_linked_user
+from upstream import UpstreamError
+from pages import RequestPageButton, open_request_source, render_request_page
+from watch_stats import WatchStatsStore
+from tracing import span
+import io
+import time
+import cache
+import metrics
+import profiler
+import utils
+
+BOTSTATS_MAX_LINES = 10 # Rows per /botstats field, keeps fields under Discord's 1024 character limit.
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+def _latency_lines(histogram: metrics.Histogram, label: str, prefix: str = "") -> str:
+    """Formats count, p50, p95 and error count for each value of a label, busiest first."""
+    rows = []
+    for value in histogram.label_values(label):
+        series = histogram.series(**{label: value})
+        errors = series.count - histogram.series(**{label: value, "outcome": "ok"}).count
+        rows.append((series.count, f"`{prefix}{value}` · {series.count} · p50 {_ms(series.quantile(0.5))} · "
+                                   f"p95 {_ms(series.quantile(0.95))}" + (f" · {errors} failed" if errors else "")))
+    rows.sort(key=lambda row: -row[0])
+    return "\n".join(line for _, line in rows[:BOTSTATS_MAX_LINES]) or "No data yet."
 
 class UtilityCog(commands.Cog):
-    def __init__(self, bot, jellyfin_url, jellyfin_headers, jellyseerr_url, jellyseerr_headers):
+    def __init__(self, bot, jellyfin, jellyseerr):
         self.bot = bot
-        self.jellyfin_url = jellyfin_url
-        self.jellyfin_headers = jellyfin_headers
-        self.jellyseerr_url = jellyseerr_url
-        self.jellyseerr_headers = jellyseerr_headers
+        self.jellyfin = jellyfin # Shared UpstreamClient for Jellyfin
+        self.jellyseerr = jellyseerr # Shared UpstreamClient for Jellyseerr
+        # Persisted /watch aggregates, kept warm for active users by a background refresher
+        self.watch_stats = WatchStatsStore(jellyfin, utils.db)
+
+    async def cog_load(self):
+        self.watch_stats.start()
+
+    def cog_unload(self):
+        self.watch_stats.stop()
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -24,128 +55,192 @@ class UtilityCog(commands.Cog):
 
     @app_commands.command(name="watch", description="Get your watch statistics from Jellyfin")
     async def watch_stats_cmd(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True) # Ephemeral for privacy
+        with span("discord.defer"):
+            await interaction.response.defer(ephemeral=True) # Ephemeral for privacy
 
-        linked_user = get_linked_user(str(interaction.user.id))
+        linked_user = await get_linked_user(str(interaction.user.id))
         if not linked_user:
             await interaction.followup.send("⚠️ You haven't linked your account yet. Use `/link` to get started.", ephemeral=True)
             return
 
-        _, jellyfin_user_id, username = linked_user # Unpack: jellyseerr_id, jellyfin_id, username
+        _, jellyfin_user_id, username, _ = linked_user # Unpack: jellyseerr_id, jellyfin_id, username, expires_at
         if not jellyfin_user_id:
             await interaction.followup.send("⚠️ Your Jellyfin User ID is not found in the link. Please try linking again or contact an admin.", ephemeral=True)
             return
 
-        # Query Jellyfin watch data
-        items_url = f"{self.jellyfin_url}/Users/{jellyfin_user_id}/Items"
-        params = {
-            "Recursive": "true", "IncludeItemTypes": "Movie,Episode",
-            "Filters": "IsPlayed", "Fields": "RunTimeTicks,UserData,SeriesName"
-        }
-
         try:
-            response = requests.get(items_url, headers=self.jellyfin_headers, params=params, timeout=15)
-            response.raise_for_status()
-            items = response.json().get("Items", [])
-        except requests.exceptions.RequestException as e:
+            with cache.track_stale() as stale_reads:
+                stats = await self.watch_stats.get(jellyfin_user_id)
+        except UpstreamError as e:
             await interaction.followup.send(f"❌ Failed to fetch watch data from Jellyfin: {e}", ephemeral=True)
             return
         except Exception as e: # Catch any other unexpected errors
             await interaction.followup.send(f"❌ An unexpected error occurred while fetching watch data: {e}", ephemeral=True)
             return
 
-
-        watched_count = len(items)
-        total_ticks = sum(item.get("RunTimeTicks", 0) for item in items if item.get("RunTimeTicks")) # Ensure ticks exist
-        total_seconds = total_ticks / 10_000_000 # Ticks are 100 nanoseconds
+        total_seconds = stats.total_ticks / 10_000_000 # Ticks are 100 nanoseconds
 
         days, remainder_seconds = divmod(total_seconds, 86400) # Seconds in a day
         hours, remainder_seconds = divmod(remainder_seconds, 3600) # Seconds in an hour
         minutes, _ = divmod(remainder_seconds, 60)
 
-        # Find the last watched item
-        last_watched_item = None
-        if items:
-            # Filter items that have UserData and LastPlayedDate to ensure reliable sorting
-            valid_items_for_last_played = [
-                item for item in items
-                if item.get("UserData") and item.get("UserData").get("LastPlayedDate")
-            ]
-            if valid_items_for_last_played:
-                last_watched_item = max(
-                    valid_items_for_last_played,
-                    key=lambda x: x["UserData"]["LastPlayedDate"]
-                )
-
         embed = discord.Embed(
             title=f"📊 {interaction.user.display_name}'s Watch Statistics", # Corrected: use interaction.user.display_name
             color=discord.Color.blue()
         )
-        embed.add_field(name="📺 Total Watched Items", value=str(watched_count), inline=False)
+        embed.add_field(name="📺 Total Watched Items", value=str(stats.watched_count), inline=False)
         embed.add_field(name="⏱️ Total Watch Time", value=f"{int(days)}d {int(hours)}h {int(minutes)}m", inline=False)
 
-        if last_watched_item:
-            title = last_watched_item.get("Name", "Unknown Title")
-            if last_watched_item.get("Type") == "Episode" and last_watched_item.get("SeriesName"):
-                title = f"{last_watched_item.get('SeriesName')} - {title}"
+        if stats.last_item_name or stats.last_series_name:
+            title = stats.last_item_name or "Unknown Title"
+            if stats.last_item_type == "Episode" and stats.last_series_name:
+                title = f"{stats.last_series_name} - {title}"
             embed.add_field(name="👀 Last Watched", value=title, inline=False)
         else:
             embed.add_field(name="👀 Last Watched", value="No specific last watched item found.", inline=False)
+        if stale_reads:
+            embed.set_footer(text="⚠️ Jellyfin is unreachable, showing the last stored statistics")
 
-        await interaction.followup.send(embed=embed, ephemeral=True)
+        with span("discord.send"):
+            await interaction.followup.send(embed=embed, ephemeral=True)
 
     @app_commands.command(name="requests", description="View the status of your media requests")
     async def my_requests_cmd(self, interaction: discord.Interaction):
-        await interaction.response.defer(ephemeral=True)
+        with span("discord.defer"):
+            await interaction.response.defer(ephemeral=True)
 
-        linked_user = get_linked_user(str(interaction.user.id))
+        linked_user = await get_linked_user(str(interaction.user.id))
         if not linked_user or not linked_user[0]: # Check for linked user and jellyseerr_id
             await interaction.followup.send("⚠️ You need to link your account first using `/link`.", ephemeral=True)
             return
 
         jellyseerr_user_id = linked_user[0]
 
-        try:
-            request_api_url = f"{self.jellyseerr_url}/api/v1/request"
-            params = { "take": 100, "skip": 0, "sort": "added",
-                       "filter": "all", "requestedBy": jellyseerr_user_id }
-
-            response = requests.get(request_api_url, headers=self.jellyseerr_headers, params=params, timeout=10)
-            response.raise_for_status()
-            user_requests_data = response.json().get("results", [])
-
-        except requests.exceptions.RequestException as e:
-            await interaction.followup.send(f"❌ An error occurred while fetching your requests: {e}", ephemeral=True)
+        # Requests are fetched lazily in server-sorted chunks, newest first
+        key, source = open_request_source(self.jellyseerr, jellyseerr_user_id)
+        with cache.track_stale(): # A stale first page is flagged on the rendered embed
+            try:
+                first_request = await source.get(0)
+            except UpstreamError as e:
+                await interaction.followup.send(f"❌ An error occurred while fetching your requests: {e}", ephemeral=True)
+                return
+            except Exception as e: # Catch any other unexpected errors
+                await interaction.followup.send(f"❌ An unexpected error occurred: {e}", ephemeral=True)
+                return
+
+            if first_request is None:
+                await interaction.followup.send("You have no pending or completed requests.", ephemeral=True)
+                return
+
+            # Rendering also warms the media details of the next request in the background
+            page = await render_request_page(self.jellyseerr, key, 0)
+        if page is None:
+            await interaction.followup.send("❌ An error occurred while fetching your requests.", ephemeral=True)
             return
-        except Exception as e: # Catch any other unexpected errors
-            await interaction.followup.send(f"❌ An unexpected error occurred: {e}", ephemeral=True)
+        initial_embed, view = page
+
+        with span("discord.send"):
+            await interaction.followup.send(embed=initial_embed, view=view, ephemeral=True)
+
+    @app_commands.command(name="cachestats", description="Show cache hit rates (admin only)")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def cache_stats_cmd(self, interaction: discord.Interaction):
+        embed = discord.Embed(title="🗃️ Cache Statistics", color=discord.Color.blue())
+        for name, registered_cache in sorted(cache.registry.items()):
+            stats = registered_cache.stats()
+            size = f"{stats['size']}/{stats['maxsize']}" if stats['maxsize'] else str(stats['size'])
+            embed.add_field(
+                name=name,
+                value=(f"Hit rate: {stats['hit_rate']:.1%}\n"
+                       f"Hits: {stats['hits']} · Misses: {stats['misses']}\n"
+                       f"Coalesced: {stats['coalesced']} · Evictions: {stats['evictions']}\n"
+                       f"Stale served: {stats.get('stale', 0)} · Size: {size}"),
+                inline=True
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="botstats", description="Show command, upstream and event loop latency (admin only)")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def botstats_cmd(self, interaction: discord.Interaction):
+        embed = discord.Embed(title="📈 Bot Statistics", color=discord.Color.blue())
+        embed.add_field(name="⌨️ Commands", value=_latency_lines(metrics.COMMAND_LATENCY, "command", "/"), inline=False)
+        embed.add_field(name="🔘 Buttons", value=_latency_lines(metrics.COMPONENT_LATENCY, "component"), inline=False)
+
+        # Failed upstream calls: 5xx responses, network errors and calls failed fast by an open breaker
+        failures = {}
+        for _, labels, count in metrics.UPSTREAM_RESPONSES.collect():
+            if not labels["status"].isdigit() or int(labels["status"]) >= 500:
+                failures[labels["backend"]] = failures.get(labels["backend"], 0) + count
+        upstream = []
+        for backend in sorted(metrics.UPSTREAM_LATENCY.label_values("backend")):
+            series = metrics.UPSTREAM_LATENCY.series(backend=backend)
+            upstream.append(f"**{backend}** · {series.count} calls · p50 {_ms(series.quantile(0.5))} · "
+                            f"p95 {_ms(series.quantile(0.95))} · {failures.get(backend, 0)} failed")
+        embed.add_field(name="🌐 Upstream", value="\n".join(upstream) or "No data yet.", inline=False)
+        slowest = sorted(
+            ((endpoint, metrics.UPSTREAM_LATENCY.series(endpoint=endpoint))
+             for endpoint in metrics.UPSTREAM_LATENCY.label_values("endpoint")),
+            key=lambda row: -row[1].quantile(0.95)
+        )[:5]
+        embed.add_field(name="🐢 Slowest Endpoints (p95)", inline=False, value="\n".join(
+            f"`{endpoint}` · {_ms(series.quantile(0.95))} · {series.count} calls" for endpoint, series in slowest
+        ) or "No data yet.")
+
+        database = []
+        for kind in ("read", "transaction"):
+            series = metrics.DB_LATENCY.series(kind=kind)
+            database.append(f"{kind.capitalize()}s: {series.count} · p50 {_ms(series.quantile(0.5))} · p95 {_ms(series.quantile(0.95))}")
+        embed.add_field(name="🗄️ Database", value="\n".join(database), inline=True)
+
+        lag = metrics.LOOP_LAG.series()
+        embed.add_field(name="⏱️ Event Loop Lag",
+                        value=f"p50 {_ms(lag.quantile(0.5))} · p99 {_ms(lag.quantile(0.99))}\nMax {_ms(metrics.loop_lag.max_lag)}",
+                        inline=True)
+
+        hits = misses = 0
+        for registered_cache in cache.registry.values():
+            stats = registered_cache.stats()
+            hits, misses = hits + stats["hits"], misses + stats["misses"]
+        embed.add_field(name="🗃️ Caches",
+                        value=f"Hit rate: {hits / (hits + misses) if hits + misses else 0:.1%}\nSee `/cachestats` for details.",
+                        inline=True)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="profile", description="Profile the bot for a number of seconds and attach the result (admin only)")
+    @app_commands.describe(seconds="How long to sample for")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def profile_cmd(self, interaction: discord.Interaction,
+                          seconds: app_commands.Range[int, 1, profiler.MAX_PROFILE_SECONDS] = 30):
+        if profiler.active_profile is not None:
+            await interaction.response.send_message("⚠️ A profile is already running, please wait for it to finish.", ephemeral=True)
             return
-
-        if not user_requests_data:
-            await interaction.followup.send("You have no pending or completed requests.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try:
+            profile = await profiler.profile(seconds)
+        except RuntimeError as e: # Another admin started a profile in the meantime
+            await interaction.followup.send(f"⚠️ {e}", ephemeral=True)
             return
 
-        user_requests_data.sort(key=lambda r: r.get('createdAt', ''), reverse=True)
-
-        # Pass JELLYSEERR_URL and headers to the RequestsPaginationView
-        view = RequestsPaginationView(user_requests_data, self.jellyseerr_url, self.jellyseerr_headers)
-        initial_embed = create_request_embed(
-            user_requests_data[0], 0, len(user_requests_data),
-            self.jellyseerr_url, self.jellyseerr_headers # Pass URL and headers
+        busy = profile.samples - profile.idle
+        lines = [f"Sampled {profile.samples} stacks over {profile.duration:.1f}s, "
+                 f"event loop busy {busy / profile.samples if profile.samples else 0:.1%} of the time."]
+        if busy:
+            lines.append("\n**Top functions** (self · total, share of busy samples)")
+            for function, own, total in profile.top_functions(10):
+                lines.append(f"`{function}` · {own / busy:.1%} · {total / busy:.1%}")
+        filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        await interaction.followup.send(
+            "\n".join(lines)[:2000],
+            file=discord.File(io.BytesIO(profile.folded().encode()), filename=filename),
+            ephemeral=True
         )
 
-        await interaction.followup.send(embed=initial_embed, view=view, ephemeral=True)
-
 async def setup(bot):
-    jellyfin_url = getattr(bot, 'JELLYFIN_URL', None)
-    jellyfin_api_key = getattr(bot, 'JELLYFIN_API_KEY', None)
-    jellyseerr_url = getattr(bot, 'JELLYSEERR_URL', None)
-    jellyseerr_api_key = getattr(bot, 'JELLYSEERR_API_KEY', None)
-
-    if not all([jellyfin_url, jellyfin_api_key, jellyseerr_url, jellyseerr_api_key]):
-        raise ValueError("JELLYFIN_URL, JELLYFIN_API_KEY, JELLYSEERR_URL, and JELLYSEERR_API_KEY must be set on the bot instance to load UtilityCog.")
+    jellyfin = getattr(bot, 'jellyfin', None)
+    jellyseerr = getattr(bot, 'jellyseerr', None)
 
-    jellyfin_headers = {"X-Emby-Token": jellyfin_api_key, "Content-Type": "application/json"}
-    jellyseerr_headers = {"X-Api-Key": jellyseerr_api_key, "Content-Type": "application/json"}
+    if jellyfin is None or jellyseerr is None:
+        raise ValueError("The Jellyfin and Jellyseerr clients must be set on the bot instance to load UtilityCog.")
 
-    await bot.add_cog(UtilityCog(bot, jellyfin_url, jellyfin_headers, jellyseerr_url, jellyseerr_headers))
+    bot.add_dynamic_items(RequestPageButton)
+    await bot.add_cog(UtilityCog(bot, jellyfin, jellyseerr))
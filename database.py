@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DB_LATENCY
+from tracing import span
+
+class Database:
+    """A long-lived SQLite connection owned by a dedicated thread.
+
+    Every statement runs on the single DB thread, so coroutines never block the event loop
+    and the connection (with its prepared statement cache) is reused for the bot's lifetime.
+    The database is opened in WAL mode so reads are not blocked by writes.
+    """
+    def __init__(self, path: str, cached_statements: int = 128, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.busy_timeout_ms = busy_timeout_ms
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = None
+
+    # --- Runs on the DB thread ---
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, cached_statements=self.cached_statements, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL, avoids an fsync per commit.
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._conn = conn
+        return self._conn
+
+    def _call(self, fn, args):
+        return fn(self._connection(), *args)
+
+    def _transaction(self, fn, args):
+        conn = self._connection()
+        with conn: # Commits on success, rolls back on error.
+            return fn(conn, *args)
+
+    # --- Public interface ---
+    def run_sync(self, fn, *args):
+        """Runs fn(conn, *args) inside a transaction on the DB thread and blocks until it finishes.
+
+        Only meant for startup code that runs before the event loop, such as schema creation.
+        """
+        return self._executor.submit(self._transaction, fn, args).result()
+
+    async def run(self, fn, *args):
+        """Runs fn(conn, *args) on the DB thread without a surrounding transaction (use for reads)."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            with span("sqlite.read"):
+                return await loop.run_in_executor(self._executor, self._call, fn, args)
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - started, kind="read")
+
+    async def transaction(self, fn, *args):
+        """Runs fn(conn, *args) on the DB thread as a single transaction, for batched writes."""
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            with span("sqlite.transaction"):
+                return await loop.run_in_executor(self._executor, self._transaction, fn, args)
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - started, kind="transaction")
+
+    async def execute(self, sql: str, params=()) -> int:
+        """Executes a single write statement in its own transaction and returns the affected row count."""
+        return await self.transaction(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql: str, seq_of_params) -> int:
+        """Executes a write statement for every parameter set in one transaction."""
+        seq_of_params = list(seq_of_params)
+        return await self.transaction(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    def close(self):
+        """Closes the connection and stops the DB thread once queued statements have finished."""
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        self._executor.submit(_close).result()
+        self._executor.shutdown(wait=True)
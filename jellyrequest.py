@@ -1,10 +1,22 @@
 import discord
 from discord.ext import commands
+from discord import app_commands
 import os # For listing files in cogs directory
 import asyncio # For setup_hook if needed, though direct loading is also fine
+import hashlib
+import importlib
+import json
+import signal
+import time
 
 # Import utilities, especially init_db
 import utils
+import pages
+import metrics
+import tracing
+from leader import leadership
+from upstream import UpstreamClient
+from webhooks import WebhookServer, is_loopback
 
 # --- Configuration ---
 # These should ideally be loaded from environment variables or a config file for security
@@ -13,10 +25,64 @@ JELLYSEERR_API_KEY = os.getenv("JELLYSEERR_API_KEY", "YOUR_JELLYSEERR_API_KEY")
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN", "YOUR_DISCORD_BOT_TOKEN") # Replace with your actual token
 JELLYFIN_URL = os.getenv("JELLYFIN_URL", "https://tv.example.com")
 JELLYFIN_API_KEY = os.getenv("JELLYFIN_API_KEY", "YOUR_JELLYFIN_API_KEY") # Example, replace
+# Request rate (per second) and in-flight cap allowed per backend, lower these for small home servers
+JELLYSEERR_MAX_RPS = float(os.getenv("JELLYSEERR_MAX_RPS", 20))
+JELLYSEERR_MAX_CONCURRENCY = int(os.getenv("JELLYSEERR_MAX_CONCURRENCY", 20))
+JELLYFIN_MAX_RPS = float(os.getenv("JELLYFIN_MAX_RPS", 20))
+JELLYFIN_MAX_CONCURRENCY = int(os.getenv("JELLYFIN_MAX_CONCURRENCY", 20))
+# Jellyseerr webhook listener, disabled unless a port is set. Only listens locally by default, any
+# other address requires WEBHOOK_SECRET.
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 0))
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Sharding: total shard count and the shards run by this process, e.g. "0-3" or "0,2". Unset lets
+# Discord recommend a shard count and runs every shard here. launcher.py sets these per worker.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0)) or None
+SHARD_IDS = os.getenv("SHARD_IDS")
+# Position of this process among the workers started by launcher.py. With more than one worker the
+# database is shared, background jobs run on the worker holding the lease and worker 0 syncs commands.
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", 0))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", 1))
+# Prometheus metrics endpoint, disabled unless a port is set (offset by WORKER_INDEX). Only listens locally by default.
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Sync commands to this guild only (instant, for development) instead of globally
+DEV_GUILD_ID = os.getenv("DEV_GUILD_ID")
+# Sync commands on startup even if they haven't changed since the last sync
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "").lower() in ("1", "true", "yes")
+# Hash of the command tree at the last successful sync, kept next to the database
+COMMAND_HASH_PATH = os.path.join(os.path.dirname(utils.DB_PATH), "command_tree.json")
 # ---------------------
 
+if SHARD_IDS and not SHARD_COUNT:
+    # AutoShardedBot needs the total to route guilds to shards, it can't be recommended by Discord here.
+    raise SystemExit("ERROR: SHARD_IDS is set but SHARD_COUNT is not. Set SHARD_COUNT to the total number of shards "
+                     "across all processes, or unset SHARD_IDS to run every shard in this process.")
+
+def parse_shard_ids(value: str) -> list:
+    """Parses SHARD_IDS: comma separated shard ids and inclusive ranges, e.g. "0-3" or "0,2,4-5"."""
+    shard_ids = []
+    for part in filter(None, (part.strip() for part in value.split(","))):
+        first, _, last = part.partition("-")
+        shard_ids.extend(range(int(first), int(last or first) + 1))
+    return shard_ids
+
+class JellyCommandTree(app_commands.CommandTree):
+    """Stamps each app command with its start time and a trace, finished once the command completes."""
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started_at"] = time.perf_counter()
+        command = interaction.command
+        interaction.extras["trace"] = tracing.begin(f"/{command.qualified_name if command else 'unknown'}",
+                                                    user_id=str(interaction.user.id))
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        metrics.record_command(interaction, "denied" if isinstance(error, app_commands.CheckFailure) else "error")
+        tracing.finish(interaction.extras.get("trace"), error)
+        await super().on_error(interaction, error)
+
 # Define a custom Bot class to handle setup_hook for loading cogs
-class JellyBot(commands.Bot):
+class JellyBot(commands.AutoShardedBot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Store config directly on the bot instance so cogs can access it.
@@ -24,44 +90,180 @@ class JellyBot(commands.Bot):
         self.JELLYSEERR_API_KEY = JELLYSEERR_API_KEY
         self.JELLYFIN_URL = JELLYFIN_URL
         self.JELLYFIN_API_KEY = JELLYFIN_API_KEY
+        # Shared upstream clients, created in setup_hook once the event loop is running.
+        self.jellyseerr = None
+        self.jellyfin = None
+        self.webhooks = None
+        self.metrics_server = None
+        self._shutdown_task = None # The close sequence, shared by every caller of close()
 
     async def setup_hook(self):
         print("Running setup_hook...")
-        # Manually load all cogs
-        import importlib 
+        # launcher.py stops workers with SIGTERM, close gracefully so the leader lease is released at once.
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self._on_sigterm)
+        except NotImplementedError:
+            pass # Not supported on Windows, the lease then expires on its own.
+        # One pooled keep-alive session per backend, shared by every cog and view.
+        self.jellyseerr = UpstreamClient(
+            "jellyseerr", self.JELLYSEERR_URL,
+            {"X-Api-Key": self.JELLYSEERR_API_KEY, "Content-Type": "application/json"},
+            pool_size=JELLYSEERR_MAX_CONCURRENCY, rate=JELLYSEERR_MAX_RPS, burst=max(1, int(JELLYSEERR_MAX_RPS * 2)),
+            health_path="/api/v1/status"
+        )
+        self.jellyfin = UpstreamClient(
+            "jellyfin", self.JELLYFIN_URL,
+            {"X-Emby-Token": self.JELLYFIN_API_KEY, "Content-Type": "application/json"},
+            pool_size=JELLYFIN_MAX_CONCURRENCY, rate=JELLYFIN_MAX_RPS, burst=max(1, int(JELLYFIN_MAX_RPS * 2)),
+            health_path="/System/Info/Public"
+        )
+        await self.jellyseerr.start()
+        await self.jellyfin.start()
+        print("Upstream HTTP clients started.")
+
+        if WORKER_COUNT > 1:
+            # Other workers link and unlink users too, so an in-memory copy would go stale.
+            utils.linked_users.share()
+        else:
+            # Load the write-through linked user index so link lookups never touch SQLite
+            linked_count = await utils.load_linked_users()
+            print(f"Loaded {linked_count} linked user(s) into memory.")
+        # Forget search result keys whose messages are too old to still be paged through
+        await pages.prune_page_sources()
+
+        metrics.loop_lag.start()
+        if METRICS_PORT:
+            self.metrics_server = metrics.MetricsServer(METRICS_HOST, METRICS_PORT + WORKER_INDEX)
+            await self.metrics_server.start()
+
+        # Push request status updates to users as DMs instead of waiting for them to run /requests.
+        # Only the worker running the background jobs listens, Jellyseerr posts to a single URL.
+        if WEBHOOK_PORT:
+            self.webhooks = WebhookServer(self, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET)
+            leadership.on_change(self._toggle_webhooks)
+        leadership.start(shared=WORKER_COUNT > 1)
+
+        # Load the cogs concurrently, their setup() calls overlap while waiting on I/O
         cogs_path = "cogs"
-        
-        cog_files = [f[:-3] for f in os.listdir(cogs_path) if f.endswith(".py") and not f.startswith("__")]
-
-        for cog_module_name in cog_files:
-            full_module_path = f"{cogs_path}.{cog_module_name}"
-            try:
-                print(f"Attempting to manually load module: {full_module_path}")
-                module = importlib.import_module(full_module_path)
-                print(f"Successfully imported module: {full_module_path}")
-                
-                if hasattr(module, 'setup'):
-                    await module.setup(self)
-                    print(f"Successfully setup and loaded cog: {full_module_path}")
-                else:
-                    print(f"No setup function found in {full_module_path}")
-            except Exception as e:
-                print(f"Failed to manually load cog {full_module_path}: {e}")
-                # Consider re-raising or handling more gracefully depending on severity.
-        
-        # Sync application commands globally
-        print("Attempting to sync application commands...")
+        cog_modules = sorted(f"{cogs_path}.{f[:-3]}" for f in os.listdir(cogs_path) if f.endswith(".py") and not f.startswith("__"))
+        await asyncio.gather(*(self._load_cog(module_path) for module_path in cog_modules))
+
+        # Every worker registers the same commands, one sync is enough.
+        if WORKER_INDEX == 0:
+            await self.sync_commands()
+
+    def _on_sigterm(self):
+        if self._shutdown_task is None:
+            print("Received SIGTERM, shutting down...")
+            self._shutdown_task = asyncio.create_task(self._shutdown())
+
+    async def _toggle_webhooks(self, leader: bool):
+        try:
+            if leader:
+                await self.webhooks.start()
+            else:
+                await self.webhooks.close()
+        except OSError as e:
+            print(f"Failed to start the Jellyseerr webhook listener: {e}")
+
+    async def _load_cog(self, full_module_path: str):
+        try:
+            print(f"Attempting to manually load module: {full_module_path}")
+            module = importlib.import_module(full_module_path)
+            print(f"Successfully imported module: {full_module_path}")
+
+            if hasattr(module, 'setup'):
+                await module.setup(self)
+                print(f"Successfully setup and loaded cog: {full_module_path}")
+            else:
+                print(f"No setup function found in {full_module_path}")
+        except Exception as e:
+            print(f"Failed to manually load cog {full_module_path}: {e}")
+            # Consider re-raising or handling more gracefully depending on severity.
+
+    def command_tree_hash(self, guild: discord.abc.Snowflake = None) -> str:
+        """Returns a stable hash of the app commands as they would be sent to Discord."""
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+                         key=lambda command: (command.get("type", 1), command["name"]))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def sync_commands(self):
+        """Syncs the command tree with Discord, unless it is unchanged since the last successful sync.
+
+        Syncing is slow and rate limited, so the hash of the last synced tree is kept in COMMAND_HASH_PATH.
+        With DEV_GUILD_ID set, commands are synced to that guild only, where changes show up immediately.
+        """
+        guild = discord.Object(id=int(DEV_GUILD_ID)) if DEV_GUILD_ID else None
+        if guild is not None:
+            self.tree.copy_global_to(guild=guild)
+        scope = f"{self.application_id}:{f'guild:{DEV_GUILD_ID}' if guild else 'global'}"
+        digest = self.command_tree_hash(guild)
         try:
-            await self.tree.sync() # Sync globally
+            with open(COMMAND_HASH_PATH) as f:
+                synced = json.load(f)
+        except (OSError, ValueError):
+            synced = {}
+        if synced.get(scope) == digest and not FORCE_COMMAND_SYNC:
+            print("Application commands are unchanged since the last sync, skipping sync.")
+            return
+
+        print(f"Attempting to sync application commands ({'guild ' + DEV_GUILD_ID if guild else 'globally'})...")
+        try:
+            await self.tree.sync(guild=guild)
             print("Application commands synced successfully.")
         except Exception as e:
             print(f"Error syncing application commands: {e}")
+            return # Not recorded, so the next start tries again.
+        synced[scope] = digest
+        temp_path = f"{COMMAND_HASH_PATH}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(synced, f)
+        os.replace(temp_path, COMMAND_HASH_PATH)
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        metrics.record_command(interaction, "ok")
+        tracing.finish(interaction.extras.get("trace"))
+
+    async def close(self):
+        """Runs the close sequence once, however many times (and from wherever) it is called."""
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.create_task(self._shutdown())
+        # Shielded so a caller being cancelled (e.g. the event loop shutting down) doesn't interrupt it.
+        await asyncio.shield(self._shutdown_task)
+
+    async def _shutdown(self):
+        await leadership.stop() # Hands the background jobs over to another worker straight away.
+        if self.webhooks is not None:
+            await self.webhooks.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        metrics.loop_lag.stop()
+        await super().close()
+        # Close the upstream sessions after the cogs have been unloaded.
+        for client in (self.jellyseerr, self.jellyfin):
+            if client is not None:
+                await client.close()
+        print("Upstream HTTP clients closed.")
+        utils.db.close()
+        print("Database connection closed.")
         
 # --- Bot Instantiation ---
 intents = discord.Intents.default()
 # If using traditional prefix commands (not slash), message content intent might be needed.
 # intents.message_content = True
-bot = JellyBot(command_prefix="/", intents=intents)
+bot = JellyBot(command_prefix="/", intents=intents, tree_cls=JellyCommandTree,
+               shard_count=SHARD_COUNT, shard_ids=parse_shard_ids(SHARD_IDS) if SHARD_IDS else None)
+
+async def run_bot():
+    """Runs the bot until it is stopped, then waits for its close sequence to finish.
+
+    Used instead of bot.run() so the upstream clients and the database are closed before the event loop
+    is torn down, also when the shutdown was started by SIGTERM.
+    """
+    try:
+        await bot.start(DISCORD_BOT_TOKEN)
+    finally:
+        await bot.close()
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -71,7 +273,14 @@ if __name__ == "__main__":
 
     if DISCORD_BOT_TOKEN == "YOUR_DISCORD_BOT_TOKEN" or not DISCORD_BOT_TOKEN:
         print("ERROR: DISCORD_BOT_TOKEN is not set. Please set it in the script or as an environment variable.")
+    elif WEBHOOK_PORT and not WEBHOOK_SECRET and not is_loopback(WEBHOOK_HOST):
+        print(f"ERROR: WEBHOOK_SECRET is not set. It is required when the webhook listener binds to {WEBHOOK_HOST}, "
+              "set it or bind the listener to 127.0.0.1.")
     else:
         print(f"Attempting to run bot with JELLYSEERR_URL: {JELLYSEERR_URL}, JELLYFIN_URL: {JELLYFIN_URL}")
-        bot.run(DISCORD_BOT_TOKEN)
+        discord.utils.setup_logging()
+        try:
+            asyncio.run(run_bot())
+        except KeyboardInterrupt:
+            pass
         print("Bot is running with username:", bot.user.name)
\ No newline at end of file
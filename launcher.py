@@ -0,0 +1,145 @@
+"""Runs the bot as several worker processes, each connected to a contiguous range of shards.
+
+    python launcher.py --workers 4            # shard count recommended by Discord
+    python launcher.py --workers 4 --shards 16
+
+Every worker is a regular jellyrequest.py process configured through SHARD_COUNT, SHARD_IDS,
+WORKER_INDEX and WORKER_COUNT. The workers share the SQLite database; background jobs (expirations,
+media index and watch statistics refreshes, the webhook listener) run on whichever worker holds the
+lease in the leases table. Workers are started one after another so their shards don't exceed the
+identify rate limit, restarted with backoff when they crash, and stopped on SIGTERM/SIGINT.
+"""
+import argparse
+import asyncio
+import math
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+
+import utils
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+IDENTIFY_WINDOW_SECONDS = 5 # Discord allows max_concurrency identifies per window.
+RESTART_BASE_SECONDS = 2 # Restart backoff, doubled per consecutive crash up to RESTART_MAX_SECONDS.
+RESTART_MAX_SECONDS = 60
+HEALTHY_SECONDS = 300 # A worker that ran this long before exiting is restarted without backoff.
+STOP_TIMEOUT_SECONDS = 30 # Grace period before workers that ignore SIGTERM are killed.
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jellyrequest.py")
+
+async def fetch_gateway(token: str) -> tuple:
+    """Returns Discord's recommended shard count and the identify max_concurrency for the bot."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(GATEWAY_URL, headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data["shards"], data.get("session_start_limit", {}).get("max_concurrency", 1)
+
+def split_shards(shard_count: int, workers: int) -> list:
+    """Splits shards 0..shard_count-1 into contiguous (first, last) ranges, one per worker."""
+    ranges, first = [], 0
+    for index in range(workers):
+        size = shard_count // workers + (1 if index < shard_count % workers else 0)
+        ranges.append((first, first + size - 1))
+        first += size
+    return ranges
+
+class Worker:
+    """One bot process and its restart loop."""
+    def __init__(self, index: int, count: int, shard_count: int, shards: tuple):
+        self.index = index
+        self.shards = shards
+        self.env = {
+            **os.environ,
+            "SHARD_COUNT": str(shard_count),
+            "SHARD_IDS": f"{shards[0]}-{shards[1]}",
+            "WORKER_INDEX": str(index),
+            "WORKER_COUNT": str(count),
+        }
+        self.process = None
+        self.crashes = 0
+
+    async def run(self, stopping: asyncio.Event):
+        while not stopping.is_set():
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(sys.executable, BOT_SCRIPT, env=self.env)
+            print(f"Worker {self.index} started (pid {self.process.pid}, shards {self.env['SHARD_IDS']}).")
+            code = await self.process.wait()
+            if stopping.is_set():
+                break
+            self.crashes = 0 if time.monotonic() - started >= HEALTHY_SECONDS else self.crashes + 1
+            delay = min(RESTART_BASE_SECONDS * 2 ** self.crashes, RESTART_MAX_SECONDS)
+            print(f"Worker {self.index} exited with code {code}, restarting in {delay}s.")
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def terminate(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+    def kill(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run the bot as several sharded worker processes.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKER_COUNT", 1)),
+                        help="number of worker processes (default: WORKER_COUNT or 1)")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARD_COUNT", 0)),
+                        help="total shard count (default: SHARD_COUNT or Discord's recommendation)")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="identifies allowed per 5 seconds (default: from Discord, or 1 with --shards)")
+    args = parser.parse_args()
+
+    shard_count, max_concurrency = args.shards, args.max_concurrency or 1
+    if not shard_count:
+        token = os.getenv("DISCORD_BOT_TOKEN")
+        if not token:
+            parser.error("Set DISCORD_BOT_TOKEN or pass --shards.")
+        shard_count, recommended_concurrency = await fetch_gateway(token)
+        max_concurrency = args.max_concurrency or recommended_concurrency
+        print(f"Discord recommends {shard_count} shard(s), max_concurrency {max_concurrency}.")
+    workers = max(1, min(args.workers, shard_count))
+    if workers < args.workers:
+        print(f"Only {shard_count} shard(s), starting {workers} worker(s).")
+
+    # Create the schema once rather than from every worker at the same time.
+    utils.init_db()
+    utils.db.close()
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+
+    pool = [Worker(index, workers, shard_count, shards) for index, shards in enumerate(split_shards(shard_count, workers))]
+    tasks = []
+    for worker in pool:
+        if stopping.is_set():
+            break
+        tasks.append(asyncio.create_task(worker.run(stopping)))
+        # Let this worker's shards identify before the next worker starts identifying its own.
+        first, last = worker.shards
+        stagger = math.ceil((last - first + 1) / max_concurrency) * IDENTIFY_WINDOW_SECONDS
+        try:
+            await asyncio.wait_for(stopping.wait(), timeout=stagger)
+        except asyncio.TimeoutError:
+            pass
+
+    await stopping.wait()
+    print("Stopping workers...")
+    for worker in pool:
+        worker.terminate()
+    _, pending = await asyncio.wait(tasks, timeout=STOP_TIMEOUT_SECONDS)
+    if pending:
+        for worker in pool:
+            worker.kill()
+        await asyncio.wait(pending)
+    print("All workers stopped.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+import asyncio
+import inspect
+import os
+import secrets
+import socket
+import time
+
+from database import Database
+from utils import db
+
+LEASE_NAME = "background_jobs"
+LEASE_SECONDS = 30 # A leader that stops renewing loses the lease after this long.
+RENEW_SECONDS = 10 # Interval between renewals (and takeover attempts by the other workers).
+
+class LeaderLease:
+    """Elects one of the bot processes sharing the database to run the background jobs.
+
+    The leader holds a row in the leases table and renews it every RENEW_SECONDS. Other workers try to
+    take the row over once it has expired, so a crashed leader is replaced within LEASE_SECONDS. Jobs
+    check is_leader (or wait_until_leader()) and callbacks registered with on_change() are run when
+    this process gains or loses the lease. Without shared workers the process is always the leader.
+    """
+    def __init__(self, db: Database, name: str = LEASE_NAME):
+        self.db = db
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.shared = False # Whether other processes share the database and compete for the lease
+        self.is_leader = False
+        self._elected = asyncio.Event()
+        self._valid_until = 0.0 # While leader: when the lease expires unless renewed.
+        self._callbacks = []
+        self._callback_tasks = set()
+        self._task = None
+
+    def start(self, shared: bool):
+        """Starts competing for the lease, or becomes leader at once if no other process shares the database."""
+        self.shared = shared
+        if not shared:
+            self._set_leader(True)
+        elif self._task is None:
+            self._task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self):
+        """Stops renewing and hands the lease over straight away instead of letting it expire."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            if self.is_leader:
+                await self.db.execute('DELETE FROM leases WHERE name=? AND holder=?', (self.name, self.holder))
+        self._set_leader(False)
+
+    def on_change(self, callback):
+        """Registers callback(is_leader), a function or coroutine function, run whenever leadership changes."""
+        self._callbacks.append(callback)
+
+    async def wait_until_leader(self):
+        await self._elected.wait()
+
+    async def _acquire(self) -> bool:
+        """Takes or renews the lease, returns whether this process holds it."""
+        now = time.time()
+        changed = await self.db.execute('''
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+            WHERE leases.holder=excluded.holder OR leases.expires_at < ?
+        ''', (self.name, self.holder, now + LEASE_SECONDS, now))
+        if changed:
+            self._valid_until = now + LEASE_SECONDS
+        return changed > 0
+
+    async def _renew_loop(self):
+        while True:
+            try:
+                leader = await self._acquire()
+            except Exception as e:
+                print(f"Failed to renew the background jobs lease: {e}")
+                leader = self.is_leader and time.time() < self._valid_until # Keep it until it would expire.
+            self._set_leader(leader)
+            await asyncio.sleep(RENEW_SECONDS)
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        if leader:
+            self._elected.set()
+            print(f"This process ({self.holder}) now runs the background jobs.")
+        else:
+            self._elected.clear()
+            print(f"This process ({self.holder}) no longer runs the background jobs.")
+        for callback in self._callbacks:
+            result = callback(leader)
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self._callback_tasks.add(task)
+                task.add_done_callback(self._callback_tasks.discard)
+
+
+leadership = LeaderLease(db)
@@ -0,0 +1,202 @@
+import asyncio
+import time
+
+from cache import register
+from database import Database
+from leader import leadership
+from upstream import UpstreamClient, UpstreamError, priority, BACKGROUND
+from utils import db
+
+PAGE_SIZE = 100 # Media fetched per /api/v1/media page.
+SYNC_SECONDS = 60 # Interval between incremental (delta) syncs.
+REBUILD_SECONDS = 24 * 3600 # Interval between full syncs, which also drop media deleted from Jellyseerr.
+
+# Jellyseerr media statuses
+UNKNOWN = 1
+PENDING = 2
+PROCESSING = 3
+PARTIALLY_AVAILABLE = 4
+AVAILABLE = 5
+
+STATUS_LABELS = {
+    PENDING: "⏳ Requested",
+    PROCESSING: "⚙️ Processing",
+    PARTIALLY_AVAILABLE: "🗂️ Partially Available",
+    AVAILABLE: "🎬 Available",
+}
+# Statuses for which Jellyseerr rejects a new request as a duplicate (409).
+UNREQUESTABLE = {PENDING, PROCESSING, AVAILABLE}
+
+class MediaIndex:
+    """A local index of Jellyseerr media status by (mediaType, tmdbId).
+
+    The index is loaded from SQLite at startup, replaced by a full sync of /api/v1/media and then kept
+    current by delta syncs (media sorted by last modification, stopping at the stored high-water mark),
+    so embeds can show availability without any upstream call. Successful requests are written through.
+    """
+    def __init__(self, db: Database):
+        self.name = "media_status"
+        self.db = db
+        self.jellyseerr = None
+        self._status = {} # (media_type, tmdb_id) -> status
+        self._high_water_mark = "" # Latest updatedAt seen, ISO timestamps compare lexicographically.
+        self._lock = asyncio.Lock()
+        self._built_at = 0.0
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._status)
+
+    def start(self, jellyseerr: UpstreamClient):
+        self.jellyseerr = jellyseerr
+        if self._task is None:
+            with priority(BACKGROUND):
+                self._task = asyncio.create_task(self._sync_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def status(self, media_type: str, tmdb_id):
+        """Returns the Jellyseerr status of a movie or TV show, or None if it isn't known to Jellyseerr."""
+        status = self._status.get((media_type, _tmdb_key(tmdb_id)))
+        if status is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return status
+
+    def is_requestable(self, media_type: str, tmdb_id) -> bool:
+        return self._status.get((media_type, _tmdb_key(tmdb_id))) not in UNREQUESTABLE
+
+    async def mark(self, media_type: str, tmdb_id, status: int):
+        """Records a status change made by the bot (e.g. a new request) until the next sync confirms it."""
+        key = (media_type, _tmdb_key(tmdb_id))
+        current = self._status.get(key)
+        if current is not None and current != UNKNOWN and current >= status:
+            return # Never downgrade what Jellyseerr reported, e.g. available -> requested.
+        self._status[key] = status
+        await self.db.execute(
+            'INSERT INTO media_status (media_type, tmdb_id, status, updated_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(media_type, tmdb_id) DO UPDATE SET status=excluded.status',
+            (media_type, key[1], status, "")
+        )
+
+    # --- Syncing ---
+    async def _load(self):
+        rows = await self.db.fetchall('SELECT media_type, tmdb_id, status, updated_at FROM media_status')
+        self._status = {(media_type, tmdb_id): status for media_type, tmdb_id, status, _ in rows}
+        self._high_water_mark = max((updated_at or "" for *_, updated_at in rows), default="")
+        return len(rows)
+
+    async def _fetch_page(self, skip: int, sort: str) -> list:
+        data = await self.jellyseerr.get_json(
+            "/api/v1/media", params={"take": PAGE_SIZE, "skip": skip, "filter": "all", "sort": sort}
+        )
+        return data.get("results", [])
+
+    @staticmethod
+    def _row(media: dict):
+        if not media.get("tmdbId") or not media.get("mediaType"):
+            return None
+        return (media["mediaType"], int(media["tmdbId"]), media.get("status") or UNKNOWN, media.get("updatedAt") or "")
+
+    async def _build(self):
+        rows, skip = [], 0
+        while True:
+            page = await self._fetch_page(skip, "added")
+            rows.extend(row for row in map(self._row, page) if row)
+            if len(page) < PAGE_SIZE:
+                break
+            skip += PAGE_SIZE
+
+        def _store(conn):
+            conn.execute('DELETE FROM media_status')
+            conn.executemany(
+                'INSERT OR REPLACE INTO media_status (media_type, tmdb_id, status, updated_at) VALUES (?, ?, ?, ?)', rows
+            )
+        await self.db.transaction(_store)
+        self._status = {(media_type, tmdb_id): status for media_type, tmdb_id, status, _ in rows}
+        self._high_water_mark = max((row[3] for row in rows), default="")
+        self._built_at = time.monotonic()
+        print(f"Media status index built with {len(rows)} item(s).")
+
+    async def _sync(self):
+        high_water_mark, skip, rows = self._high_water_mark, 0, []
+        while True:
+            page = await self._fetch_page(skip, "modified")
+            for media in page:
+                if (media.get("updatedAt") or "") < high_water_mark:
+                    break
+                row = self._row(media)
+                if row:
+                    rows.append(row)
+            else:
+                if len(page) == PAGE_SIZE:
+                    skip += PAGE_SIZE
+                    continue
+            break
+        if not rows:
+            return
+        await self.db.executemany(
+            'INSERT OR REPLACE INTO media_status (media_type, tmdb_id, status, updated_at) VALUES (?, ?, ?, ?)', rows
+        )
+        for media_type, tmdb_id, status, updated_at in rows:
+            self._status[(media_type, tmdb_id)] = status
+            self._high_water_mark = max(self._high_water_mark, updated_at)
+
+    async def sync(self):
+        """Runs a full sync if one is due (or none has run yet), otherwise a delta sync."""
+        async with self._lock:
+            if time.monotonic() - self._built_at >= REBUILD_SECONDS or not self._built_at:
+                await self._build()
+            else:
+                await self._sync()
+
+    async def _sync_loop(self):
+        loaded = False
+        while True:
+            try:
+                if not loaded:
+                    # Retried with the syncs below if the database isn't usable yet.
+                    count = await self._load()
+                    loaded = True
+                    print(f"Loaded {count} media status(es) from the database.")
+                    if leadership.is_leader:
+                        await self.sync()
+                elif leadership.is_leader:
+                    await self.sync()
+                else:
+                    # Another worker syncs with Jellyseerr, pick up what it stored.
+                    await self._load()
+            except UpstreamError as e:
+                print(f"Failed to sync the media status index: {e}")
+            except Exception as e:
+                print(f"An unexpected error occurred while syncing the media status index: {e}")
+            await asyncio.sleep(SYNC_SECONDS)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._status),
+            "maxsize": 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+            "coalesced": 0,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _tmdb_key(tmdb_id):
+    try:
+        return int(tmdb_id)
+    except (TypeError, ValueError):
+        return tmdb_id
+
+
+media_status = register(MediaIndex(db))
@@ -0,0 +1,265 @@
+import asyncio
+import bisect
+import contextlib
+import time
+
+from aiohttp import web
+
+import cache
+
+METRICS_PATH = "/metrics"
+LOOP_LAG_INTERVAL_SECONDS = 0.5 # Sampling interval of the event loop lag monitor.
+
+# Histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+# Every metric exposed on /metrics, by name.
+registry = {}
+
+def register(metric):
+    """Adds a metric (anything with a name and a collect() method) to the registry."""
+    registry[metric.name] = metric
+    return metric
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values = {} # label values -> count
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Returns the total over every label set matching the given labels."""
+        return sum(value for key, value in self._values.items() if self._matches(key, labels))
+
+    def _matches(self, key: tuple, labels: dict) -> bool:
+        return all(key[self.labelnames.index(name)] == str(value) for name, value in labels.items())
+
+    def collect(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class HistogramSeries:
+    """Bucketed observations of one label set, or several merged together."""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last slot counts observations above every bucket.
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, other: "HistogramSeries"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by linear interpolation within its bucket, like Prometheus' histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1] # Beyond the last bucket, its bound is all that is known.
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Histogram:
+    """Observations (e.g. latencies in seconds) counted into fixed buckets per label set."""
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {} # label values -> HistogramSeries
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = HistogramSeries(self.buckets)
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observes the duration of the block, with an outcome label of "ok" or "error" (if it raised)."""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+    def series(self, **labels) -> HistogramSeries:
+        """Returns the observations of every label set matching the given labels, merged."""
+        merged = HistogramSeries(self.buckets)
+        for key, series in self._series.items():
+            if all(key[self.labelnames.index(name)] == str(value) for name, value in labels.items()):
+                merged.add(series)
+        return merged
+
+    def label_values(self, name: str) -> set:
+        index = self.labelnames.index(name)
+        return {key[index] for key in self._series}
+
+    def collect(self):
+        for key, series in sorted(self._series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, series.count
+            yield f"{self.name}_sum", labels, series.sum
+            yield f"{self.name}_count", labels, series.count
+
+
+class CacheStat:
+    """Reports one of the counters of every registered cache at scrape time."""
+    def __init__(self, name: str, kind: str, description: str, stat: str):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self.stat = stat
+
+    def collect(self):
+        for name, registered_cache in sorted(cache.registry.items()):
+            yield self.name, {"cache": name}, registered_cache.stats().get(self.stat, 0)
+
+
+COMMAND_LATENCY = register(Histogram(
+    "jellyrequest_command_duration_seconds", "Time from receiving an app command to its completion.",
+    ("command", "outcome")
+))
+COMPONENT_LATENCY = register(Histogram(
+    "jellyrequest_component_duration_seconds", "Time taken by view button callbacks.", ("component", "outcome")
+))
+UPSTREAM_LATENCY = register(Histogram(
+    "jellyrequest_upstream_request_duration_seconds", "Duration of HTTP requests to Jellyseerr and Jellyfin.",
+    ("backend", "endpoint")
+))
+UPSTREAM_RESPONSES = register(Counter(
+    "jellyrequest_upstream_responses_total",
+    "Upstream responses by status code (\"error\" for network errors, \"circuit_open\" for calls failed fast).",
+    ("backend", "endpoint", "status")
+))
+DB_LATENCY = register(Histogram(
+    "jellyrequest_db_query_duration_seconds", "Time taken by SQLite reads and transactions, including queueing.",
+    ("kind",), FAST_BUCKETS
+))
+LOOP_LAG = register(Histogram(
+    "jellyrequest_event_loop_lag_seconds", "How late the event loop runs a timer that is due.", (), FAST_BUCKETS
+))
+for _name, _kind, _description, _stat in (
+    ("jellyrequest_cache_hits_total", "counter", "Cache lookups answered from the cache.", "hits"),
+    ("jellyrequest_cache_misses_total", "counter", "Cache lookups that had to fetch.", "misses"),
+    ("jellyrequest_cache_stale_total", "counter", "Expired entries served because the upstream failed.", "stale"),
+    ("jellyrequest_cache_evictions_total", "counter", "Entries evicted to stay within the cache size.", "evictions"),
+    ("jellyrequest_cache_size", "gauge", "Entries currently in the cache.", "size"),
+    ("jellyrequest_cache_hit_ratio", "gauge", "Share of lookups answered from the cache.", "hit_rate"),
+):
+    register(CacheStat(_name, _kind, _description, _stat))
+
+
+def record_command(interaction, outcome: str):
+    """Observes an app command's latency from the start time stamped by the command tree."""
+    started = interaction.extras.get("started_at")
+    if started is None:
+        return
+    command = interaction.command
+    COMMAND_LATENCY.observe(time.perf_counter() - started,
+                            command=command.qualified_name if command else "unknown", outcome=outcome)
+
+
+class LoopLagMonitor:
+    """Measures event loop lag by checking how late a periodic sleep wakes up."""
+    def __init__(self):
+        self._task = None
+        self.max_lag = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+            lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL_SECONDS)
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+
+
+loop_lag = LoopLagMonitor()
+
+
+def render() -> str:
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry.values():
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.collect():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """A local HTTP listener serving the metrics at /metrics for Prometheus to scrape."""
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(METRICS_PATH, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        print(f"Serving metrics on {self.host}:{self.port}{METRICS_PATH}")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
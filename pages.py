@@ -0,0 +1,338 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import discord
+from discord.ui import View, Button, DynamicItem
+
+from cache import TTLCache, track_stale
+from sources import ListSource, DiscoverSource, RequestSource, normalize_query, search_media
+from upstream import UpstreamClient, UpstreamError, priority, PREFETCH
+from media_index import media_status, STATUS_LABELS, UNREQUESTABLE
+from metrics import COMPONENT_LATENCY
+from tracing import trace, span
+from submissions import submissions, REQUESTED, DUPLICATE
+from utils import db, get_linked_user, create_embed_for_item, create_request_embed, fetch_media_details
+
+# Paginated result messages keep no state in memory. Each button's custom_id holds the source key and
+# the index being shown, and the page is rebuilt from a shared source when the button is pressed:
+#   jr:m:<action>:<key>:<index>                    media results (search / discover), action is prev or next
+#   jr:m:req:<key>:<index>:<media type>:<tmdb id>  the Request button, which submits exactly the media shown
+#   jr:r:<action>:<key>:<index>                    a user's requests, action is prev or next
+# Source keys start with the kind of source: "s<hash>" search, "d" discover, "r<jellyseerr id>" requests.
+
+# Sources shared by every message showing the same results.
+SOURCE_CACHE = TTLCache(
+    "page_sources",
+    maxsize=int(os.getenv("PAGE_SOURCE_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("PAGE_SOURCE_CACHE_TTL", 1800))
+)
+# Search keys are persisted so their buttons keep working after a restart, for this long.
+PAGE_SOURCE_RETENTION_SECONDS = 30 * 24 * 3600
+# Maximum number of neighbouring request pages warmed in the background at once.
+PREFETCH_CONCURRENCY = 2
+
+_prefetch_semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+_prefetch_tasks = set()
+
+# --- Source Keys ---
+async def _persist_source_key(key: str, kind: str, params: dict):
+    await db.execute(
+        'INSERT OR REPLACE INTO page_sources (key, kind, params, created_at) VALUES (?, ?, ?, ?)',
+        (key, kind, json.dumps(params), time.time())
+    )
+
+async def prune_page_sources():
+    """Removes persisted source keys that are too old for their messages to still be in use."""
+    await db.execute('DELETE FROM page_sources WHERE created_at < ?', (time.time() - PAGE_SOURCE_RETENTION_SECONDS,))
+
+async def open_search_source(jellyseerr: UpstreamClient, query: str):
+    """Runs a search and returns (key, source) for its results.
+
+    Searches without results are neither cached nor persisted, there is nothing to page through.
+    """
+    normalized_query = normalize_query(query)
+    key = "s" + hashlib.sha1(normalized_query.encode()).hexdigest()[:20]
+    source = ListSource(await search_media(jellyseerr, normalized_query))
+    if source.total == 0:
+        return key, source
+    SOURCE_CACHE.set(key, source)
+    await _persist_source_key(key, "search", {"query": normalized_query})
+    return key, source
+
+async def open_discover_source(jellyseerr: UpstreamClient):
+    """Returns (key, source) for the discover feeds, shared by every user."""
+    key = "d"
+    source = SOURCE_CACHE.get(key)
+    if source is None:
+        source = DiscoverSource(jellyseerr)
+        SOURCE_CACHE.set(key, source)
+    return key, source
+
+def open_request_source(jellyseerr: UpstreamClient, jellyseerr_user_id):
+    """Returns (key, source) with a fresh view of a user's requests."""
+    key = f"r{jellyseerr_user_id}"
+    source = RequestSource(jellyseerr, jellyseerr_user_id)
+    SOURCE_CACHE.set(key, source)
+    return key, source
+
+async def _rebuild_source(jellyseerr: UpstreamClient, key: str):
+    if key == "d":
+        return DiscoverSource(jellyseerr)
+    if key.startswith("r"):
+        return RequestSource(jellyseerr, key[1:])
+    row = await db.fetchone('SELECT kind, params FROM page_sources WHERE key=?', (key,))
+    if row is None:
+        return None
+    kind, params = row[0], json.loads(row[1])
+    if kind == "search":
+        return ListSource(await search_media(jellyseerr, params["query"]))
+    return None
+
+async def get_source(jellyseerr: UpstreamClient, key: str):
+    """Returns the shared source for a key, rebuilding it (e.g. after a restart) if needed."""
+    source = await SOURCE_CACHE.get_or_fetch(key, lambda: _rebuild_source(jellyseerr, key))
+    if source is None:
+        SOURCE_CACHE.pop(key)
+    return source
+
+# --- Views ---
+_BUTTON_LABELS = {
+    "prev": ("⬅️ Previous", discord.ButtonStyle.secondary),
+    "req": ("Request", discord.ButtonStyle.success),
+    "next": ("Next ➡️", discord.ButtonStyle.secondary),
+}
+
+class MediaPageButton(DynamicItem[Button], template=r"jr:m:(?P<action>prev|next|req):(?P<key>[A-Za-z0-9]+):(?P<index>\d+)"
+                                                     r"(?::(?P<media_type>movie|tv):(?P<tmdb_id>\d+))?"):
+    """A persistent Previous/Request/Next button for media results (search and discover).
+
+    The Request button also carries the media type and TMDB id of the item shown, because the source
+    behind the key may have been replaced (a newer search, an expired cache entry) since it was rendered.
+    """
+    def __init__(self, action: str, key: str, index: int, disabled: bool = False, label: str = None,
+                 media_type: str = None, tmdb_id: int = None):
+        default_label, style = _BUTTON_LABELS[action]
+        custom_id = f"jr:m:{action}:{key}:{index}"
+        if media_type and tmdb_id:
+            custom_id += f":{media_type}:{tmdb_id}"
+        super().__init__(Button(label=label or default_label, style=style, custom_id=custom_id, disabled=disabled))
+        self.action = action
+        self.key = key
+        self.index = index
+        self.media_type = media_type
+        self.tmdb_id = tmdb_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        tmdb_id = int(match["tmdb_id"]) if match["tmdb_id"] else None
+        return cls(match["action"], match["key"], int(match["index"]), media_type=match["media_type"], tmdb_id=tmdb_id)
+
+    async def callback(self, interaction: discord.Interaction):
+        component = f"media_{self.action}"
+        with COMPONENT_LATENCY.time(component=component), trace(component, user_id=str(interaction.user.id)):
+            await self._press(interaction)
+
+    async def _press(self, interaction: discord.Interaction):
+        jellyseerr = interaction.client.jellyseerr
+        if self.action == "req":
+            await request_media(interaction, self.media_type, self.tmdb_id)
+            return
+        with span("discord.defer"):
+            await interaction.response.defer()
+        index = self.index + (1 if self.action == "next" else -1)
+        try:
+            page = await render_media_page(jellyseerr, self.key, index)
+        except UpstreamError as e:
+            await interaction.followup.send(f"❌ Could not load more results: {e}", ephemeral=True)
+            return
+        if page is None:
+            await interaction.followup.send("⚠️ These results are no longer available, please run the command again.", ephemeral=True)
+            return
+        embed, view = page
+        with span("discord.edit"):
+            await interaction.edit_original_response(embed=embed, view=view)
+
+
+class RequestPageButton(DynamicItem[Button], template=r"jr:r:(?P<action>prev|next):(?P<key>[A-Za-z0-9]+):(?P<index>\d+)"):
+    """A persistent Previous/Next button for a user's requests."""
+    def __init__(self, action: str, key: str, index: int, disabled: bool = False):
+        label, style = _BUTTON_LABELS[action]
+        super().__init__(Button(label=label, style=style, custom_id=f"jr:r:{action}:{key}:{index}", disabled=disabled))
+        self.action = action
+        self.key = key
+        self.index = index
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(match["action"], match["key"], int(match["index"]))
+
+    async def callback(self, interaction: discord.Interaction):
+        component = f"requests_{self.action}"
+        with COMPONENT_LATENCY.time(component=component), trace(component, user_id=str(interaction.user.id)):
+            await self._press(interaction)
+
+    async def _press(self, interaction: discord.Interaction):
+        with span("discord.defer"):
+            await interaction.response.defer()
+        index = self.index + (1 if self.action == "next" else -1)
+        page = await render_request_page(interaction.client.jellyseerr, self.key, index)
+        if page is None:
+            await interaction.followup.send("⚠️ This request is no longer available, please run `/requests` again.", ephemeral=True)
+            return
+        embed, view = page
+        with span("discord.edit"):
+            await interaction.edit_original_response(embed=embed, view=view)
+
+
+class PaginationView(View):
+    """A stateless view for paginating through media results, allowing users to request media.
+
+    All state lives in the buttons' custom_ids, so the view survives restarts and holds no results.
+    The Request button is disabled for media that is already requested or available.
+    """
+    def __init__(self, key: str, index: int, total_results: int, item, status: int = None):
+        super().__init__(timeout=None)
+        self.add_item(MediaPageButton("prev", key, index, disabled=index == 0))
+        media = {"media_type": item.media_type, "tmdb_id": item.tmdb_id}
+        if status in UNREQUESTABLE:
+            self.add_item(MediaPageButton("req", key, index, disabled=True, label=STATUS_LABELS[status], **media))
+        else:
+            self.add_item(MediaPageButton("req", key, index, **media))
+        self.add_item(MediaPageButton("next", key, index, disabled=index >= total_results - 1))
+
+
+class RequestsPaginationView(View):
+    """A stateless view for paginating through a user's media requests."""
+    def __init__(self, key: str, index: int, total_results: int):
+        super().__init__(timeout=None)
+        self.add_item(RequestPageButton("prev", key, index, disabled=index == 0))
+        self.add_item(RequestPageButton("next", key, index, disabled=index >= total_results - 1))
+
+# --- Page Rendering ---
+def _mark_stale(embed: discord.Embed, stale_reads: list):
+    if stale_reads:
+        embed.set_footer(text=f"{embed.footer.text} · ⚠️ Jellyseerr is unreachable, showing cached data")
+
+async def render_media_page(jellyseerr: UpstreamClient, key: str, index: int, source=None):
+    """Returns (embed, view) for one media result, or None if the source or item is gone.
+
+    source is the source behind key if the caller has just opened it, otherwise it is looked up.
+    """
+    with track_stale() as stale_reads:
+        if source is None:
+            source = await get_source(jellyseerr, key)
+        if source is None:
+            return None
+        item = await source.get(index)
+        if item is None:
+            return None
+        source.prefetch(index)
+        total_results = source.total
+        status = media_status.status(item.media_type, item.tmdb_id)
+        embed = create_embed_for_item(item, index, total_results, STATUS_LABELS.get(status))
+    _mark_stale(embed, stale_reads)
+    return embed, PaginationView(key, index, total_results, item, status)
+
+async def render_request_page(jellyseerr: UpstreamClient, key: str, index: int):
+    """Returns (embed, view) for one of a user's requests, or None if it is gone.
+
+    The media details of the neighbouring requests are warmed in the background so the next page flip
+    is served from the media details cache.
+    """
+    with track_stale() as stale_reads:
+        source = await get_source(jellyseerr, key)
+        if source is None:
+            return None
+        try:
+            request = await source.get(index)
+        except UpstreamError as e:
+            print(f"Error fetching request {index + 1}: {e}")
+            return None
+        if request is None:
+            return None
+        source.prefetch(index)
+        total_results = source.total
+        embed = await create_request_embed(request, index, total_results, jellyseerr)
+    _mark_stale(embed, stale_reads)
+    for neighbour in (index + 1, index - 1):
+        if 0 <= neighbour < total_results:
+            with priority(PREFETCH):
+                task = asyncio.create_task(_warm_request(jellyseerr, source, neighbour))
+            _prefetch_tasks.add(task)
+            task.add_done_callback(_prefetch_tasks.discard)
+    return embed, RequestsPaginationView(key, index, total_results)
+
+async def _warm_request(jellyseerr: UpstreamClient, source, index: int):
+    async with _prefetch_semaphore:
+        try:
+            request = await source.get(index)
+            if request is not None and request.tmdb_id:
+                await fetch_media_details(jellyseerr, request.media_type or "unknown", request.tmdb_id)
+        except UpstreamError:
+            pass # The page is fetched again when it is actually shown.
+
+# --- Requesting Media ---
+async def request_media(interaction: discord.Interaction, media_type: str, tmdb_id: int):
+    """Requests the media item named by a Request button on behalf of the interacting user."""
+    with span("discord.defer"):
+        await interaction.response.defer(ephemeral=True)
+
+    if not media_type or not tmdb_id: # Buttons rendered before the media was part of their custom_id
+        await interaction.followup.send("⚠️ These results are no longer available, please run the command again.", ephemeral=True)
+        return
+
+    # Known duplicates are answered locally instead of with a POST that Jellyseerr rejects with a 409
+    if not media_status.is_requestable(media_type, tmdb_id):
+        await interaction.followup.send("⚠️ This item is already available or has been requested.", ephemeral=True)
+        return
+
+    linked_user_data = await get_linked_user(str(interaction.user.id))
+
+    if not linked_user_data or not linked_user_data[0]: # Jellyseerr User ID is the first element
+        await interaction.followup.send("⚠️ You need to link your Discord account to a Jellyseerr user first using `/link`.", ephemeral=True)
+        return
+
+    jellyseerr_user_id = int(linked_user_data[0])
+
+    # Double clicks and concurrent requests for the same media are collapsed by the submission queue
+    with span("submission") as record: # The POST itself runs on a submission worker
+        result = await submissions.submit(jellyseerr_user_id, media_type, tmdb_id)
+        if record is not None:
+            record["outcome"] = result.outcome
+    if result.outcome == REQUESTED:
+        title = _shown_title(interaction.message) or "the selected item"
+        await interaction.followup.send(f"✅ Successfully requested '{title}'!", ephemeral=True)
+        await _disable_request_button(interaction, media_type, tmdb_id)
+    elif result.outcome == DUPLICATE:
+        await interaction.followup.send("⚠️ This item is already available or has been requested.", ephemeral=True)
+        await _disable_request_button(interaction, media_type, tmdb_id)
+    elif result.error.status is not None:
+        e = result.error
+        await interaction.followup.send(f"❌ An error occurred: {e.status} - {e.details()}", ephemeral=True)
+        print(f"Error requesting item: {e.text}")
+    else:
+        await interaction.followup.send(f"❌ A network error occurred: {result.error}", ephemeral=True)
+
+def _shown_title(message) -> str:
+    """Returns the title of the media shown on a result message, without the " (year)" create_embed_for_item adds."""
+    embeds = getattr(message, "embeds", None)
+    if not embeds or not embeds[0].title:
+        return None
+    title, _, _ = embeds[0].title.rpartition(" (")
+    return title or embeds[0].title
+
+async def _disable_request_button(interaction: discord.Interaction, media_type: str, tmdb_id: int):
+    """Shows the media's new status on the message's Request button, keeping its other buttons as they are."""
+    try:
+        status = media_status.status(media_type, tmdb_id)
+        view = View.from_message(interaction.message, timeout=None)
+        for child in view.children:
+            if isinstance(child, Button) and (child.custom_id or "").startswith("jr:m:req:"):
+                child.disabled = True
+                child.label = STATUS_LABELS.get(status, child.label)
+        await interaction.message.edit(view=view)
+    except discord.HTTPException as e:
+        print(f"Failed to update the Request button: {e}")
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILER_INTERVAL_MS", 5)) / 1000
+MAX_PROFILE_SECONDS = 300
+
+# Leaf frame of an event loop waiting for I/O, counted as idle time rather than work.
+_IDLE_FRAME = "select (selectors.py:"
+
+class SamplingProfiler:
+    """A statistical profiler sampling the event loop thread's stack from a background thread.
+
+    Unlike cProfile it doesn't instrument the profiled code, so it is cheap enough to run in production
+    for a short while. Stacks are aggregated in the "folded" format (frames joined by ";" and a count per line)
+    read by flame graph tools such as speedscope, flamegraph.pl and inferno.
+    """
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.stacks = Counter() # Folded stack -> samples
+        self.samples = 0
+        self.idle = 0
+        self.started = None
+        self.duration = 0.0
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    @property
+    def running(self) -> bool:
+        return self._sampler is not None and self._sampler.is_alive()
+
+    def start(self):
+        """Starts sampling the calling thread, which should be the event loop's."""
+        self._thread_id = threading.get_ident()
+        self._stop.clear()
+        self.started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples += 1
+            if stack[0].startswith(_IDLE_FRAME):
+                self.idle += 1
+                continue
+            self.stacks[";".join(reversed(stack))] += 1
+
+    async def run(self, seconds: float):
+        """Profiles the event loop for the given number of seconds."""
+        self.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.stop()
+
+    def folded(self) -> str:
+        """Returns the busy stacks in the folded format, most sampled first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit: int = 10) -> list:
+        """Returns (function, self samples, total samples) for the functions the loop spent most time in."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(function, count, total[function]) for function, count in own.most_common(limit)]
+
+
+# The profile currently running, only one at a time.
+active_profile = None
+
+async def profile(seconds: float) -> SamplingProfiler:
+    """Profiles the event loop for up to MAX_PROFILE_SECONDS. Raises RuntimeError if a profile is already running."""
+    global active_profile
+    if active_profile is not None:
+        raise RuntimeError("A profile is already running.")
+    active_profile = SamplingProfiler()
+    try:
+        await active_profile.run(min(seconds, MAX_PROFILE_SECONDS))
+        return active_profile
+    finally:
+        active_profile = None
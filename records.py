@@ -0,0 +1,137 @@
+import sys
+import weakref
+
+from cache import register
+
+# Compact records for the Jellyseerr objects kept by paginated views and caches. Jellyseerr responses
+# carry credits, genres, vote data and more, but embeds and request submission only need a handful of
+# fields, so responses are parsed into slotted records as soon as they arrive.
+
+class InternTable:
+    """Shares equal records between every view and cache that holds them.
+
+    Records are held weakly, so a record disappears from the table once nothing else refers to it.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._records = weakref.WeakValueDictionary()
+        self.hits = 0 # Parsed records replaced by an existing, identical one
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def intern(self, record):
+        """Returns the shared record equal to record, storing record if there is none."""
+        existing = self._records.get(record.key)
+        if existing is not None and existing == record:
+            self.hits += 1
+            return existing
+        self.misses += 1
+        self._records[record.key] = record
+        return record
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._records),
+            "maxsize": 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+            "coalesced": 0,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+MEDIA_ITEMS = register(InternTable("media_items"))
+REQUEST_ITEMS = register(InternTable("request_items"))
+
+
+def _intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class _Record:
+    __slots__ = ("__weakref__",)
+    _fields = ()
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, field) for field in self._fields)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other._values() == self._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
+
+
+class MediaItem(_Record):
+    """A movie or TV show, as shown by /request, /discover and /requests."""
+    __slots__ = ("media_type", "tmdb_id", "title", "date", "overview", "poster_path")
+    _fields = __slots__
+
+    def __init__(self, media_type, tmdb_id, title, date, overview, poster_path):
+        self.media_type = _intern_str(media_type)
+        self.tmdb_id = tmdb_id
+        self.title = title
+        self.date = date
+        self.overview = overview
+        self.poster_path = poster_path
+
+    @property
+    def key(self):
+        return (self.media_type, self.tmdb_id)
+
+    @property
+    def year(self):
+        return self.date.split("-")[0] if self.date else None
+
+    @classmethod
+    def from_json(cls, data: dict, media_type: str = None) -> "MediaItem":
+        """Parses a Jellyseerr search, discover or details result into a shared MediaItem.
+
+        Details responses don't include mediaType, so it is passed in by the caller.
+        """
+        return MEDIA_ITEMS.intern(cls(
+            media_type or data.get("mediaType"),
+            data.get("id"),
+            data.get("title") or data.get("name"),
+            data.get("releaseDate") or data.get("firstAirDate"),
+            data.get("overview"),
+            data.get("posterPath"),
+        ))
+
+
+class RequestItem(_Record):
+    """One of a user's Jellyseerr requests, as shown by /requests."""
+    __slots__ = ("request_id", "status", "created_at", "media_type", "tmdb_id")
+    _fields = __slots__
+
+    def __init__(self, request_id, status, created_at, media_type, tmdb_id):
+        self.request_id = request_id
+        self.status = status
+        self.created_at = created_at
+        self.media_type = _intern_str(media_type)
+        self.tmdb_id = tmdb_id
+
+    @property
+    def key(self):
+        return self.request_id
+
+    @classmethod
+    def from_json(cls, data: dict) -> "RequestItem":
+        """Parses a Jellyseerr request into a shared RequestItem."""
+        media = data.get("media") or {}
+        return REQUEST_ITEMS.intern(cls(
+            data.get("id"),
+            data.get("status"),
+            data.get("createdAt"),
+            media.get("mediaType"),
+            media.get("tmdbId"),
+        ))
@@ -0,0 +1,189 @@
+import asyncio
+import os
+from urllib.parse import urlencode, quote
+
+from cache import TTLCache
+from upstream import UpstreamClient, UpstreamError, priority, PREFETCH
+from records import MediaItem, RequestItem
+
+# Discover pages are the same for every user, so they are shared across views.
+# The caches below keep serving expired entries (marked stale) while Jellyseerr is unreachable.
+DISCOVER_CACHE = TTLCache(
+    "discover",
+    maxsize=int(os.getenv("DISCOVER_CACHE_SIZE", 64)),
+    ttl=float(os.getenv("DISCOVER_CACHE_TTL", 900)),
+    stale_if_error=(UpstreamError,)
+)
+# Normalized /request search queries, shared by every user and coalesced while in flight.
+SEARCH_CACHE = TTLCache(
+    "search",
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", 512)),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", 600)),
+    stale_if_error=(UpstreamError,)
+)
+# Last known pages of each user's requests, as (RequestItems, total). They are always fetched
+# again, and only served as a stale fallback when Jellyseerr can't be reached.
+REQUEST_PAGE_CACHE = TTLCache("request_pages", maxsize=256, ttl=0, stale_if_error=(UpstreamError,))
+# Requests fetched per upstream call by RequestSource.
+REQUEST_PAGE_SIZE = 20
+# Start loading the next upstream page when the user is this close to the end of what is loaded.
+PREFETCH_MARGIN = 5
+
+class ListSource:
+    """A PaginationView source backed by a list that is already fully loaded (e.g. search results)."""
+    def __init__(self, items: list):
+        self.items = items
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    async def get(self, index: int):
+        return self.items[index] if 0 <= index < len(self.items) else None
+
+    def prefetch(self, index: int):
+        pass # Everything is loaded already.
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a search query so equivalent searches share a cache entry."""
+    return " ".join(query.casefold().split())
+
+
+async def search_media(jellyseerr: UpstreamClient, query: str) -> list:
+    """Returns Jellyseerr search results for a query as MediaItems, cached and coalesced in SEARCH_CACHE."""
+    normalized_query = normalize_query(query)
+
+    async def fetch():
+        # Jellyseerr rejects '+' for spaces, so the query string is pre-encoded with %20.
+        params = urlencode({"query": normalized_query}, quote_via=quote)
+        data = await jellyseerr.get_json("/api/v1/search", params=params)
+        return [MediaItem.from_json(result) for result in data.get("results", [])]
+    return await SEARCH_CACHE.get_or_fetch(normalized_query, fetch)
+
+
+async def fetch_discover_page(jellyseerr: UpstreamClient, kind: str, page: int) -> dict:
+    """Returns one page of /api/v1/discover/{movies|tv}, shared across users through DISCOVER_CACHE.
+
+    Only the page counters are kept from the response, results are parsed into MediaItems.
+    """
+    async def fetch():
+        data = await jellyseerr.get_json(f"/api/v1/discover/{kind}", params={"page": page})
+        return {
+            "results": [MediaItem.from_json(result) for result in data.get("results", [])],
+            "totalResults": data.get("totalResults"),
+            "totalPages": data.get("totalPages"),
+        }
+    return await DISCOVER_CACHE.get_or_fetch((kind, page), fetch)
+
+
+class LazySource:
+    """Base class for PaginationView sources that load upstream pages on demand.
+
+    Subclasses implement _fetch_next(), which loads the next upstream page and returns
+    (items, total_results, exhausted). Pages are loaded in order, one at a time.
+    """
+    def __init__(self):
+        self.items = []
+        self._total_results = None
+        self._exhausted = False
+        self._lock = asyncio.Lock()
+        self._prefetch_task = None
+
+    @property
+    def total(self) -> int:
+        """The total number of results reported upstream, or the number loaded once exhausted."""
+        if self._exhausted or self._total_results is None:
+            return len(self.items)
+        return max(self._total_results, len(self.items))
+
+    async def _fetch_next(self):
+        raise NotImplementedError
+
+    async def _load_next_page(self):
+        async with self._lock:
+            if self._exhausted:
+                return
+            items, total_results, exhausted = await self._fetch_next()
+            self.items.extend(items)
+            self._total_results = total_results
+            self._exhausted = exhausted or not items
+
+    async def get(self, index: int):
+        """Returns the item at index, loading upstream pages as needed, or None past the end."""
+        while index >= len(self.items) and not self._exhausted:
+            await self._load_next_page()
+        return self.items[index] if 0 <= index < len(self.items) else None
+
+    def prefetch(self, index: int):
+        """Starts loading the next page in the background if index is near the end of the loaded items."""
+        if self._exhausted or index < len(self.items) - PREFETCH_MARGIN:
+            return
+        if self._prefetch_task is None or self._prefetch_task.done():
+            with priority(PREFETCH):
+                self._prefetch_task = asyncio.create_task(self._prefetch())
+
+    async def _prefetch(self):
+        try:
+            await self._load_next_page()
+        except Exception as e:
+            # The page is fetched again when it is actually needed.
+            print(f"Failed to prefetch the next page for {type(self).__name__}: {e}")
+
+
+class DiscoverSource(LazySource):
+    """A lazy PaginationView source over the Jellyseerr discover feeds.
+
+    Movie and TV pages are fetched concurrently and interleaved. The next pair of pages is loaded
+    in the background once the user pages close to the end of what has been loaded.
+    """
+    def __init__(self, jellyseerr: UpstreamClient):
+        super().__init__()
+        self.jellyseerr = jellyseerr
+        self._next_page = 1
+
+    async def _fetch_next(self):
+        page = self._next_page
+        movies, tv_shows = await asyncio.gather(
+            fetch_discover_page(self.jellyseerr, "movies", page),
+            fetch_discover_page(self.jellyseerr, "tv", page)
+        )
+        movie_results = movies.get("results", [])
+        tv_results = tv_shows.get("results", [])
+        items = []
+        for index in range(max(len(movie_results), len(tv_results))):
+            if index < len(movie_results):
+                items.append(movie_results[index])
+            if index < len(tv_results):
+                items.append(tv_results[index])
+
+        total_results = (movies.get("totalResults") or 0) + (tv_shows.get("totalResults") or 0)
+        total_pages = max(movies.get("totalPages") or 0, tv_shows.get("totalPages") or 0)
+        self._next_page = page + 1
+        return items, total_results, page >= total_pages
+
+
+class RequestSource(LazySource):
+    """A lazy, cursor-backed source over one user's Jellyseerr requests, newest first.
+
+    Requests are fetched in chunks of REQUEST_PAGE_SIZE, already sorted by the server, and the
+    next chunk is loaded as the user pages forward. total is the true count reported by Jellyseerr.
+    """
+    def __init__(self, jellyseerr: UpstreamClient, jellyseerr_user_id):
+        super().__init__()
+        self.jellyseerr = jellyseerr
+        self.jellyseerr_user_id = jellyseerr_user_id
+        self._skip = 0 # Cursor into the server-side ordering.
+
+    async def _fetch_next(self):
+        params = { "take": REQUEST_PAGE_SIZE, "skip": self._skip, "sort": "added",
+                   "filter": "all", "requestedBy": self.jellyseerr_user_id }
+
+        async def fetch():
+            data = await self.jellyseerr.get_json("/api/v1/request", params=params)
+            results = [RequestItem.from_json(request) for request in data.get("results", [])]
+            return results, (data.get("pageInfo") or {}).get("results")
+        results, total_results = await REQUEST_PAGE_CACHE.fetch_or_stale((str(self.jellyseerr_user_id), self._skip), fetch)
+        self._skip += len(results)
+        exhausted = len(results) < REQUEST_PAGE_SIZE or (total_results is not None and self._skip >= total_results)
+        return results, total_results, exhausted
@@ -0,0 +1,131 @@
+import asyncio
+from collections import namedtuple
+
+from media_index import media_status, PENDING
+from upstream import UpstreamClient, UpstreamError
+
+SUBMISSION_WORKERS = 3 # Requests POSTed to Jellyseerr at once.
+DEDUP_WINDOW_SECONDS = 30 # Finished submissions keep answering duplicates for this long.
+
+# Outcomes of a submission
+REQUESTED = "requested" # This submission created the request.
+DUPLICATE = "duplicate" # The media was already requested or available (409, or collapsed into another user's request).
+FAILED = "failed" # Jellyseerr rejected the request or could not be reached, see error.
+
+SubmissionResult = namedtuple("SubmissionResult", "outcome error")
+
+class _Submission:
+    __slots__ = ("user_id", "media_type", "tmdb_id", "future")
+
+    def __init__(self, user_id: int, media_type: str, tmdb_id, future: asyncio.Future):
+        self.user_id = user_id
+        self.media_type = media_type
+        self.tmdb_id = tmdb_id
+        self.future = future
+
+
+class SubmissionQueue:
+    """Submits media requests to Jellyseerr through a queue drained by a bounded worker pool.
+
+    - Idempotency: a user submitting the same media again (e.g. a double click) while the first
+      submission is queued, in flight or finished less than DEDUP_WINDOW_SECONDS ago gets its result.
+    - Deduplication: other users submitting the same media in that window are answered with
+      DUPLICATE instead of racing Jellyseerr for a 409. If the first submission failed, theirs is
+      submitted on its own.
+    """
+    def __init__(self):
+        self.jellyseerr = None
+        self._queue = asyncio.Queue()
+        self._by_user = {} # (user_id, media_type, tmdb_id) -> future
+        self._by_media = {} # (media_type, tmdb_id) -> future of the submission that is POSTed
+        self._workers = []
+
+    def start(self, jellyseerr: UpstreamClient):
+        self.jellyseerr = jellyseerr
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(SUBMISSION_WORKERS)]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    async def submit(self, user_id: int, media_type: str, tmdb_id) -> SubmissionResult:
+        """Requests media on behalf of a Jellyseerr user and waits for the outcome."""
+        user_key = (user_id, media_type, tmdb_id)
+        future = self._by_user.get(user_key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._by_user[user_key] = future
+            future.add_done_callback(lambda _: self._forget_later(self._by_user, user_key, future))
+            submission = _Submission(user_id, media_type, tmdb_id, future)
+            leader = self._by_media.get((media_type, tmdb_id))
+            if leader is None:
+                self._enqueue(submission)
+            else:
+                leader.add_done_callback(lambda done: self._follow(done, submission))
+        # Shielded so a cancelled interaction doesn't cancel the result other callers share.
+        return await asyncio.shield(future)
+
+    def _enqueue(self, submission: _Submission):
+        media_key = (submission.media_type, submission.tmdb_id)
+        self._by_media[media_key] = submission.future
+        submission.future.add_done_callback(lambda _: self._forget_later(self._by_media, media_key, submission.future))
+        self._queue.put_nowait(submission)
+
+    def _follow(self, leader: asyncio.Future, submission: _Submission):
+        if not leader.cancelled() and leader.result().outcome != FAILED:
+            submission.future.set_result(SubmissionResult(DUPLICATE, None))
+            return
+        # The failure may be specific to the first user (e.g. a request quota), so submit this one on its own.
+        leader = self._by_media.get((submission.media_type, submission.tmdb_id))
+        if leader is None or leader.done():
+            self._enqueue(submission)
+        else:
+            leader.add_done_callback(lambda done: self._follow(done, submission))
+
+    def _forget_later(self, table: dict, key, future: asyncio.Future):
+        def forget():
+            if table.get(key) is future:
+                del table[key]
+        if future.cancelled() or future.result().outcome == FAILED:
+            forget() # Failed submissions can be retried straight away.
+        else:
+            asyncio.get_running_loop().call_later(DEDUP_WINDOW_SECONDS, forget)
+
+    async def _post(self, submission: _Submission) -> SubmissionResult:
+        payload = {
+            "mediaType": submission.media_type,
+            "mediaId": submission.tmdb_id,
+            "userId": submission.user_id,
+        }
+        if submission.media_type == 'tv':
+            payload['seasons'] = 'all'
+        try:
+            (await self.jellyseerr.post("/api/v1/request", json=payload)).raise_for_status()
+        except UpstreamError as e:
+            if e.status != 409:
+                return SubmissionResult(FAILED, e)
+            outcome = DUPLICATE
+        else:
+            outcome = REQUESTED
+        await media_status.mark(submission.media_type, submission.tmdb_id, PENDING)
+        return SubmissionResult(outcome, None)
+
+    async def _worker(self):
+        while True:
+            submission = await self._queue.get()
+            try:
+                result = await self._post(submission)
+            except asyncio.CancelledError:
+                submission.future.cancel()
+                raise
+            except Exception as e:
+                print(f"An unexpected error occurred while submitting a request: {e}")
+                result = SubmissionResult(FAILED, UpstreamError(str(e)))
+            finally:
+                self._queue.task_done()
+            submission.future.set_result(result)
+
+
+submissions = SubmissionQueue()
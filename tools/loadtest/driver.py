@@ -0,0 +1,481 @@
+"""Drives the bot's commands and buttons against local Jellyseerr/Jellyfin stand-ins and reports latency.
+
+The cogs are loaded against a scratch database, without connecting to Discord: commands are invoked
+through their callbacks with mocked interactions, and buttons are dispatched from the custom_ids of
+the views the commands send, like discord.py does for persistent items. Virtual users run sessions
+concurrently (a command, then a few button presses on its result) and the driver reports p50/p95/p99
+latency per operation, event loop lag, and the upstream calls counted by the fake servers.
+
+    python tools/loadtest/driver.py --concurrency 50 --sessions 1000 --output baseline.json
+    # ...make a change, then compare against the recorded run:
+    python tools/loadtest/driver.py --concurrency 50 --sessions 1000 --baseline baseline.json
+
+Unless --jellyseerr-url and --jellyfin-url are given, fake_servers.py is started in a separate
+process so that its work doesn't show up as event loop lag.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+import aiohttp
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_servers import add_config_arguments, jellyfin_user_id
+import tracing
+
+FIRST_DISCORD_ID = 10**17 # Discord IDs of the virtual users start here.
+LAG_INTERVAL_SECONDS = 0.01 # Sampling interval of the event loop lag monitor.
+SCENARIOS = ("request", "discover", "requests", "watch", "link")
+DEFAULT_MIX = {"request": 4, "discover": 2, "requests": 2, "watch": 1, "link": 1}
+
+# --- Mocked Discord objects ---
+class FakeResponse:
+    """Stands in for discord.InteractionResponse."""
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, *, ephemeral: bool = False, thinking: bool = False):
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.record(content, **kwargs)
+
+    async def edit_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.record(content, **kwargs)
+
+
+class FakeWebhook:
+    """Stands in for interaction.followup."""
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.record(content, **kwargs)
+
+
+class FakeMessage:
+    """Stands in for the message a button is attached to."""
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self.embeds = []
+        self.components = []
+
+    async def edit(self, content=None, **kwargs):
+        self._interaction.record(content, **kwargs)
+
+
+class FakeInteraction:
+    """A mocked discord.Interaction that records what the bot sends back."""
+    def __init__(self, bot, user):
+        self.client = bot
+        self.user = user
+        self.guild = None
+        self.guild_id = None
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeWebhook(self)
+        self.message = FakeMessage(self)
+        self.content = None # Last text sent
+        self.view = None # Last view sent
+
+    def record(self, content=None, *, view=None, **kwargs):
+        if content is not None:
+            self.content = content
+        if view is not None:
+            self.view = view
+
+    async def edit_original_response(self, content=None, **kwargs):
+        self.record(content, **kwargs)
+
+    @property
+    def outcome(self) -> str:
+        content = self.content or ""
+        if content.startswith(("❌", "An error", "An unexpected")):
+            return "error"
+        if content.startswith("⚠️"):
+            return "warning"
+        return "ok"
+
+
+class FakeBot:
+    """The parts of JellyBot the cogs use outside of Discord events."""
+    def __init__(self, jellyseerr, jellyfin):
+        self.jellyseerr = jellyseerr
+        self.jellyfin = jellyfin
+        self.user = SimpleNamespace(name="loadtest")
+
+    def get_guild(self, guild_id):
+        return None
+
+    def get_user(self, user_id):
+        return None
+
+
+def virtual_user(index: int) -> SimpleNamespace:
+    discord_id = FIRST_DISCORD_ID + index
+    return SimpleNamespace(id=discord_id, name=f"vu{index}", display_name=f"Virtual User {index}",
+                           mention=f"<@{discord_id}>")
+
+
+# --- Measurements ---
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(samples: list) -> dict:
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task sleeping LAG_INTERVAL_SECONDS."""
+    def __init__(self):
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL_SECONDS)
+            self.samples.append(max(0.0, loop.time() - started - LAG_INTERVAL_SECONDS))
+
+
+class LoadTest:
+    def __init__(self, args, bot, cogs: dict):
+        self.args = args
+        self.bot = bot
+        self.cogs = cogs
+        self.random = random.Random(args.seed)
+        self.latencies = defaultdict(list) # operation -> seconds
+        self.outcomes = defaultdict(Counter) # operation -> outcome -> count
+        self.exceptions = Counter()
+        self._remaining = args.sessions
+        weights = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+        self.scenarios = [scenario for scenario in SCENARIOS if weights.get(scenario)]
+        self.weights = [weights[scenario] for scenario in self.scenarios]
+        # Queries are picked with a Zipf-like skew, a few popular titles and a long tail.
+        self.queries = [f"title {i}" for i in range(args.queries)]
+        self.query_weights = [1 / (rank + 1) for rank in range(args.queries)]
+
+    async def _timed(self, operation: str, interaction: FakeInteraction, coro):
+        started = time.perf_counter()
+        try:
+            await coro
+        except Exception as e:
+            self.exceptions[f"{operation}: {type(e).__name__}: {e}"] += 1
+            self.outcomes[operation]["exception"] += 1
+        else:
+            self.outcomes[operation][interaction.outcome] += 1
+        self.latencies[operation].append(time.perf_counter() - started)
+
+    async def _command(self, operation: str, user, command, *args) -> FakeInteraction:
+        interaction = FakeInteraction(self.bot, user)
+        # Traced like JellyCommandTree does, so slow traces are logged during load tests too.
+        with tracing.trace(f"/{command.qualified_name}", user_id=str(user.id)):
+            await self._timed(operation, interaction, command.callback(command.binding, interaction, *args))
+        return interaction
+
+    async def _press(self, operation: str, user, view, action: str):
+        """Presses the button of a view the way discord.py dispatches a DynamicItem, from its custom_id."""
+        for child in view.children:
+            if getattr(child, "action", None) == action and not child.item.disabled:
+                break
+        else:
+            return None
+        interaction = FakeInteraction(self.bot, user)
+        match = child.template.fullmatch(child.custom_id)
+        button = await type(child).from_custom_id(interaction, child.item, match)
+        await self._timed(operation, interaction, button.callback(interaction))
+        return interaction
+
+    async def _page(self, prefix: str, user, interaction: FakeInteraction):
+        view = interaction.view
+        for _ in range(self.random.randint(0, self.args.pages)):
+            if view is None:
+                return
+            pressed = await self._press(f"{prefix}_next", user, view, "next")
+            if pressed is None:
+                return
+            view = pressed.view or view
+        if prefix == "media" and view is not None and self.random.random() < self.args.request_rate:
+            await self._press("media_request", user, view, "req")
+
+    async def _session(self, index: int):
+        user = virtual_user(index)
+        scenario = self.random.choices(self.scenarios, self.weights)[0]
+        media_cog, utility_cog, user_cog = self.cogs["media"], self.cogs["utility"], self.cogs["users"]
+        if scenario == "request":
+            query = self.random.choices(self.queries, self.query_weights)[0]
+            interaction = await self._command("request_cmd", user, media_cog.request_cmd, query)
+            await self._page("media", user, interaction)
+        elif scenario == "discover":
+            interaction = await self._command("discover_cmd", user, media_cog.discover_cmd)
+            await self._page("media", user, interaction)
+        elif scenario == "requests":
+            interaction = await self._command("my_requests_cmd", user, utility_cog.my_requests_cmd)
+            await self._page("requests", user, interaction)
+        elif scenario == "watch":
+            await self._command("watch_stats_cmd", user, utility_cog.watch_stats_cmd)
+        elif scenario == "link":
+            await self._command("link_cmd", user, user_cog.link_cmd, f"user{index % self.args.users}", "password")
+
+    async def _virtual_user(self, index: int):
+        while self._remaining > 0:
+            self._remaining -= 1
+            await self._session(index)
+            if self.args.think_ms:
+                await asyncio.sleep(self.random.uniform(0, 2 * self.args.think_ms) / 1000)
+
+    async def run(self) -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*(self._virtual_user(index) for index in range(self.args.concurrency)))
+        return time.perf_counter() - started
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in filter(None, mix.split(",")):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}', expected one of: {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+# --- Setup ---
+async def start_fake_servers(args):
+    """Starts fake_servers.py in a child process and returns (process, jellyseerr_url, jellyfin_url)."""
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_servers.py"),
+               "--jellyseerr-port", "0", "--jellyfin-port", "0",
+               "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+               "--error-rate", str(args.error_rate), "--media", str(args.media), "--users", str(args.users),
+               "--requests-per-user", str(args.requests_per_user), "--played-per-user", str(args.played_per_user),
+               "--seed", str(args.seed)]
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+    line = (await asyncio.wait_for(process.stdout.readline(), timeout=30)).decode()
+    if not line.startswith("READY"):
+        process.kill()
+        raise SystemExit("The fake servers failed to start.")
+    urls = dict(part.split("=", 1) for part in line.split()[1:])
+    return process, urls["jellyseerr"], urls["jellyfin"]
+
+
+async def fake_server_stats(session: aiohttp.ClientSession, url: str, reset: bool = False) -> dict:
+    async with session.request("POST" if reset else "GET", f"{url}/_reset" if reset else f"{url}/_stats") as resp:
+        return {} if reset else await resp.json()
+
+
+async def setup_bot(args, jellyseerr_url: str, jellyfin_url: str):
+    """Opens the scratch database, links the virtual users and loads the cogs the way setup_hook does."""
+    import utils
+    from leader import leadership
+    from upstream import UpstreamClient
+    from cogs.media_cog import MediaCommandsCog
+    from cogs.utility_cog import UtilityCog
+    from cogs.user_management_cog import UserManagementCog
+
+    utils.init_db()
+    burst = max(1, int(args.max_rps * 2))
+    jellyseerr = UpstreamClient("jellyseerr", jellyseerr_url, {"X-Api-Key": "loadtest", "Content-Type": "application/json"},
+                                pool_size=args.max_concurrency, rate=args.max_rps, burst=burst, health_path="/api/v1/status")
+    jellyfin = UpstreamClient("jellyfin", jellyfin_url, {"X-Emby-Token": "loadtest", "Content-Type": "application/json"},
+                              pool_size=args.max_concurrency, rate=args.max_rps, burst=burst, health_path="/System/Info/Public")
+    await jellyseerr.start()
+    await jellyfin.start()
+
+    # Every virtual user is linked, except those that only run /link, which links them on the way.
+    await utils.store_linked_users([
+        (str(virtual_user(index).id), str(index % args.users + 1), jellyfin_user_id(index % args.users),
+         f"user{index % args.users}", None, None, None)
+        for index in range(args.concurrency)
+    ])
+    await utils.load_linked_users()
+    leadership.start(shared=False) # A single process runs the background jobs, like the bot without launcher.py.
+
+    bot = FakeBot(jellyseerr, jellyfin)
+    cogs = {
+        "media": MediaCommandsCog(bot, jellyseerr),
+        "utility": UtilityCog(bot, jellyfin, jellyseerr),
+        "users": UserManagementCog(bot, jellyseerr, jellyfin),
+    }
+    for cog in cogs.values():
+        await cog.cog_load()
+    return bot, cogs
+
+
+async def teardown_bot(bot, cogs: dict):
+    import utils
+    for cog in cogs.values():
+        cog.cog_unload()
+    await bot.jellyseerr.close()
+    await bot.jellyfin.close()
+    utils.db.close()
+
+
+# --- Reporting ---
+def build_report(args, load_test: LoadTest, elapsed: float, lag: LoopLagMonitor, upstream: dict, bot) -> dict:
+    import cache
+    operations = {}
+    for operation, samples in sorted(load_test.latencies.items()):
+        operations[operation] = {**summarize(samples), "outcomes": dict(load_test.outcomes[operation])}
+    total_operations = sum(len(samples) for samples in load_test.latencies.values())
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "elapsed_s": elapsed,
+        "throughput_ops_s": total_operations / elapsed if elapsed else 0.0,
+        "operations": operations,
+        "loop_lag": summarize(lag.samples),
+        "upstream": upstream,
+        "schedulers": {client.name: client.scheduler.stats() for client in (bot.jellyseerr, bot.jellyfin)},
+        "caches": {name: registered.stats() for name, registered in sorted(cache.registry.items())},
+        "exceptions": dict(load_test.exceptions.most_common(10)),
+    }
+
+
+def _delta(current: float, baseline: float) -> str:
+    if not baseline:
+        return ""
+    return f" ({(current - baseline) / baseline:+.0%})"
+
+
+def print_report(report: dict, baseline: dict = None):
+    baseline = baseline or {}
+    base_operations = baseline.get("operations", {})
+    print(f"\n{'operation':<18}{'count':>7}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}   outcomes")
+    for operation, stats in report["operations"].items():
+        base = base_operations.get(operation, {})
+        columns = "".join(f"{stats[key]:>8.1f}{_delta(stats[key], base.get(key)):<10}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        outcomes = ", ".join(f"{name}={count}" for name, count in sorted(stats["outcomes"].items()))
+        print(f"{operation:<18}{stats['count']:>7}{columns}   {outcomes}")
+
+    lag, base_lag = report["loop_lag"], baseline.get("loop_lag", {})
+    print(f"\nEvent loop lag: p50 {lag['p50_ms']:.2f} ms, p99 {lag['p99_ms']:.2f} ms{_delta(lag['p99_ms'], base_lag.get('p99_ms'))}, "
+          f"max {lag['max_ms']:.2f} ms")
+    print(f"Throughput: {report['throughput_ops_s']:.1f} ops/s over {report['elapsed_s']:.1f} s"
+          f"{_delta(report['throughput_ops_s'], baseline.get('throughput_ops_s'))}")
+
+    for backend, stats in report["upstream"].items():
+        base_calls = baseline.get("upstream", {}).get(backend, {}).get("calls", {})
+        total = sum(stats["calls"].values())
+        print(f"\nUpstream calls to {backend}: {total}{_delta(total, sum(base_calls.values()))}")
+        for endpoint, count in sorted(stats["calls"].items(), key=lambda item: -item[1]):
+            errors = stats["errors"].get(endpoint, 0)
+            print(f"  {endpoint:<40}{count:>7}{_delta(count, base_calls.get(endpoint)):<10}"
+                  f"{f'  {errors} injected error(s)' if errors else ''}")
+
+    for message, count in report["exceptions"].items():
+        print(f"\n{count}x {message}")
+
+
+def regressions(report: dict, baseline: dict, threshold: float) -> list:
+    """Returns the operations whose p95 latency regressed by more than threshold (a fraction) against the baseline."""
+    regressed = []
+    for operation, stats in report["operations"].items():
+        base = baseline.get("operations", {}).get(operation)
+        if base and base["p95_ms"] and (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"] > threshold:
+            regressed.append(operation)
+    return regressed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20, help="Virtual users running sessions at once")
+    parser.add_argument("--sessions", type=int, default=200, help="Sessions to run in total")
+    parser.add_argument("--mix", help="Scenario weights, e.g. request=4,discover=2,requests=2,watch=1,link=1")
+    parser.add_argument("--pages", type=int, default=3, help="Maximum Next presses after a command")
+    parser.add_argument("--request-rate", type=float, default=0.2, help="Chance of pressing Request after browsing results")
+    parser.add_argument("--queries", type=int, default=100, help="Distinct search queries")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a virtual user's sessions")
+    parser.add_argument("--settle", type=float, default=2, help="Seconds to let background syncs finish before measuring")
+    parser.add_argument("--max-rps", type=float, default=float(os.getenv("JELLYSEERR_MAX_RPS", 20)))
+    parser.add_argument("--max-concurrency", type=int, default=int(os.getenv("JELLYSEERR_MAX_CONCURRENCY", 20)))
+    parser.add_argument("--jellyseerr-url", help="Use an already running Jellyseerr stand-in")
+    parser.add_argument("--jellyfin-url", help="Use an already running Jellyfin stand-in")
+    parser.add_argument("--output", help="Write the report as JSON, e.g. to record a baseline")
+    parser.add_argument("--baseline", help="A JSON report to compare against")
+    parser.add_argument("--max-regression", type=float,
+                        help="With --baseline, exit with status 1 if any p95 grew by more than this fraction")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    process = None
+    if args.jellyseerr_url and args.jellyfin_url:
+        jellyseerr_url, jellyfin_url = args.jellyseerr_url, args.jellyfin_url
+    else:
+        process, jellyseerr_url, jellyfin_url = await start_fake_servers(args)
+
+    # The bot keeps its database under ./data, so run from a scratch directory.
+    args.output = args.output and os.path.abspath(args.output)
+    args.baseline = args.baseline and os.path.abspath(args.baseline)
+    workdir = tempfile.mkdtemp(prefix="jellyrequest-loadtest-")
+    os.chdir(workdir)
+    bot = cogs = None
+    try:
+        bot, cogs = await setup_bot(args, jellyseerr_url, jellyfin_url)
+        await asyncio.sleep(args.settle)
+        async with aiohttp.ClientSession() as session:
+            for url in (jellyseerr_url, jellyfin_url):
+                await fake_server_stats(session, url, reset=True)
+
+            load_test = LoadTest(args, bot, cogs)
+            lag = LoopLagMonitor()
+            lag.start()
+            elapsed = await load_test.run()
+            lag.stop()
+
+            upstream = {"jellyseerr": await fake_server_stats(session, jellyseerr_url),
+                        "jellyfin": await fake_server_stats(session, jellyfin_url)}
+        report = build_report(args, load_test, elapsed, lag, upstream, bot)
+    finally:
+        if bot is not None:
+            await teardown_bot(bot, cogs)
+        if process is not None:
+            process.terminate()
+            await process.wait()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    if baseline and args.max_regression is not None:
+        regressed = regressions(report, baseline, args.max_regression)
+        if regressed:
+            print(f"\np95 regressed by more than {args.max_regression:.0%} for: {', '.join(regressed)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,345 @@
+"""Local stand-ins for the Jellyseerr and Jellyfin APIs used by the bot, for offline load tests.
+
+Both servers answer with deterministic, generated data shaped like the real APIs (only the fields
+the bot reads are filled in), with configurable latency, error rate and dataset sizes. Every request
+is counted per endpoint, GET /_stats returns the counters and POST /_reset clears them.
+
+    python tools/loadtest/fake_servers.py --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+
+Generated users are named user0, user1, ... and any password but "wrong" authenticates them.
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+PAGE_SIZE = 20 # Results per search and discover page, as in Jellyseerr.
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 50 # Mean added latency per request.
+    jitter_ms: float = 25 # Latency is drawn uniformly from latency_ms +/- jitter_ms.
+    error_rate: float = 0.0 # Fraction of requests answered with a 500, health checks excluded.
+    media: int = 2000 # Movies and TV shows in the catalogue (odd tmdb ids are movies, even ones TV).
+    users: int = 500 # Jellyseerr/Jellyfin users.
+    requests_per_user: int = 30 # Requests made by each user.
+    played_per_user: int = 400 # Played Jellyfin items per user.
+    seed: int = 1
+
+
+def _iso(seconds: float) -> str:
+    return (EPOCH + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def jellyfin_user_id(index: int) -> str:
+    return f"{index + 1:032x}"
+
+
+def _user_index(jellyfin_id: str):
+    try:
+        index = int(jellyfin_id, 16) - 1
+    except ValueError:
+        return None
+    return index if index >= 0 else None
+
+
+class FakeBackend:
+    """Shared behaviour of the fake servers: latency, error injection and per-endpoint counters."""
+    name = "backend"
+    health_paths = ()
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.calls = Counter() # "METHOD /route" -> count
+        self.errors = Counter() # Injected errors per endpoint
+        self.app = web.Application(middlewares=[self._middleware])
+        self.app.router.add_get("/_stats", self._stats)
+        self.app.router.add_post("/_reset", self._reset)
+        self._routes(self.app.router)
+
+    def _routes(self, router: web.UrlDispatcher):
+        raise NotImplementedError
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        if request.path.startswith("/_"):
+            return await handler(request)
+        route = request.match_info.route.resource
+        endpoint = f"{request.method} {route.canonical if route is not None else request.path}"
+        self.calls[endpoint] += 1
+        delay = self.config.latency_ms + self.random.uniform(-1, 1) * self.config.jitter_ms
+        await asyncio.sleep(max(0.0, delay) / 1000)
+        if request.path not in self.health_paths and self.random.random() < self.config.error_rate:
+            self.errors[endpoint] += 1
+            return web.json_response({"message": "Injected failure"}, status=500)
+        return await handler(request)
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": dict(self.calls), "errors": dict(self.errors)})
+
+    async def _reset(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        self.errors.clear()
+        return web.Response(status=204)
+
+
+class FakeJellyseerr(FakeBackend):
+    name = "jellyseerr"
+    health_paths = ("/api/v1/status",)
+
+    def __init__(self, config: FakeConfig):
+        super().__init__(config)
+        self.requested = set() # (media_type, tmdb_id) requested through POST /api/v1/request
+
+    def _routes(self, router: web.UrlDispatcher):
+        router.add_get("/api/v1/status", self.status)
+        router.add_get("/api/v1/search", self.search)
+        router.add_get("/api/v1/discover/movies", self.discover)
+        router.add_get("/api/v1/discover/tv", self.discover)
+        router.add_get("/api/v1/movie/{tmdb_id}", self.details)
+        router.add_get("/api/v1/tv/{tmdb_id}", self.details)
+        router.add_get("/api/v1/request", self.list_requests)
+        router.add_post("/api/v1/request", self.create_request)
+        router.add_get("/api/v1/user", self.list_users)
+        router.add_post("/api/v1/user/import-from-jellyfin", self.import_users)
+        router.add_get("/api/v1/media", self.list_media)
+
+    # --- Generated data ---
+    @staticmethod
+    def media_type(tmdb_id: int) -> str:
+        return "movie" if tmdb_id % 2 else "tv"
+
+    def media(self, tmdb_id: int, with_type: bool = True) -> dict:
+        media_type = self.media_type(tmdb_id)
+        title_field, date_field = ("title", "releaseDate") if media_type == "movie" else ("name", "firstAirDate")
+        result = {
+            "id": tmdb_id,
+            title_field: f"{'Movie' if media_type == 'movie' else 'Show'} {tmdb_id}",
+            date_field: f"{1970 + tmdb_id % 55}-01-01",
+            "overview": f"Generated {media_type} number {tmdb_id}. " * 4,
+            "posterPath": f"/poster{tmdb_id}.jpg",
+        }
+        if with_type:
+            result["mediaType"] = media_type
+        return result
+
+    def user(self, index: int) -> dict:
+        return {
+            "id": index + 1,
+            "username": f"user{index}",
+            "jellyfinUsername": f"user{index}",
+            "jellyfinUserId": jellyfin_user_id(index),
+            "displayName": f"User {index}",
+            "updatedAt": _iso(index * 60),
+        }
+
+    # --- Handlers ---
+    async def status(self, request: web.Request) -> web.Response:
+        return web.json_response({"version": "fake"})
+
+    async def search(self, request: web.Request) -> web.Response:
+        query = request.query.get("query", "")
+        # Each query maps to a stable slice of the catalogue, a query ending in "none" finds nothing.
+        if not self.config.media or query.endswith("none"):
+            return web.json_response({"page": 1, "totalPages": 0, "totalResults": 0, "results": []})
+        start = int(hashlib.sha1(query.encode()).hexdigest(), 16) % self.config.media
+        results = [self.media((start + offset) % self.config.media + 1) for offset in range(min(PAGE_SIZE, self.config.media))]
+        return web.json_response({"page": 1, "totalPages": 1, "totalResults": len(results), "results": results})
+
+    async def discover(self, request: web.Request) -> web.Response:
+        media_type = "movie" if request.path.endswith("movies") else "tv"
+        ids = range(1 if media_type == "movie" else 2, self.config.media + 1, 2)
+        page = max(1, int(request.query.get("page", 1)))
+        total_pages = math.ceil(len(ids) / PAGE_SIZE)
+        results = [self.media(tmdb_id) for tmdb_id in ids[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]]
+        return web.json_response({"page": page, "totalPages": total_pages, "totalResults": len(ids), "results": results})
+
+    async def details(self, request: web.Request) -> web.Response:
+        tmdb_id = int(request.match_info["tmdb_id"])
+        if not 1 <= tmdb_id <= self.config.media:
+            return web.json_response({"message": "Unable to retrieve media."}, status=404)
+        return web.json_response(self.media(tmdb_id, with_type=False))
+
+    async def list_requests(self, request: web.Request) -> web.Response:
+        user_id = int(request.query.get("requestedBy", 1))
+        take = int(request.query.get("take", 10))
+        skip = int(request.query.get("skip", 0))
+        total = self.config.requests_per_user if self.config.media else 0
+        results = []
+        for offset in range(skip, min(skip + take, total)):
+            tmdb_id = (user_id * 7919 + offset * 104729) % self.config.media + 1
+            results.append({
+                "id": user_id * 100000 + offset,
+                "status": offset % 3 + 1,
+                "createdAt": _iso(-offset * 3600),
+                "media": {"mediaType": self.media_type(tmdb_id), "tmdbId": tmdb_id},
+            })
+        return web.json_response({
+            "pageInfo": {"pages": math.ceil(total / take) if take else 0, "pageSize": take, "results": total,
+                         "page": skip // take + 1 if take else 1},
+            "results": results,
+        })
+
+    async def create_request(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        key = (payload.get("mediaType"), int(payload.get("mediaId") or 0))
+        if key in self.requested:
+            return web.json_response({"message": "Request for this media already exists."}, status=409)
+        self.requested.add(key)
+        return web.json_response({"id": len(self.requested), "status": 1}, status=201)
+
+    async def list_users(self, request: web.Request) -> web.Response:
+        take = int(request.query.get("take", 10))
+        skip = int(request.query.get("skip", 0))
+        indexes = range(self.config.users)
+        if request.query.get("sort") == "updated":
+            indexes = reversed(indexes) # Most recently updated first
+        indexes = list(indexes)[skip:skip + take]
+        return web.json_response({
+            "pageInfo": {"results": self.config.users, "pageSize": take},
+            "results": [self.user(index) for index in indexes],
+        })
+
+    async def import_users(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        imported = []
+        for jellyfin_id in payload.get("jellyfinUserIds", []):
+            index = _user_index(jellyfin_id)
+            if index is not None:
+                imported.append(self.user(index))
+        return web.json_response(imported, status=201)
+
+    async def list_media(self, request: web.Request) -> web.Response:
+        # Every third catalogue entry is known to Jellyseerr (requested or available).
+        take = int(request.query.get("take", 20))
+        skip = int(request.query.get("skip", 0))
+        ids = range(3, self.config.media + 1, 3)
+        if request.query.get("sort") == "modified":
+            ids = ids[::-1] # Most recently modified first
+        results = [{
+            "mediaType": self.media_type(tmdb_id),
+            "tmdbId": tmdb_id,
+            "status": 5 if tmdb_id % 2 else 2,
+            "updatedAt": _iso(tmdb_id * 60),
+        } for tmdb_id in ids[skip:skip + take]]
+        return web.json_response({"pageInfo": {"results": len(ids)}, "results": results})
+
+
+class FakeJellyfin(FakeBackend):
+    name = "jellyfin"
+    health_paths = ("/System/Info/Public",)
+
+    def _routes(self, router: web.UrlDispatcher):
+        router.add_get("/System/Info/Public", self.info)
+        router.add_post("/Users/AuthenticateByName", self.authenticate)
+        router.add_post("/Users/New", self.new_user)
+        router.add_get("/Users/{user_id}/Items", self.items)
+        router.add_get("/Users/{user_id}/Policy", self.get_policy)
+        router.add_post("/Users/{user_id}/Policy", self.set_policy)
+
+    async def info(self, request: web.Request) -> web.Response:
+        return web.json_response({"ServerName": "fake", "Version": "10.9.0"})
+
+    async def authenticate(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        username = payload.get("Username") or ""
+        index = int(username[4:]) if username.startswith("user") and username[4:].isdigit() else None
+        if index is None or index >= self.config.users or payload.get("Pw") == "wrong":
+            return web.Response(status=401, text="Error processing request.")
+        return web.json_response({"User": {"Id": jellyfin_user_id(index), "Name": username}, "AccessToken": "fake"})
+
+    async def new_user(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        return web.json_response({"Id": jellyfin_user_id(self.config.users + self.random.randrange(10**6)),
+                                  "Name": payload.get("Name")})
+
+    async def items(self, request: web.Request) -> web.Response:
+        index = _user_index(request.match_info["user_id"])
+        total = self.config.played_per_user if index is not None and index < self.config.users else 0
+        start = int(request.query.get("StartIndex", 0))
+        limit = int(request.query.get("Limit", total or 1))
+        # Played items are numbered newest first, so DatePlayed descending is the natural order.
+        items = []
+        for position in range(start, min(start + limit, total)):
+            is_episode = position % 4 == 0
+            items.append({
+                "Id": f"{index:08x}{position:024x}",
+                "Name": f"Episode {position}" if is_episode else f"Movie {position}",
+                "Type": "Episode" if is_episode else "Movie",
+                "SeriesName": f"Show {position % 50}" if is_episode else None,
+                "RunTimeTicks": (25 if is_episode else 100) * 60 * 10_000_000,
+                "UserData": {"Played": True, "LastPlayedDate": _iso(-position * 3600)},
+            })
+        return web.json_response({"Items": items, "TotalRecordCount": total, "StartIndex": start})
+
+    async def get_policy(self, request: web.Request) -> web.Response:
+        return web.json_response({"IsAdministrator": False, "IsDisabled": False, "EnableUserPreferenceAccess": True})
+
+    async def set_policy(self, request: web.Request) -> web.Response:
+        return web.Response(status=204)
+
+
+async def start_servers(config: FakeConfig, host: str = "127.0.0.1", jellyseerr_port: int = 0, jellyfin_port: int = 0):
+    """Starts both fake servers and returns (runners, jellyseerr_url, jellyfin_url). Port 0 picks a free port."""
+    runners, urls = [], []
+    for backend, port in ((FakeJellyseerr(config), jellyseerr_port), (FakeJellyfin(config), jellyfin_port)):
+        runner = web.AppRunner(backend.app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        runners.append(runner)
+        urls.append(f"http://{host}:{bound_port}")
+    return runners, urls[0], urls[1]
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Adds the FakeConfig options to a parser, shared with the load-test driver."""
+    defaults = FakeConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="Mean added latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms, help="Latency jitter (uniform, +/-)")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Fraction of requests failing with a 500")
+    parser.add_argument("--media", type=int, default=defaults.media, help="Movies and TV shows in the catalogue")
+    parser.add_argument("--users", type=int, default=defaults.users, help="Jellyseerr/Jellyfin users")
+    parser.add_argument("--requests-per-user", type=int, default=defaults.requests_per_user)
+    parser.add_argument("--played-per-user", type=int, default=defaults.played_per_user)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.media, args.users,
+                      args.requests_per_user, args.played_per_user, args.seed)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--jellyseerr-port", type=int, default=5055)
+    parser.add_argument("--jellyfin-port", type=int, default=8096)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    runners, jellyseerr_url, jellyfin_url = await start_servers(
+        config_from_args(args), args.host, args.jellyseerr_port, args.jellyfin_port
+    )
+    # The driver waits for this line when it starts the servers itself.
+    print(f"READY jellyseerr={jellyseerr_url} jellyfin={jellyfin_url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
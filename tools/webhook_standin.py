@@ -0,0 +1,79 @@
+"""Posts sample Jellyseerr webhook payloads to the bot's webhook listener.
+
+Stands in for Jellyseerr when testing notifications locally. Run the bot with WEBHOOK_PORT set, link
+a Discord account, then for example:
+
+    python tools/webhook_standin.py --username alice --type MEDIA_AVAILABLE
+    python tools/webhook_standin.py --username alice --type all --secret "$WEBHOOK_SECRET"
+"""
+import argparse
+import asyncio
+import json
+
+import aiohttp
+
+TYPES = ["MEDIA_APPROVED", "MEDIA_AUTO_APPROVED", "MEDIA_AVAILABLE", "MEDIA_DECLINED", "MEDIA_FAILED",
+         "MEDIA_PENDING", "TEST_NOTIFICATION"]
+
+SUBJECTS = {
+    "MEDIA_APPROVED": "Movie Request Approved",
+    "MEDIA_AUTO_APPROVED": "Movie Request Automatically Approved",
+    "MEDIA_AVAILABLE": "Movie Now Available",
+    "MEDIA_DECLINED": "Movie Request Declined",
+    "MEDIA_FAILED": "Movie Request Failed",
+    "MEDIA_PENDING": "New Movie Request",
+    "TEST_NOTIFICATION": "Test Notification",
+}
+
+def sample_payload(notification_type: str, username: str, tmdb_id: int, title: str, discord_id: str = None) -> dict:
+    """Returns a payload shaped like Jellyseerr's default webhook JSON template."""
+    return {
+        "notification_type": notification_type,
+        "event": SUBJECTS[notification_type],
+        "subject": f"{title} (1999)",
+        "message": "A sample notification sent by tools/webhook_standin.py.",
+        "image": "/f89U3ADr1oiB1s9GkdPOEpXUk5H.jpg",
+        "media": {
+            "media_type": "movie",
+            "tmdbId": str(tmdb_id),
+            "tvdbId": "",
+            "status": "AVAILABLE" if notification_type == "MEDIA_AVAILABLE" else "PROCESSING",
+            "status4k": "UNKNOWN",
+        },
+        "request": {
+            "request_id": "1",
+            "requestedBy_email": f"{username}@example.com",
+            "requestedBy_username": username,
+            "requestedBy_avatar": "",
+            "requestedBy_settings_discordId": discord_id or "",
+            "requestedBy_settings_telegramChatId": "",
+        },
+        "issue": None,
+        "comment": None,
+        "extra": [],
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8787/webhooks/jellyseerr", help="Webhook listener URL")
+    parser.add_argument("--secret", help="Authorization header value (WEBHOOK_SECRET)")
+    parser.add_argument("--type", default="MEDIA_AVAILABLE", choices=TYPES + ["all"], help="Notification type to send")
+    parser.add_argument("--username", required=True, help="Jellyseerr username of the requester")
+    parser.add_argument("--discord-id", help="Discord ID from the requester's notification settings")
+    parser.add_argument("--tmdb-id", type=int, default=603)
+    parser.add_argument("--title", default="The Matrix")
+    parser.add_argument("--count", type=int, default=1, help="Number of times to send each payload")
+    args = parser.parse_args()
+
+    headers = {"Authorization": args.secret} if args.secret else {}
+    types = [t for t in TYPES if t != "TEST_NOTIFICATION"] if args.type == "all" else [args.type]
+    async with aiohttp.ClientSession(headers=headers) as session:
+        for _ in range(args.count):
+            for notification_type in types:
+                payload = sample_payload(notification_type, args.username, args.tmdb_id, args.title, args.discord_id)
+                async with session.post(args.url, data=json.dumps(payload),
+                                        headers={"Content-Type": "application/json"}) as resp:
+                    print(f"{notification_type}: {resp.status}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import secrets
+import time
+
+# Traces taking at least this long are logged as a JSON line, 0 disables tracing.
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_MS", 2000)) / 1000
+MAX_SPANS_PER_TRACE = 200 # Later spans are dropped (and counted) to bound the memory of long traces.
+
+# The trace of the interaction being handled, and the span code is currently running in.
+# Tasks started while handling an interaction (e.g. prefetches) inherit both.
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Trace:
+    """The spans recorded while handling one interaction."""
+    __slots__ = ("name", "trace_id", "attrs", "started", "spans", "dropped", "finished")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.trace_id = secrets.token_hex(8)
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.spans = [] # Dicts with name, parent (index of the enclosing span), start_ms, duration_ms and attributes
+        self.dropped = 0
+        self.finished = False
+
+    def to_dict(self, duration: float, error: BaseException = None) -> dict:
+        trace = {
+            "event": "slow_trace",
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": round(duration * 1000, 2),
+            **self.attrs,
+        }
+        if error is not None:
+            trace["error"] = f"{type(error).__name__}: {error}"
+        trace["spans"] = self.spans
+        if self.dropped:
+            trace["dropped_spans"] = self.dropped
+        return trace
+
+
+def begin(name: str, **attrs):
+    """Starts a trace for the current task, returns it (or None when tracing is disabled)."""
+    if not TRACE_SLOW_SECONDS:
+        return None
+    trace = Trace(name, attrs)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def finish(trace: Trace, error: BaseException = None):
+    """Ends a trace started with begin() and logs it if it was slow. Spans started later are ignored."""
+    if trace is None or trace.finished:
+        return
+    trace.finished = True
+    duration = time.perf_counter() - trace.started
+    if duration >= TRACE_SLOW_SECONDS:
+        print(json.dumps(trace.to_dict(duration, error), default=str))
+
+
+@contextlib.contextmanager
+def trace(name: str, **attrs):
+    """Traces the block as one interaction, for handlers that don't go through the command tree (e.g. buttons)."""
+    trace_token, span_token = _current_trace.set(None), _current_span.set(None)
+    current = begin(name, **attrs)
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        finish(current, error)
+        _current_trace.reset(trace_token)
+        _current_span.reset(span_token)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """Records the block as a span of the current trace. Yields the span's dict (None when not tracing),
+    which attributes can be added to."""
+    current = _current_trace.get()
+    if current is None or current.finished:
+        yield None
+        return
+    if len(current.spans) >= MAX_SPANS_PER_TRACE:
+        current.dropped += 1
+        yield None
+        return
+    started = time.perf_counter()
+    record = {"name": name, "parent": _current_span.get(), "start_ms": round((started - current.started) * 1000, 2), **attrs}
+    current.spans.append(record)
+    token = _current_span.set(len(current.spans) - 1)
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        _current_span.reset(token)
+
+
+def traced(name: str = None):
+    """Decorates a function (sync or async) so each call is recorded as a span."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with span(span_name):
+                    return fn(*args, **kwargs)
+        return wrapper
+    return decorator
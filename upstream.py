@@ -0,0 +1,524 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from metrics import UPSTREAM_LATENCY, UPSTREAM_RESPONSES
+from tracing import span
+
+DEFAULT_TIMEOUT = 10 # Seconds, matches the timeout the cogs have always used.
+DEFAULT_POOL_SIZE = 20 # Maximum open keep-alive connections per backend.
+DEFAULT_RATE = 20.0 # Requests per second allowed by a backend's token bucket.
+DEFAULT_BURST = 40 # Requests that may be sent at once after an idle period.
+MIN_CONCURRENCY = 2 # The adaptive in-flight cap never drops below this.
+SLOW_RESPONSE_SECONDS = 3.0 # Responses slower than this count as a sign of an overloaded backend.
+BACKOFF_INTERVAL_SECONDS = 1.0 # The in-flight cap is lowered at most once per interval.
+MAX_RETRIES = 2 # Retries of a request rejected with 429/503 or a connection error.
+MAX_RETRY_AFTER_SECONDS = 30 # Longer Retry-After values are returned to the caller instead of waited on.
+BREAKER_FAILURE_THRESHOLD = 5 # Consecutive failures (errors, timeouts, 5xx) that open an endpoint's breaker.
+BREAKER_RESET_SECONDS = 30 # An open breaker lets a trial request through after this long.
+PROBE_INTERVAL_SECONDS = 5 # Interval of the background health probe while any breaker is open.
+PROBE_TIMEOUT_SECONDS = 3
+
+# Priority classes, lower is served first. Interactive commands are the default, background jobs opt
+# out with `with upstream.priority(upstream.BACKGROUND):` so they queue behind users.
+INTERACTIVE = 0
+PREFETCH = 1
+BACKGROUND = 2
+
+_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+# The SharedPriority of the shared call (see cache.SingleFlight) the current task is running, if any.
+_shared = contextvars.ContextVar("upstream_shared_priority", default=None)
+
+@contextlib.contextmanager
+def priority(level: int):
+    """Runs the upstream calls made inside the block (and tasks started from it) at a priority class."""
+    token = _priority.set(level)
+    shared_token = _shared.set(None)
+    try:
+        yield
+    finally:
+        _shared.reset(shared_token)
+        _priority.reset(token)
+
+def current_priority() -> int:
+    """Returns the priority class upstream calls made now are queued at."""
+    shared = _shared.get()
+    return _priority.get() if shared is None else shared.level
+
+
+class SharedPriority:
+    """The priority class of a call whose result several callers wait on.
+
+    A shared call runs at the most urgent class among its callers: join() raises it to the joining
+    caller's class, and the requests it already has queued in a RequestScheduler move up with it. So
+    a page flip that joins a PREFETCH warm of the same data isn't left waiting behind other prefetches.
+    Shared calls started from inside this one are raised along with it.
+    """
+    def __init__(self):
+        self.level = current_priority()
+        self._queued = {} # future -> RequestScheduler, requests of this call waiting for a slot
+        self._nested = [] # SharedPriority of shared calls this one waits on
+        self._link()
+
+    def _link(self):
+        outer = _shared.get()
+        if outer is not None and outer is not self:
+            outer._nested.append(self)
+
+    def join(self):
+        """Raises the call to the current caller's priority class if that is more urgent."""
+        self._link()
+        self._raise(current_priority())
+
+    def _raise(self, level: int):
+        if level >= self.level:
+            return
+        self.level = level
+        for future, scheduler in list(self._queued.items()):
+            scheduler.reprioritize(future, level)
+        for nested in self._nested:
+            nested._raise(level)
+
+    @contextlib.contextmanager
+    def applied(self):
+        """Runs the block (and tasks started from it) as part of this shared call."""
+        token = _shared.set(self)
+        try:
+            yield
+        finally:
+            _shared.reset(token)
+
+class UpstreamError(Exception):
+    """Raised when a call to Jellyseerr or Jellyfin fails (network error, timeout or error status)."""
+    def __init__(self, message: str, status: int = None, text: str = None):
+        super().__init__(message)
+        self.status = status
+        self.text = text
+
+    def details(self) -> str:
+        """Returns the most useful error message from the response body, if any."""
+        if not self.text:
+            return str(self)
+        try:
+            data = json.loads(self.text)
+        except ValueError:
+            return self.text
+        if isinstance(data, dict) and data.get("message"):
+            return str(data["message"])
+        return self.text
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without contacting the backend while an endpoint's circuit breaker is open."""
+
+
+class UpstreamResponse:
+    """A fully read response from an upstream backend."""
+    __slots__ = ("status", "reason", "text", "url", "headers")
+
+    def __init__(self, status: int, reason: str, text: str, url: str, headers: dict):
+        self.status = status
+        self.reason = reason
+        self.text = text
+        self.url = url
+        self.headers = headers
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    def raise_for_status(self):
+        """Raises UpstreamError if the response has an error status code."""
+        if self.status in (429, 503):
+            raise UpstreamError(f"The server is busy ({self.status} {self.reason}), please try again in a moment.",
+                                status=self.status, text=self.text)
+        if not self.ok:
+            raise UpstreamError(f"{self.status} {self.reason} for url: {self.url}", status=self.status, text=self.text)
+
+    def json(self):
+        """Parses the response body as JSON."""
+        try:
+            return json.loads(self.text) if self.text else None
+        except ValueError as e:
+            raise UpstreamError(f"Invalid JSON from {self.url}: {e}", status=self.status, text=self.text) from e
+
+
+def _retry_after(headers: dict):
+    """Returns the Retry-After delay of a response in seconds, or None."""
+    value = next((v for k, v in headers.items() if k.lower() == "retry-after"), None)
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """Admits requests to one backend under a token bucket and an adaptive in-flight cap.
+
+    Waiting requests are admitted by priority class, then in arrival order. The in-flight cap grows by
+    one per window of successful fast responses and is cut by 30% on 429/5xx responses, connection
+    errors and slow responses (additive increase, multiplicative decrease). pause() holds every
+    request back, e.g. until a Retry-After deadline.
+    """
+    def __init__(self, name: str, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 max_concurrency: int = DEFAULT_POOL_SIZE):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._backed_off_at = 0.0
+        self._waiters = [] # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+        self._timer = None
+        # Counters
+        self.admitted = 0
+        self.throttled = 0 # Requests that had to wait for a slot
+        self.retries = 0
+        self.backoffs = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters and self.in_flight < int(self.limit):
+            if self._waiters[0][2].done(): # Cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if now < self._paused_until:
+                self._wake_at(self._paused_until - now)
+                return
+            if self._tokens < 1:
+                self._wake_at((1 - self._tokens) / self.rate)
+                return
+            _, _, future = heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            future.set_result(None)
+
+    def _wake_at(self, delay: float):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    async def acquire(self, level: int = None):
+        """Waits until a request at the given priority class (default: the current one) may be sent."""
+        future = asyncio.get_running_loop().create_future()
+        shared = _shared.get() if level is None else None
+        heapq.heappush(self._waiters, (current_priority() if level is None else level, next(self._sequence), future))
+        self._dispatch()
+        if future.done():
+            return
+        self.throttled += 1
+        if shared is not None:
+            shared._queued[future] = self
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.in_flight -= 1 # Admitted just before being cancelled, hand the slot on.
+                self._dispatch()
+            raise
+        finally:
+            if shared is not None:
+                shared._queued.pop(future, None)
+
+    def reprioritize(self, future: asyncio.Future, level: int):
+        """Moves a waiting request to a more urgent priority class.
+
+        The request is queued again at the new class; its old heap entry is skipped once the
+        request has been admitted.
+        """
+        if not future.done():
+            heapq.heappush(self._waiters, (level, next(self._sequence), future))
+            self._dispatch()
+
+    def release(self, latency: float, overloaded: bool = False):
+        """Returns a slot and adapts the in-flight cap to how the request went."""
+        self.in_flight -= 1
+        now = time.monotonic()
+        if overloaded or latency > SLOW_RESPONSE_SECONDS:
+            if now - self._backed_off_at >= BACKOFF_INTERVAL_SECONDS:
+                self._backed_off_at = now
+                self.limit = max(MIN_CONCURRENCY, self.limit * 0.7)
+                self.backoffs += 1
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self._dispatch()
+
+    def abandon(self):
+        """Returns the slot of a request that was cancelled, without adapting the in-flight cap."""
+        self.in_flight -= 1
+        self._dispatch()
+
+    def pause(self, seconds: float):
+        """Holds back every request to the backend for the given number of seconds."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len({id(future) for _, _, future in self._waiters if not future.done()}),
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "backoffs": self.backoffs,
+        }
+
+
+# Path segments that are IDs (TMDB ids, Jellyfin GUIDs), so e.g. /api/v1/movie/603 and /api/v1/movie/604
+# share the /api/v1/movie/{id} breaker.
+_ID_SEGMENT = re.compile(r"/(?:\d+|[0-9a-fA-F]{32}|[0-9a-fA-F-]{36})(?=/|$)")
+
+def endpoint_of(method: str, path: str) -> str:
+    """Returns the endpoint a request belongs to, e.g. "GET /api/v1/movie/{id}"."""
+    return f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+
+
+class CircuitBreaker:
+    """Tracks the health of one endpoint and fails calls fast while it is known to be down.
+
+    closed: calls go through. After BREAKER_FAILURE_THRESHOLD consecutive failures the breaker opens.
+    open: calls fail immediately with CircuitOpenError. After BREAKER_RESET_SECONDS, or as soon as the
+    backend's health probe succeeds, the breaker becomes half-open.
+    half-open: a single trial call goes through, its outcome closes or re-opens the breaker.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= BREAKER_RESET_SECONDS:
+            self.state = self.HALF_OPEN
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.state != self.OPEN:
+                print(f"Circuit breaker opened for {self.endpoint} after {self.failures} failure(s).")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def abandon(self):
+        """Forgets a trial call that was cancelled before it finished."""
+        self._trial_in_flight = False
+
+    def half_open(self):
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+
+
+class UpstreamClient:
+    """A pooled keep-alive HTTP client for a single backend (Jellyseerr or Jellyfin).
+
+    One client is created per backend in JellyBot.setup_hook and shared by every cog and view,
+    so calls never block the event loop and connections are reused between interactions. Every
+    request goes through the client's RequestScheduler, so bursts are queued by priority instead of
+    overwhelming the backend, and 429/503 responses are retried after their Retry-After delay.
+
+    Each endpoint has a CircuitBreaker. While one is open, health_path (if given) is probed in the
+    background so the breakers let traffic through again as soon as the backend is back.
+    """
+    def __init__(self, name: str, base_url: str, headers: dict, timeout: float = DEFAULT_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 health_path: str = None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.health_path = health_path
+        self.scheduler = RequestScheduler(name, rate=rate, burst=burst, max_concurrency=pool_size)
+        self.breakers = {} # endpoint -> CircuitBreaker
+        self._probe_task = None
+        self._session = None
+
+    async def start(self):
+        """Opens the underlying session. Must be called from within the running event loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+
+    async def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _send(self, method: str, url: str, params, json, client_timeout) -> UpstreamResponse:
+        try:
+            async with self._session.request(method, url, params=params, json=json, timeout=client_timeout) as resp:
+                text = await resp.text()
+                return UpstreamResponse(resp.status, resp.reason, text, str(resp.url), dict(resp.headers))
+        except asyncio.TimeoutError as e:
+            raise UpstreamError(f"Timed out after {client_timeout.total}s waiting for {url}") from e
+        except aiohttp.ClientError as e:
+            raise UpstreamError(f"Connection error for url: {url}: {e}") from e
+
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+    def _start_probe(self):
+        if self.health_path and (self._probe_task is None or self._probe_task.done()):
+            with priority(BACKGROUND):
+                self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        """Probes health_path while any breaker is open and half-opens them once the backend answers."""
+        client_timeout = aiohttp.ClientTimeout(total=PROBE_TIMEOUT_SECONDS)
+        while any(breaker.state == CircuitBreaker.OPEN for breaker in self.breakers.values()):
+            await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+            try:
+                response = await self._send("GET", f"{self.base_url}{self.health_path}", None, None, client_timeout)
+            except UpstreamError:
+                continue
+            if response.ok:
+                print(f"{self.name} is reachable again, letting trial requests through.")
+                for breaker in self.breakers.values():
+                    breaker.half_open()
+                return
+
+    def _record(self, endpoint: str, latency: float, status):
+        UPSTREAM_LATENCY.observe(latency, backend=self.name, endpoint=endpoint)
+        UPSTREAM_RESPONSES.inc(backend=self.name, endpoint=endpoint, status=status)
+
+    async def request(self, method: str, path: str, **kwargs) -> UpstreamResponse:
+        """Performs a request against the backend and returns the fully read response.
+
+        The request waits for the scheduler at the current priority class. 429 responses (and 503s
+        and connection errors for GETs) are retried up to MAX_RETRIES times, honouring Retry-After.
+        Raises CircuitOpenError at once while the endpoint's breaker is open, and UpstreamError on
+        network errors and timeouts. Error status codes are returned as-is, callers decide whether
+        to call raise_for_status().
+        """
+        with span("upstream", backend=self.name, endpoint=endpoint_of(method, path)) as record:
+            response = await self._request(method, path, **kwargs)
+            if record is not None:
+                record["status"] = response.status
+            return response
+
+    async def _request(self, method: str, path: str, *, params=None, json=None, timeout: float = None) -> UpstreamResponse:
+        if self._session is None or self._session.closed:
+            await self.start()
+        url = f"{self.base_url}{path}"
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+        endpoint = endpoint_of(method, path)
+        breaker = self._breaker(endpoint)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                UPSTREAM_RESPONSES.inc(backend=self.name, endpoint=endpoint, status="circuit_open")
+                raise CircuitOpenError(f"{self.name.capitalize()} is unavailable right now, please try again later.")
+            try:
+                with span("upstream.queue"):
+                    await self.scheduler.acquire()
+            except asyncio.CancelledError:
+                breaker.abandon() # A half-open trial cancelled while queued must not block the next one.
+                raise
+            started = time.monotonic()
+            try:
+                with span("upstream.http", attempt=attempt):
+                    response = await self._send(method, url, params, json, client_timeout)
+            except UpstreamError as e:
+                self.scheduler.release(time.monotonic() - started, overloaded=True)
+                self._record(endpoint, time.monotonic() - started, "error")
+                breaker.record_failure()
+                if breaker.state == CircuitBreaker.OPEN:
+                    self._start_probe()
+                    raise # No point retrying once the endpoint is known to be down.
+                if method != "GET" or attempt >= MAX_RETRIES or isinstance(e.__cause__, asyncio.TimeoutError):
+                    raise
+                delay = BACKOFF_INTERVAL_SECONDS * 2 ** attempt
+            except asyncio.CancelledError:
+                self.scheduler.abandon()
+                breaker.abandon()
+                raise
+            else:
+                self.scheduler.release(time.monotonic() - started, overloaded=response.status == 429 or response.status >= 500)
+                self._record(endpoint, time.monotonic() - started, response.status)
+                if response.status >= 500:
+                    breaker.record_failure()
+                    if breaker.state == CircuitBreaker.OPEN:
+                        self._start_probe()
+                else:
+                    breaker.record_success()
+                retryable = response.status == 429 or (response.status == 503 and method == "GET")
+                if not retryable or attempt >= MAX_RETRIES:
+                    return response
+                delay = _retry_after(response.headers)
+                if delay is None:
+                    delay = BACKOFF_INTERVAL_SECONDS * 2 ** attempt
+                elif delay > MAX_RETRY_AFTER_SECONDS:
+                    return response
+                # The backend asked everyone to slow down, not just this request.
+                self.scheduler.pause(delay)
+            attempt += 1
+            self.scheduler.retries += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, path: str, **kwargs) -> UpstreamResponse:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> UpstreamResponse:
+        return await self.request("POST", path, **kwargs)
+
+    async def get_json(self, path: str, **kwargs):
+        """GETs a path, raising UpstreamError on failure, and returns the decoded JSON body."""
+        response = await self.get(path, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    async def post_json(self, path: str, **kwargs):
+        """POSTs to a path, raising UpstreamError on failure, and returns the decoded JSON body."""
+        response = await self.post(path, **kwargs)
+        response.raise_for_status()
+        return response.json()
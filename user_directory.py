@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+from upstream import UpstreamClient, UpstreamError, priority, BACKGROUND
+
+PAGE_SIZE = 100 # Users fetched per /api/v1/user page.
+REFRESH_SECONDS = 300 # Interval between incremental background refreshes.
+REBUILD_SECONDS = 24 * 3600 # Interval between full rebuilds, which also drop deleted users.
+MISS_REFRESH_SECONDS = 10 # Minimum interval between refreshes triggered by lookup misses.
+
+# Only the fields /link and user creation need are kept for each Jellyseerr user.
+_USER_FIELDS = ("id", "username", "jellyfinUsername", "jellyfinUserId", "displayName", "updatedAt")
+
+class JellyseerrUserDirectory:
+    """A local index of Jellyseerr users by jellyfinUserId.
+
+    The directory is built by paging through the full user list, refreshed incrementally in the
+    background (users sorted by last update, stopping at the stored high-water mark) and refreshed
+    on demand when a lookup misses, so /link is a single dictionary lookup.
+    """
+    def __init__(self, jellyseerr: UpstreamClient):
+        self.jellyseerr = jellyseerr
+        self._by_jellyfin_id = {}
+        self._high_water_mark = "" # Latest updatedAt seen, ISO timestamps compare lexicographically.
+        self._lock = asyncio.Lock()
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return self._built_at > 0
+
+    def start(self):
+        if self._task is None:
+            with priority(BACKGROUND):
+                self._task = asyncio.create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def add(self, user: dict):
+        """Adds or updates a Jellyseerr user (as returned by the API) in the directory."""
+        record = {field: user.get(field) for field in _USER_FIELDS}
+        jellyfin_user_id = record.get("jellyfinUserId")
+        if jellyfin_user_id:
+            self._by_jellyfin_id[str(jellyfin_user_id)] = record
+        if (record.get("updatedAt") or "") > self._high_water_mark:
+            self._high_water_mark = record["updatedAt"]
+
+    async def _fetch_page(self, skip: int, sort: str) -> list:
+        data = await self.jellyseerr.get_json("/api/v1/user", params={"take": PAGE_SIZE, "skip": skip, "sort": sort})
+        return data.get("results", [])
+
+    async def _build(self):
+        users, skip = [], 0
+        while True:
+            page = await self._fetch_page(skip, "created")
+            users.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            skip += PAGE_SIZE
+        self._by_jellyfin_id.clear()
+        self._high_water_mark = ""
+        for user in users:
+            self.add(user)
+        self._built_at = self._refreshed_at = time.monotonic()
+        print(f"Jellyseerr user directory built with {len(users)} user(s).")
+
+    async def _refresh(self):
+        high_water_mark, skip = self._high_water_mark, 0
+        while True:
+            page = await self._fetch_page(skip, "updated")
+            for user in page:
+                if (user.get("updatedAt") or "") < high_water_mark:
+                    break
+                self.add(user)
+            else:
+                if len(page) == PAGE_SIZE:
+                    skip += PAGE_SIZE
+                    continue
+            break
+        self._refreshed_at = time.monotonic()
+
+    async def build(self):
+        """Rebuilds the directory from the complete, paged Jellyseerr user list."""
+        async with self._lock:
+            await self._build()
+
+    async def refresh(self, min_age: float = 0):
+        """Fetches users updated since the high-water mark, newest first, and merges them in.
+
+        The refresh is skipped if the directory was refreshed less than min_age seconds ago.
+        """
+        async with self._lock:
+            if not self.ready:
+                await self._build()
+            elif time.monotonic() - self._refreshed_at >= min_age:
+                await self._refresh()
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                if time.monotonic() - self._built_at >= REBUILD_SECONDS:
+                    await self.build()
+                else:
+                    await self.refresh()
+            except UpstreamError as e:
+                print(f"Failed to refresh the Jellyseerr user directory: {e}")
+            await asyncio.sleep(REFRESH_SECONDS)
+
+    async def find_by_jellyfin_id(self, jellyfin_user_id: str):
+        """Returns the Jellyseerr user linked to a Jellyfin user ID, or None.
+
+        On a miss the directory is refreshed once (rate limited) so newly imported users are found.
+        """
+        user = self._by_jellyfin_id.get(str(jellyfin_user_id)) if self.ready else None
+        if user is None:
+            await self.refresh(min_age=MISS_REFRESH_SECONDS)
+            user = self._by_jellyfin_id.get(str(jellyfin_user_id))
+        return user
@@ -1,18 +1,120 @@
 import sqlite3
+from collections import OrderedDict
 import discord
-from discord.ui import View, Button, button
-import requests # Added for create_request_embed
-import os # For creating data directory
+import os # For cache configuration
+
+from cache import TTLCache, register
+from database import Database
+from upstream import UpstreamClient, UpstreamError
+from records import MediaItem, RequestItem
+from tracing import traced
 
 TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500" # Base URL for TMDb poster images.
 
+# Jellyseerr media details keyed by (mediaType, tmdbId) as MediaItems, shared by every user and page.
+# Expired details are still served (marked stale) while Jellyseerr is unreachable.
+MEDIA_DETAILS_CACHE = TTLCache(
+    "media_details",
+    maxsize=int(os.getenv("MEDIA_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("MEDIA_CACHE_TTL", 3600)),
+    stale_if_error=(UpstreamError,)
+)
+# Optional bound on the in-memory linked user index, 0 keeps every linked user in memory.
+LINKED_USER_CACHE_SIZE = int(os.getenv("LINKED_USER_CACHE_SIZE", 0))
+
 DB_PATH = "data/linked_users.db"
 
 # --- Database Functions ---
-def init_db():
-    """Initializes the SQLite database and creates the linked_users table if it doesn't exist."""
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+# A single long-lived connection shared by the whole bot, see database.Database.
+db = Database(DB_PATH)
+
+class LinkedUserIndex:
+    """A write-through in-memory index of discord_id -> linked user row.
+
+    It is filled by load_linked_users() at startup and kept consistent by the store/delete helpers,
+    so link lookups are a dictionary access. When maxsize is set only the most recently used users
+    are kept (including known unlinked ones) and other lookups fall back to SQLite.
+    """
+    def __init__(self, maxsize: int = 0):
+        self.name = "linked_users"
+        self.maxsize = maxsize
+        self._rows = OrderedDict() # discord_id -> row, or None for a user known to be unlinked
+        self.complete = False # True when every linked user is in memory, so a miss means "not linked"
+        self.shared = False # True when other processes write to the database, see share()
+        self.hits = 0
+        self.misses = 0
+
+    def share(self):
+        """Stops caching rows because other processes (e.g. other shards) write to the database too."""
+        self.shared = True
+        self._rows.clear()
+        self.complete = False
+
+    def lookup(self, discord_id: str):
+        """Returns (found, row). found is False when SQLite has to be consulted."""
+        if self.shared:
+            self.misses += 1
+            return False, None
+        if discord_id in self._rows:
+            self.hits += 1
+            if self.maxsize:
+                self._rows.move_to_end(discord_id)
+            return True, self._rows[discord_id]
+        if self.complete:
+            self.hits += 1
+            return True, None
+        self.misses += 1
+        return False, None
+
+    def put(self, discord_id: str, row):
+        if self.shared:
+            return
+        if row is None and self.complete:
+            self._rows.pop(discord_id, None)
+            return
+        self._rows[discord_id] = row
+        if self.maxsize:
+            self._rows.move_to_end(discord_id)
+            while len(self._rows) > self.maxsize:
+                self._rows.popitem(last=False)
+                self.complete = False
+
+    def fill(self, discord_id: str, row):
+        """Caches a row read from SQLite, unless a concurrent write already updated the entry."""
+        if discord_id not in self._rows:
+            self.put(discord_id, row)
+
+    def load(self, rows: list) -> int:
+        """Replaces the index with rows, newest first. With maxsize, one extra row tells whether there are more.
+
+        Returns the number of rows kept.
+        """
+        if self.shared:
+            return 0
+        self._rows.clear()
+        kept = rows[:self.maxsize] if self.maxsize else rows
+        # Oldest first, so the newest users end up most recently used and are evicted last.
+        for discord_id, *row in reversed(kept):
+            self.put(discord_id, tuple(row))
+        self.complete = len(kept) == len(rows)
+        return len(kept)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._rows),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+            "coalesced": 0,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+linked_users = register(LinkedUserIndex(LINKED_USER_CACHE_SIZE))
+
+def _create_schema(conn: sqlite3.Connection):
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS linked_users (
@@ -42,65 +144,213 @@ def init_db():
         cursor.execute('ALTER TABLE linked_users ADD COLUMN role_name TEXT')
     except sqlite3.OperationalError:
         pass # Column already exists
-    conn.commit()
-    conn.close()
+    # Lets the expiration scheduler find the next due users without a full scan
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_linked_users_expires_at ON linked_users (expires_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_linked_users_username ON linked_users (username COLLATE NOCASE)')
+    # Journal of in-progress expirations, so a restart resumes them without repeating completed steps
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS expiration_jobs (
+            discord_id TEXT PRIMARY KEY,
+            jellyfin_user_id TEXT,
+            guild_id TEXT,
+            role_name TEXT,
+            completed_steps TEXT NOT NULL DEFAULT '',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Incrementally maintained /watch statistics, see watch_stats.WatchStatsStore
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS watch_stats (
+            jellyfin_user_id TEXT PRIMARY KEY,
+            watched_count INTEGER NOT NULL DEFAULT 0,
+            total_ticks INTEGER NOT NULL DEFAULT 0,
+            last_item_name TEXT,
+            last_item_type TEXT,
+            last_series_name TEXT,
+            high_water_mark TEXT,
+            rebuilt_at REAL,
+            refreshed_at REAL,
+            requested_at REAL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS watch_items (
+            jellyfin_user_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            run_time_ticks INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (jellyfin_user_id, item_id)
+        ) WITHOUT ROWID
+    ''')
+    # Jellyseerr media status by (mediaType, tmdbId), see media_index.MediaIndex
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media_status (
+            media_type TEXT NOT NULL,
+            tmdb_id INTEGER NOT NULL,
+            status INTEGER NOT NULL,
+            updated_at TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (media_type, tmdb_id)
+        ) WITHOUT ROWID
+    ''')
+    # Leases electing the process that runs background jobs when several bot processes share the database
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    # Keys of paginated search results, so their buttons can rebuild the results after a restart
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS page_sources (
+            key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
 
-def delete_linked_user(discord_id: str):
-    """Deletes a linked user from the database by their Discord ID."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM linked_users WHERE discord_id=?', (discord_id,))
-    conn.commit()
-    conn.close()
+def init_db():
+    """Initializes the SQLite database and creates the linked_users table if it doesn't exist."""
+    db.run_sync(_create_schema)
+
+_UPSERT_LINKED_USER_SQL = '''
+    INSERT INTO linked_users (discord_id, jellyseerr_user_id, jellyfin_user_id, username, expires_at, guild_id, role_name)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(discord_id) DO UPDATE SET
+        jellyseerr_user_id=excluded.jellyseerr_user_id,
+        jellyfin_user_id=excluded.jellyfin_user_id,
+        username=excluded.username,
+        expires_at=excluded.expires_at,
+        guild_id=excluded.guild_id,
+        role_name=excluded.role_name
+'''
+
+async def load_linked_users():
+    """Loads the linked users into the in-memory index. Called once at startup."""
+    rows = await db.fetchall(
+        'SELECT discord_id, jellyseerr_user_id, jellyfin_user_id, username, expires_at FROM linked_users'
+        + (' ORDER BY created_at DESC LIMIT ?' if LINKED_USER_CACHE_SIZE else ''),
+        (LINKED_USER_CACHE_SIZE + 1,) if LINKED_USER_CACHE_SIZE else ()
+    )
+    return linked_users.load(rows)
 
-def store_linked_user(discord_id, jellyseerr_user_id, jellyfin_user_id, username=None, expires_at=None, guild_id=None, role_name=None):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO linked_users (discord_id, jellyseerr_user_id, jellyfin_user_id, username, expires_at, guild_id, role_name)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(discord_id) DO UPDATE SET
-            jellyseerr_user_id=excluded.jellyseerr_user_id,
-            jellyfin_user_id=excluded.jellyfin_user_id,
-            username=excluded.username,
-            expires_at=excluded.expires_at,
-            guild_id=excluded.guild_id,
-            role_name=excluded.role_name
-    ''', (str(discord_id), jellyseerr_user_id, jellyfin_user_id, username, expires_at, guild_id, role_name))
-    conn.commit()
-    conn.close()
-
-def get_linked_user(discord_id: str):
-    """Retrieves a linked user's details from the database by their Discord ID."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+async def delete_linked_user(discord_id: str):
+    """Deletes a linked user from the database by their Discord ID."""
+    await db.execute('DELETE FROM linked_users WHERE discord_id=?', (str(discord_id),))
+    linked_users.put(str(discord_id), None)
+
+async def store_linked_user(discord_id, jellyseerr_user_id, jellyfin_user_id, username=None, expires_at=None, guild_id=None, role_name=None):
+    await db.execute(_UPSERT_LINKED_USER_SQL,
+                     (str(discord_id), jellyseerr_user_id, jellyfin_user_id, username, expires_at, guild_id, role_name))
+    linked_users.put(str(discord_id), (jellyseerr_user_id, jellyfin_user_id, username, expires_at))
+
+async def store_linked_users(rows: list):
+    """Stores several linked users in a single transaction.
+
+    Each row is a tuple of (discord_id, jellyseerr_user_id, jellyfin_user_id, username, expires_at, guild_id, role_name).
+    """
+    await db.executemany(_UPSERT_LINKED_USER_SQL, [(str(row[0]), *row[1:]) for row in rows])
+    for row in rows:
+        linked_users.put(str(row[0]), tuple(row[1:5]))
+
+@traced()
+async def get_linked_user(discord_id: str):
+    """Retrieves a linked user's details by their Discord ID, from memory when possible."""
+    found, row = linked_users.lookup(str(discord_id))
+    if found:
+        return row
     # Also retrieve expires_at
-    cursor.execute('''
+    row = await db.fetchone('''
         SELECT jellyseerr_user_id, jellyfin_user_id, username, expires_at
         FROM linked_users WHERE discord_id=?
     ''', (str(discord_id),))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    linked_users.fill(str(discord_id), row)
+    return row
+
+async def find_linked_discord_ids(username: str) -> list:
+    """Returns the Discord IDs linked to a Jellyfin/Jellyseerr username (case-insensitive)."""
+    if not username:
+        return []
+    rows = await db.fetchall('SELECT discord_id FROM linked_users WHERE username = ? COLLATE NOCASE', (username,))
+    return [discord_id for (discord_id,) in rows]
+
+async def get_due_expirations(now: str):
+    """Retrieves the users whose expiration date (an ISO timestamp) is at or before now, oldest first."""
+    return await db.fetchall(
+        'SELECT discord_id, jellyfin_user_id, expires_at, guild_id, role_name FROM linked_users '
+        'WHERE expires_at IS NOT NULL AND expires_at <= ? ORDER BY expires_at',
+        (now,)
+    )
 
-def get_all_expiring_users():
-    """Retrieves all users with an expiration date."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT discord_id, jellyfin_user_id, expires_at, guild_id, role_name FROM linked_users WHERE expires_at IS NOT NULL')
-    results = cursor.fetchall()
-    conn.close()
-    return results
+async def get_upcoming_expirations(limit: int):
+    """Retrieves (discord_id, expires_at) for the next users to expire, soonest first."""
+    return await db.fetchall(
+        'SELECT discord_id, expires_at FROM linked_users WHERE expires_at IS NOT NULL ORDER BY expires_at LIMIT ?',
+        (limit,)
+    )
+
+# --- Expiration Job Journal ---
+async def create_expiration_jobs(due_users: list):
+    """Journals an expiration job for each due user row, keeping any job that is already in progress.
+
+    Each row is (discord_id, jellyfin_user_id, expires_at, guild_id, role_name) as returned by get_due_expirations.
+    """
+    await db.executemany(
+        'INSERT OR IGNORE INTO expiration_jobs (discord_id, jellyfin_user_id, guild_id, role_name) VALUES (?, ?, ?, ?)',
+        [(discord_id, jellyfin_user_id, guild_id, role_name)
+         for discord_id, jellyfin_user_id, _, guild_id, role_name in due_users]
+    )
+
+async def get_pending_expiration_jobs():
+    """Retrieves every unfinished expiration job, oldest first."""
+    return await db.fetchall(
+        'SELECT discord_id, jellyfin_user_id, guild_id, role_name, completed_steps, attempts '
+        'FROM expiration_jobs ORDER BY created_at'
+    )
+
+async def complete_expiration_step(discord_id: str, completed_steps: list):
+    """Records the steps of an expiration job that have finished."""
+    await db.execute(
+        'UPDATE expiration_jobs SET completed_steps=?, updated_at=CURRENT_TIMESTAMP WHERE discord_id=?',
+        (",".join(completed_steps), discord_id)
+    )
+
+async def record_expiration_failure(discord_id: str, error: str):
+    await db.execute(
+        'UPDATE expiration_jobs SET attempts=attempts+1, last_error=?, updated_at=CURRENT_TIMESTAMP WHERE discord_id=?',
+        (error, discord_id)
+    )
+
+async def is_expiration_due(discord_id: str, now: str) -> bool:
+    """Returns False if the user was given a later expiration date (or none) since their job was journaled."""
+    row = await db.fetchone('SELECT expires_at FROM linked_users WHERE discord_id=?', (discord_id,))
+    return row is None or (row[0] is not None and row[0] <= now)
+
+async def cancel_expiration_job(discord_id: str):
+    """Removes an expiration job that no longer applies."""
+    await db.execute('DELETE FROM expiration_jobs WHERE discord_id=?', (discord_id,))
+
+async def finish_expiration_job(discord_id: str):
+    """Unlinks an expired user and removes their expiration job in a single transaction."""
+    def _finish(conn):
+        conn.execute('DELETE FROM linked_users WHERE discord_id=?', (discord_id,))
+        conn.execute('DELETE FROM expiration_jobs WHERE discord_id=?', (discord_id,))
+    await db.transaction(_finish)
+    linked_users.put(discord_id, None)
 
 # --- Embed Creation Helpers ---
-def create_embed_for_item(item: dict, current_index: int, total_results: int) -> discord.Embed:
-    """Creates a Discord embed for a media item (movie or TV show)."""
-    title = item.get("title") or item.get("name") or "Unknown Title"
-    year_str = item.get("releaseDate") or item.get("firstAirDate", "N/A")
-    year = year_str.split("-")[0] if isinstance(year_str, str) else "N/A"
+@traced()
+def create_embed_for_item(item: MediaItem, current_index: int, total_results: int,
+                          availability: str = None) -> discord.Embed:
+    """Creates a Discord embed for a media item (movie or TV show), with its availability if known."""
+    title = item.title or "Unknown Title"
+    year = item.year or "N/A"
 
-    media_type = item.get("mediaType", "N/A").capitalize()
-    overview = item.get("overview", "No overview available.")
+    media_type = (item.media_type or "N/A").capitalize()
+    overview = item.overview or "No overview available."
 
     embed = discord.Embed(
         title=f"{title} ({year})",
@@ -108,14 +358,25 @@ def create_embed_for_item(item: dict, current_index: int, total_results: int) ->
         color=discord.Color.blue()
     )
     embed.add_field(name="Type", value=media_type, inline=True)
+    if availability:
+        embed.add_field(name="Availability", value=availability, inline=True)
 
-    poster_path = item.get("posterPath")
-    if poster_path:
-        embed.set_thumbnail(url=f"{TMDB_IMAGE_BASE_URL}{poster_path}")
+    if item.poster_path:
+        embed.set_thumbnail(url=f"{TMDB_IMAGE_BASE_URL}{item.poster_path}")
 
     embed.set_footer(text=f"Result {current_index + 1} of {total_results}")
     return embed
 
+# --- Jellyseerr Media Details ---
+async def fetch_media_details(jellyseerr: UpstreamClient, media_type: str, tmdb_id) -> MediaItem:
+    """Returns Jellyseerr details for a movie or TV show, using MEDIA_DETAILS_CACHE when possible."""
+    endpoint = 'tv' if media_type == 'tv' else 'movie'
+    key = (endpoint, str(tmdb_id))
+
+    async def fetch():
+        return MediaItem.from_json(await jellyseerr.get_json(f"/api/v1/{endpoint}/{tmdb_id}"), endpoint)
+    return await MEDIA_DETAILS_CACHE.get_or_fetch(key, fetch)
+
 # --- Jellyseerr Request Status Helper Functions ---
 def get_status_emoji(status_id):
     """Returns an emoji corresponding to the Jellyseerr request status."""
@@ -127,38 +388,37 @@ def get_status_emoji(status_id):
         5: "🎬 Available"
     }.get(status_id, "❓ Unknown")
 
-def create_request_embed(request: dict, current_index: int, total_results: int,
-                         jellyseerr_url: str, jellyseerr_headers: dict) -> discord.Embed:
+@traced()
+async def create_request_embed(request: RequestItem, current_index: int, total_results: int,
+                               jellyseerr: UpstreamClient) -> discord.Embed:
     """Creates a Discord embed for a media request, fetching additional details from Jellyseerr."""
-    media = request.get("media", {})
-    media_type = media.get("mediaType", "unknown")
-    tmdb_id = media.get("tmdbId")
+    media_type = request.media_type or "unknown"
+    tmdb_id = request.tmdb_id
 
     if not tmdb_id:
         return discord.Embed(title="Error", description="Request is missing a TMDB ID.", color=discord.Color.red())
 
+    status = get_status_emoji(request.status)
+    requested_date = (request.created_at or "N/A").split('T')[0]
+
     try:
-        endpoint = 'tv' if media_type == 'tv' else 'movie'
-        media_info_url = f"{jellyseerr_url}/api/v1/{endpoint}/{tmdb_id}" # Use passed-in jellyseerr_url
-        response = requests.get(media_info_url, headers=jellyseerr_headers)
-        response.raise_for_status()
-        media_info = response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching media details from {media_info_url}: {e}") # Log URL for debugging
-        return discord.Embed(title="Error", description="Could not fetch details for this request.", color=discord.Color.red())
-
-    if media_type == 'tv':
-        title = media_info.get("name", "Unknown Title")
-        date_str = media_info.get("firstAirDate", "")
-    else: # Default to movie
-        title = media_info.get("title", "Unknown Title")
-        date_str = media_info.get("releaseDate", "")
-
-    year = date_str.split('-')[0] if date_str else "Unknown Year"
-
-    status = get_status_emoji(request.get("status"))
-    requested_date = request.get("createdAt", "N/A").split('T')[0]
-    poster_path = media_info.get("posterPath")
+        media_info = await fetch_media_details(jellyseerr, media_type, tmdb_id)
+    except UpstreamError as e:
+        # Degrade to what the request itself says rather than replacing the page with an error.
+        print(f"Error fetching media details for {media_type} {tmdb_id}: {e}")
+        embed = discord.Embed(
+            title=f"{media_type.capitalize()} #{tmdb_id}",
+            description="⚠️ Details for this request are unavailable right now.",
+            color=discord.Color.orange()
+        )
+        embed.add_field(name="Status", value=status, inline=True)
+        embed.add_field(name="Requested On", value=requested_date, inline=False)
+        embed.set_footer(text=f"Request {current_index + 1} of {total_results}")
+        return embed
+
+    title = media_info.title or "Unknown Title"
+    year = media_info.year or "Unknown Year"
+    poster_path = media_info.poster_path
 
     embed = discord.Embed(
         title=f"{title} ({year})",
@@ -176,141 +436,4 @@ def create_request_embed(request: dict, current_index: int, total_results: int,
     embed.set_footer(text=f"Request {current_index + 1} of {total_results}")
     return embed
 
-# --- Pagination Views ---
-class PaginationView(View):
-    """A view for paginating through search results, allowing users to request media."""
-    def __init__(self, results: list, jellyseerr_url: str, jellyseerr_headers: dict):
-        super().__init__(timeout=300)
-        self.results = results
-        self.current_index = 0
-        self.total_results = len(results)
-        self.jellyseerr_url = jellyseerr_url
-        self.jellyseerr_headers = jellyseerr_headers
-        self.update_button_state()
-
-    def update_button_state(self):
-        """Disables/enables previous/next buttons based on the current index."""
-        # Assumes buttons are: Previous, Request, Next in self.children
-        if len(self.children) == 3:
-            prev_button = self.children[0]
-            next_button = self.children[2]
-            prev_button.disabled = self.current_index == 0
-            next_button.disabled = self.current_index >= self.total_results - 1
-
-
-    @button(label="⬅️ Previous", style=discord.ButtonStyle.secondary, custom_id="previous_media")
-    async def previous_button(self, interaction: discord.Interaction, button_obj: discord.ui.Button):
-        await interaction.response.defer()
-        if self.current_index > 0:
-            self.current_index -= 1
-            self.update_button_state()
-            embed = create_embed_for_item(self.results[self.current_index], self.current_index, self.total_results)
-            await interaction.edit_original_response(embed=embed, view=self)
-        # If already at the first item, the defer() handles the interaction acknowledgment.
-
-    @button(label="Request", style=discord.ButtonStyle.success, custom_id="request_media")
-    async def request_button(self, interaction: discord.Interaction, button_obj: discord.ui.Button):
-        item = self.results[self.current_index]
-        media_type = item.get("mediaType")
-        tmdb_id = item.get("id")
-
-        linked_user_data = get_linked_user(str(interaction.user.id))
-
-        if not linked_user_data or not linked_user_data[0]: # Jellyseerr User ID is the first element
-            await interaction.response.send_message("⚠️ You need to link your Discord account to a Jellyseerr user first using `/link`.", ephemeral=True)
-            return
-
-        jellyseerr_user_id = int(linked_user_data[0])
-        request_url = f"{self.jellyseerr_url}/api/v1/request"
-        payload = {
-            "mediaType": media_type,
-            "mediaId": tmdb_id,
-            "userId": jellyseerr_user_id,
-        }
-
-        if media_type == 'tv':
-            payload['seasons'] = 'all'
-
-        await interaction.response.defer(ephemeral=True)
-
-        try:
-            response = requests.post(request_url, headers=self.jellyseerr_headers, json=payload)
-            response.raise_for_status()
-            title = item.get("title") or item.get("name", "the selected item")
-            await interaction.followup.send(f"✅ Successfully requested '{title}'!", ephemeral=True)
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 409:
-                await interaction.followup.send("⚠️ This item is already available or has been requested.", ephemeral=True)
-            else:
-                error_details = "Could not parse error from Jellyseerr."
-                try:
-                    error_details = e.response.json().get('message', e.response.text)
-                except requests.exceptions.JSONDecodeError:
-                    error_details = e.response.text
-                await interaction.followup.send(f"❌ An error occurred: {e.response.status_code} - {error_details}", ephemeral=True)
-                print(f"Error requesting item: {e.response.text}")
-        except requests.exceptions.RequestException as e:
-            await interaction.followup.send(f"❌ A network error occurred: {e}", ephemeral=True)
-
-    @button(label="Next ➡️", style=discord.ButtonStyle.secondary, custom_id="next_media")
-    async def next_button(self, interaction: discord.Interaction, button_obj: discord.ui.Button):
-        await interaction.response.defer()
-        if self.current_index < self.total_results - 1:
-            self.current_index += 1
-            self.update_button_state()
-            embed = create_embed_for_item(self.results[self.current_index], self.current_index, self.total_results)
-            await interaction.edit_original_response(embed=embed, view=self)
-        # If already at the last item, the defer() handles the interaction acknowledgment.
-
-
-class RequestsPaginationView(View):
-    """A view for paginating through a user's media requests."""
-    def __init__(self, requests_data: list, jellyseerr_url: str, jellyseerr_headers: dict):
-        super().__init__(timeout=300)
-        self.requests_data = requests_data
-        self.current_index = 0
-        self.total_results = len(requests_data)
-        self.jellyseerr_url = jellyseerr_url
-        self.jellyseerr_headers = jellyseerr_headers
-        self.update_button_state()
-
-    def update_button_state(self):
-        """Disables/enables previous/next buttons based on the current index."""
-        # Assumes buttons are: Previous, Next in self.children
-        if len(self.children) >= 2:
-            prev_button = self.children[0]
-            next_button = self.children[1]
-            prev_button.disabled = self.current_index == 0
-            next_button.disabled = self.current_index >= self.total_results - 1
-
-    @button(label="⬅️ Previous", style=discord.ButtonStyle.secondary, custom_id="previous_request_status")
-    async def previous_button(self, interaction: discord.Interaction, button_obj: discord.ui.Button):
-        await interaction.response.defer()
-        if self.current_index > 0:
-            self.current_index -= 1
-            self.update_button_state()
-            embed = create_request_embed(
-                self.requests_data[self.current_index],
-                self.current_index,
-                self.total_results,
-                self.jellyseerr_url,
-                self.jellyseerr_headers
-            )
-            await interaction.edit_original_response(embed=embed, view=self)
-
-    @button(label="Next ➡️", style=discord.ButtonStyle.secondary, custom_id="next_request_status")
-    async def next_button(self, interaction: discord.Interaction, button_obj: discord.ui.Button):
-        await interaction.response.defer()
-        if self.current_index < self.total_results - 1:
-            self.current_index += 1
-            self.update_button_state()
-            embed = create_request_embed(
-                self.requests_data[self.current_index],
-                self.current_index,
-                self.total_results,
-                self.jellyseerr_url,
-                self.jellyseerr_headers
-            )
-            await interaction.edit_original_response(embed=embed, view=self)
-
 # End of utils.py
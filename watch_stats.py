@@ -0,0 +1,219 @@
+import asyncio
+import time
+from collections import namedtuple
+
+from cache import SingleFlight, note_stale
+from database import Database
+from leader import leadership
+from upstream import UpstreamClient, UpstreamError, priority, PREFETCH, BACKGROUND
+
+WATCH_PAGE_SIZE = 500 # Played items fetched per Jellyfin /Items page.
+FRESH_SECONDS = 60 # Stored statistics older than this (but within REFRESH_SECONDS) are refreshed after being served.
+REBUILD_SECONDS = 7 * 24 * 3600 # Full rebuild interval, picks up items that were marked unplayed.
+ACTIVE_SECONDS = 24 * 3600 # Users who ran /watch within this window are kept warm.
+REFRESH_SECONDS = 600 # Interval of the background refresher.
+
+WatchStats = namedtuple("WatchStats", "watched_count total_ticks last_item_name last_item_type last_series_name")
+
+class WatchStatsStore:
+    """Per-user /watch aggregates persisted in SQLite and maintained incrementally.
+
+    The played items of each user are kept as (item_id, run_time_ticks) rows so that re-watches are not
+    counted twice. On a refresh only items played since the stored high-water mark (LastPlayedDate) are
+    fetched from Jellyfin, newest first. A background task refreshes users who used /watch recently, so
+    their /watch is answered from the store and only refreshed afterwards; other users wait for the delta.
+    """
+    def __init__(self, jellyfin: UpstreamClient, db: Database):
+        self.jellyfin = jellyfin
+        self.db = db
+        self._flight = SingleFlight() # One refresh per user at a time
+        self._task = None
+        self._updates = set() # Background updates started by get()
+
+    def start(self):
+        if self._task is None:
+            with priority(BACKGROUND):
+                self._task = asyncio.create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._updates):
+            task.cancel()
+
+    def _items_params(self, **params) -> dict:
+        return {
+            "Recursive": "true", "IncludeItemTypes": "Movie,Episode", "Filters": "IsPlayed",
+            "EnableImages": "false", **params
+        }
+
+    async def _fetch_page(self, jellyfin_user_id: str, params: dict) -> dict:
+        return await self.jellyfin.get_json(f"/Users/{jellyfin_user_id}/Items", params=params, timeout=15)
+
+    # --- SQLite access ---
+    async def _load(self, jellyfin_user_id: str):
+        return await self.db.fetchone(
+            'SELECT watched_count, total_ticks, last_item_name, last_item_type, last_series_name, '
+            'high_water_mark, rebuilt_at, refreshed_at FROM watch_stats WHERE jellyfin_user_id=?',
+            (jellyfin_user_id,)
+        )
+
+    async def _touch(self, jellyfin_user_id: str):
+        await self.db.execute('UPDATE watch_stats SET requested_at=? WHERE jellyfin_user_id=?', (time.time(), jellyfin_user_id))
+
+    # --- Refreshing ---
+    async def _rebuild(self, jellyfin_user_id: str):
+        """Recomputes a user's statistics from scratch by paging through every played item."""
+        items, start_index = [], 0
+        while True:
+            page = await self._fetch_page(jellyfin_user_id, self._items_params(
+                EnableUserData="false", StartIndex=start_index, Limit=WATCH_PAGE_SIZE
+            ))
+            page_items = page.get("Items", [])
+            items.extend((item["Id"], item.get("RunTimeTicks") or 0) for item in page_items if item.get("Id"))
+            start_index += len(page_items)
+            if len(page_items) < WATCH_PAGE_SIZE or start_index >= page.get("TotalRecordCount", 0):
+                break
+        latest = (await self._fetch_page(jellyfin_user_id, self._items_params(
+            SortBy="DatePlayed", SortOrder="Descending", Limit=1, Fields="SeriesName"
+        ))).get("Items", [])
+        last_item = latest[0] if latest else {}
+        now = time.time()
+
+        def _store(conn):
+            conn.execute('DELETE FROM watch_items WHERE jellyfin_user_id=?', (jellyfin_user_id,))
+            conn.executemany(
+                'INSERT OR IGNORE INTO watch_items (jellyfin_user_id, item_id, run_time_ticks) VALUES (?, ?, ?)',
+                [(jellyfin_user_id, item_id, ticks) for item_id, ticks in items]
+            )
+            count, ticks = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(run_time_ticks), 0) FROM watch_items WHERE jellyfin_user_id=?',
+                (jellyfin_user_id,)
+            ).fetchone()
+            conn.execute('''
+                INSERT INTO watch_stats (jellyfin_user_id, watched_count, total_ticks, last_item_name, last_item_type,
+                                         last_series_name, high_water_mark, rebuilt_at, refreshed_at, requested_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(jellyfin_user_id) DO UPDATE SET
+                    watched_count=excluded.watched_count, total_ticks=excluded.total_ticks,
+                    last_item_name=excluded.last_item_name, last_item_type=excluded.last_item_type,
+                    last_series_name=excluded.last_series_name, high_water_mark=excluded.high_water_mark,
+                    rebuilt_at=excluded.rebuilt_at, refreshed_at=excluded.refreshed_at
+            ''', (jellyfin_user_id, count, ticks, last_item.get("Name"), last_item.get("Type"), last_item.get("SeriesName"),
+                  (last_item.get("UserData") or {}).get("LastPlayedDate") or "", now, now, now))
+        await self.db.transaction(_store)
+
+    async def _refresh(self, jellyfin_user_id: str, high_water_mark: str):
+        """Adds the items played since high_water_mark to a user's stored statistics."""
+        new_items, latest, start_index = [], None, 0
+        while True:
+            page = await self._fetch_page(jellyfin_user_id, self._items_params(
+                SortBy="DatePlayed", SortOrder="Descending", Fields="SeriesName",
+                StartIndex=start_index, Limit=WATCH_PAGE_SIZE
+            ))
+            page_items = page.get("Items", [])
+            reached_mark = False
+            for item in page_items:
+                played_at = (item.get("UserData") or {}).get("LastPlayedDate") or ""
+                if played_at <= high_water_mark:
+                    reached_mark = True
+                    break
+                latest = latest or item
+                if item.get("Id"):
+                    new_items.append((item["Id"], item.get("RunTimeTicks") or 0))
+            start_index += len(page_items)
+            if reached_mark or len(page_items) < WATCH_PAGE_SIZE:
+                break
+
+        def _store(conn):
+            added_count, added_ticks = 0, 0
+            for item_id, ticks in new_items:
+                inserted = conn.execute(
+                    'INSERT OR IGNORE INTO watch_items (jellyfin_user_id, item_id, run_time_ticks) VALUES (?, ?, ?)',
+                    (jellyfin_user_id, item_id, ticks)
+                ).rowcount
+                added_count += inserted
+                added_ticks += ticks if inserted else 0
+            if latest:
+                conn.execute('''
+                    UPDATE watch_stats SET watched_count=watched_count+?, total_ticks=total_ticks+?,
+                        last_item_name=?, last_item_type=?, last_series_name=?, high_water_mark=?, refreshed_at=?
+                    WHERE jellyfin_user_id=?
+                ''', (added_count, added_ticks, latest.get("Name"), latest.get("Type"), latest.get("SeriesName"),
+                      latest["UserData"]["LastPlayedDate"], time.time(), jellyfin_user_id))
+            else:
+                conn.execute('UPDATE watch_stats SET refreshed_at=? WHERE jellyfin_user_id=?', (time.time(), jellyfin_user_id))
+        await self.db.transaction(_store)
+
+    async def _update(self, jellyfin_user_id: str, max_age: float):
+        row = await self._load(jellyfin_user_id)
+        now = time.time()
+        if row is None or now - (row[6] or 0) >= REBUILD_SECONDS:
+            await self._rebuild(jellyfin_user_id)
+        elif now - (row[7] or 0) >= max_age:
+            await self._refresh(jellyfin_user_id, row[5] or "")
+
+    async def update(self, jellyfin_user_id: str, max_age: float = None):
+        """Brings a user's stored statistics up to date if they are older than max_age (default FRESH_SECONDS)."""
+        max_age = FRESH_SECONDS if max_age is None else max_age
+        await self._flight.do(jellyfin_user_id, lambda: self._update(jellyfin_user_id, max_age))
+
+    async def get(self, jellyfin_user_id: str) -> WatchStats:
+        """Returns a user's watch statistics, fetching only what was played since the last refresh.
+
+        Statistics refreshed within REFRESH_SECONDS (the window the background refresher keeps warm) are
+        served from the store and, if older than FRESH_SECONDS, brought up to date in the background.
+        Older statistics wait for the update; if Jellyfin can't be reached they are served marked stale.
+        """
+        row = await self._load(jellyfin_user_id)
+        if row is None:
+            await self.update(jellyfin_user_id)
+            row = await self._load(jellyfin_user_id)
+        else:
+            now = time.time()
+            if now - (row[7] or 0) >= REFRESH_SECONDS:
+                try:
+                    await self.update(jellyfin_user_id)
+                except UpstreamError as e:
+                    print(f"Failed to refresh watch statistics for Jellyfin user {jellyfin_user_id}: {e}")
+                    note_stale("watch_stats")
+                else:
+                    row = await self._load(jellyfin_user_id)
+            elif now - (row[7] or 0) >= FRESH_SECONDS or now - (row[6] or 0) >= REBUILD_SECONDS:
+                self._update_later(jellyfin_user_id)
+        await self._touch(jellyfin_user_id)
+        return WatchStats(*row[:5])
+
+    def _update_later(self, jellyfin_user_id: str):
+        with priority(PREFETCH):
+            task = asyncio.create_task(self._update_quietly(jellyfin_user_id))
+        self._updates.add(task)
+        task.add_done_callback(self._updates.discard)
+
+    async def _update_quietly(self, jellyfin_user_id: str):
+        try:
+            await self.update(jellyfin_user_id)
+        except UpstreamError as e:
+            print(f"Failed to refresh watch statistics for Jellyfin user {jellyfin_user_id}: {e}")
+
+    async def refresh_active_users(self):
+        """Refreshes every user who requested their statistics within ACTIVE_SECONDS."""
+        rows = await self.db.fetchall(
+            'SELECT jellyfin_user_id FROM watch_stats WHERE requested_at >= ?', (time.time() - ACTIVE_SECONDS,)
+        )
+        for (jellyfin_user_id,) in rows:
+            try:
+                await self.update(jellyfin_user_id, max_age=REFRESH_SECONDS / 2)
+            except UpstreamError as e:
+                print(f"Failed to refresh watch statistics for Jellyfin user {jellyfin_user_id}: {e}")
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(REFRESH_SECONDS)
+            if not leadership.is_leader:
+                continue # Another worker keeps the statistics warm.
+            try:
+                await self.refresh_active_users()
+            except Exception as e:
+                print(f"An unexpected error occurred while refreshing watch statistics: {e}")
@@ -0,0 +1,192 @@
+import asyncio
+import hmac
+import ipaddress
+from collections import OrderedDict
+
+import discord
+from aiohttp import web
+
+from media_index import media_status, PROCESSING, AVAILABLE
+from utils import TMDB_IMAGE_BASE_URL, find_linked_discord_ids, get_linked_user
+
+WEBHOOK_PATH = "/webhooks/jellyseerr"
+DM_BATCH_WINDOW_SECONDS = 2 # Notifications for the same user within this window are sent as one DM.
+DM_INTERVAL_SECONDS = 0.5 # Minimum interval between DMs, well under Discord's DM rate limits.
+MAX_EMBEDS_PER_DM = 10 # Discord's limit on embeds per message.
+
+# Jellyseerr notification types that are forwarded to the requesting user, with the embed shown for each.
+NOTIFICATIONS = {
+    "MEDIA_APPROVED": ("✅ Request Approved", discord.Color.green()),
+    "MEDIA_AUTO_APPROVED": ("✅ Request Approved", discord.Color.green()),
+    "MEDIA_AVAILABLE": ("🎬 Now Available", discord.Color.blue()),
+    "MEDIA_DECLINED": ("❌ Request Declined", discord.Color.red()),
+    "MEDIA_FAILED": ("⚠️ Request Failed", discord.Color.orange()),
+}
+# Media status implied by a notification, written through to the media status index.
+NOTIFICATION_STATUS = {
+    "MEDIA_APPROVED": PROCESSING,
+    "MEDIA_AUTO_APPROVED": PROCESSING,
+    "MEDIA_AVAILABLE": AVAILABLE,
+}
+
+def is_loopback(host: str) -> bool:
+    """Returns whether a listen address only accepts connections from this machine."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class DMSender:
+    """Sends direct messages from a queue, batching notifications per user and pacing the sends.
+
+    Notifications queued for the same user within DM_BATCH_WINDOW_SECONDS go out as one message with
+    up to MAX_EMBEDS_PER_DM embeds, and consecutive DMs are spaced by DM_INTERVAL_SECONDS.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self._pending = OrderedDict() # discord_id -> [embeds], in order of the first notification
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._send_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def send(self, discord_id: str, embed: discord.Embed):
+        self._pending.setdefault(str(discord_id), []).append(embed)
+        self._wakeup.set()
+
+    async def _send_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Give closely spaced notifications (e.g. approved, then available) time to be batched.
+            await asyncio.sleep(DM_BATCH_WINDOW_SECONDS)
+            self._wakeup.clear()
+            while self._pending:
+                discord_id, embeds = self._pending.popitem(last=False)
+                for start in range(0, len(embeds), MAX_EMBEDS_PER_DM):
+                    await self._send(discord_id, embeds[start:start + MAX_EMBEDS_PER_DM])
+                    await asyncio.sleep(DM_INTERVAL_SECONDS)
+
+    async def _send(self, discord_id: str, embeds: list):
+        try:
+            user = self.bot.get_user(int(discord_id)) or await self.bot.fetch_user(int(discord_id))
+            await user.send(embeds=embeds)
+            self.sent += 1
+        except discord.Forbidden:
+            self.failed += 1
+            print(f"Cannot DM user {discord_id} (DMs closed), dropping {len(embeds)} notification(s).")
+        except discord.HTTPException as e:
+            self.failed += 1
+            print(f"Failed to DM user {discord_id}: {e}")
+
+
+class WebhookServer:
+    """An embedded HTTP listener for Jellyseerr webhook notifications.
+
+    Configure a Jellyseerr webhook agent with the URL http://<bot host>:<port>/webhooks/jellyseerr, the
+    default JSON payload and WEBHOOK_SECRET as its Authorization header. Request notifications are
+    mapped to linked users and sent to them as DMs. The secret is only optional while the listener
+    binds to a loopback address, otherwise anyone reaching the port could post notifications.
+    """
+    def __init__(self, bot, host: str, port: int, secret: str = None):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.sender = DMSender(bot)
+        self._runner = None
+        self._events = asyncio.Queue() # Processed in arrival order by a single worker
+        self._worker = None
+        self.received = 0
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.sender.start()
+        self._worker = asyncio.create_task(self._process_loop())
+        print(f"Listening for Jellyseerr webhooks on {self.host}:{self.port}{WEBHOOK_PATH}")
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self.sender.stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get("Authorization", ""), self.secret):
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Invalid JSON")
+        if not isinstance(payload, dict):
+            return web.Response(status=400, text="Expected a JSON object")
+        self.received += 1
+        # Answer Jellyseerr straight away, the notification is processed in the background.
+        self._events.put_nowait(payload)
+        return web.Response(status=202)
+
+    async def _process_loop(self):
+        while True:
+            payload = await self._events.get()
+            try:
+                await self._process(payload)
+            except Exception as e:
+                print(f"An unexpected error occurred while processing a Jellyseerr webhook: {e}")
+
+    async def _process(self, payload: dict):
+        notification_type = payload.get("notification_type")
+        if notification_type == "TEST_NOTIFICATION":
+            print("Received a Jellyseerr test notification.")
+            return
+        media = payload.get("media") or {}
+        status = NOTIFICATION_STATUS.get(notification_type)
+        if status and media.get("tmdbId") and media.get("media_type"):
+            await media_status.mark(media["media_type"], media["tmdbId"], status)
+        if notification_type not in NOTIFICATIONS:
+            return
+
+        request = payload.get("request") or {}
+        discord_ids = await self._recipients(request)
+        if not discord_ids:
+            return
+        embed = self._embed(notification_type, payload)
+        for discord_id in discord_ids:
+            self.sender.send(discord_id, embed)
+
+    async def _recipients(self, request: dict) -> set:
+        """Returns the linked Discord users to notify about a request."""
+        discord_ids = set(await find_linked_discord_ids(request.get("requestedBy_username")))
+        # Jellyseerr users can also store their Discord ID in their notification settings.
+        notify_id = request.get("requestedBy_settings_discordId")
+        if notify_id and await get_linked_user(str(notify_id)):
+            discord_ids.add(str(notify_id))
+        return discord_ids
+
+    def _embed(self, notification_type: str, payload: dict) -> discord.Embed:
+        title, color = NOTIFICATIONS[notification_type]
+        embed = discord.Embed(
+            title=title,
+            description=f"**{payload.get('subject') or 'Your request'}**\n{payload.get('message') or ''}".strip(),
+            color=color
+        )
+        image = payload.get("image")
+        if image:
+            embed.set_thumbnail(url=image if image.startswith("http") else f"{TMDB_IMAGE_BASE_URL}{image}")
+        return embed